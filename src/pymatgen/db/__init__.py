@@ -20,6 +20,8 @@ SETTINGS_FILE = os.path.join(os.path.expanduser("~"), ".pmgrc.yaml")
 
 
 def _load_mgdb_settings():
+    if not os.path.exists(SETTINGS_FILE):
+        return {}
     try:
         from ruamel.yaml import YAML
 
@@ -31,4 +33,11 @@ def _load_mgdb_settings():
     return d
 
 
-SETTINGS = _load_mgdb_settings()
+def __getattr__(name):
+    # SETTINGS is loaded on first access rather than at import, so that
+    # importing pymatgen.db does not parse ~/.pmgrc.yaml or import ruamel.
+    if name == "SETTINGS":
+        settings = _load_mgdb_settings()
+        globals()["SETTINGS"] = settings
+        return settings
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
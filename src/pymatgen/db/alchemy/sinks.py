@@ -0,0 +1,125 @@
+"""
+This module implements sinks that store TransformedStructures generated by
+the transmuters in a Mongo collection for later screening.
+"""
+
+from __future__ import annotations
+
+import datetime
+import logging
+
+from pymatgen.alchemy.materials import TransformedStructure
+from pymatgen.analysis.structure_matcher import StructureMatcher
+from pymatgen.core import Structure
+
+from pymatgen.db.cache import bump_generation
+from pymatgen.db.fingerprint import fingerprint_neighbors, structure_fingerprint
+
+_log = logging.getLogger("mg.alchemy.sinks")
+
+
+class MongoStructureSink:
+    """
+    Writes TransformedStructures to a Mongo collection in batches, skipping
+    duplicates of structures that are already in the collection or earlier in
+    the stream.
+
+    Each doc is the TransformedStructure dict plus a "fingerprint" (see
+    pymatgen.db.fingerprint) and a "pretty_formula". Candidate duplicates are
+    looked up by fingerprint, which is indexed, and only those candidates are
+    compared with the StructureMatcher.
+
+    Usage::
+
+        with MongoStructureSink(db.candidates) as sink:
+            for ts in transmuter:
+                sink.add(ts)
+        print(sink.ninserted, sink.nduplicates)
+    """
+
+    def __init__(self, collection, batch_size=500, matcher=None, dedupe=True):
+        """
+        Args:
+            collection: pymongo Collection to write to.
+            batch_size: Number of structures per insert_many.
+            matcher: StructureMatcher used to confirm duplicates within a
+                fingerprint bucket. Defaults to StructureMatcher(). Use False
+                to treat structures with identical fingerprints as duplicates
+                without matching.
+            dedupe: Whether to skip duplicates at all.
+        """
+        self.collection = collection
+        self.batch_size = batch_size
+        self.matcher = StructureMatcher() if matcher is None else matcher
+        self.dedupe = dedupe
+        self.ninserted = 0
+        self.nduplicates = 0
+        self._buffer = []
+        self.collection.create_index("fingerprint")
+
+    def add(self, transformed_structure, fingerprint=None):
+        """
+        Add a TransformedStructure. It is written when the batch is full.
+
+        Args:
+            transformed_structure: TransformedStructure.
+            fingerprint: Precomputed fingerprint of its final structure, e.g.
+                computed in a worker process. Computed here if not given.
+        """
+        if fingerprint is None:
+            fingerprint = structure_fingerprint(transformed_structure.final_structure)
+        self._buffer.append((transformed_structure, fingerprint))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def _is_duplicate(self, structure, fingerprint, candidates):
+        if not self.matcher:
+            return any(fp == fingerprint for fp, _ in candidates)
+        return any(self.matcher.fit(structure, other) for _, other in candidates)
+
+    def flush(self):
+        """Write the buffered structures."""
+        if not self._buffer:
+            return
+        buckets = {}
+        if self.dedupe:
+            fingerprints = {n for _, fp in self._buffer for n in fingerprint_neighbors(fp)}
+            for doc in self.collection.find({"fingerprint": {"$in": list(fingerprints)}}, {"history": 0}):
+                buckets.setdefault(doc["fingerprint"], []).append(Structure.from_dict(doc))
+
+        docs = []
+        now = datetime.datetime.utcnow()
+        for ts, fp in self._buffer:
+            structure = ts.final_structure
+            if self.dedupe:
+                candidates = [(n, s) for n in fingerprint_neighbors(fp) for s in buckets.get(n, [])]
+                if self._is_duplicate(structure, fp, candidates):
+                    self.nduplicates += 1
+                    continue
+                buckets.setdefault(fp, []).append(structure)
+            doc = ts.as_dict()
+            doc["fingerprint"] = fp
+            doc["pretty_formula"] = structure.composition.reduced_formula
+            doc["created_at"] = now
+            docs.append(doc)
+        if docs:
+            self.collection.insert_many(docs, ordered=False)
+            bump_generation(self.collection.database, self.collection.name)
+        self.ninserted += len(docs)
+        _log.info(f"Inserted {len(docs)} structures, skipped {len(self._buffer) - len(docs)} duplicates.")
+        self._buffer = []
+
+    def close(self):
+        """Flush the remaining structures."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def get_transformed_structure(doc):
+        """Convert a doc written by the sink back to a TransformedStructure."""
+        return TransformedStructure.from_dict({k: v for k, v in doc.items() if k != "_id"})
@@ -14,9 +14,19 @@ __email__ = "shyue@mit.edu"
 __date__ = "Mar 4, 2012"
 
 import datetime
+import json
+import multiprocessing
+import os
+import re
 
+from monty.io import zopen
 from pymatgen.alchemy.materials import TransformedStructure
 from pymatgen.alchemy.transmuters import StandardTransmuter
+from pymatgen.io.vasp.sets import MPRelaxSet
+
+from pymatgen.db.alchemy.sinks import MongoStructureSink
+from pymatgen.db.export import chunked
+from pymatgen.db.fingerprint import structure_fingerprint
 
 
 class QeTransmuter(StandardTransmuter):
@@ -68,3 +78,160 @@ class QeTransmuter(StandardTransmuter):
             extend_collection=extend_collection,
             ncores=ncores,
         )
+
+
+def _transform(args):
+    """
+    Apply transformations to one structure. Module level so that it can be
+    used with multiprocessing.Pool.
+    """
+    structure, history, transformations, extend_collection = args
+    transformed_structures = [TransformedStructure(structure, [], history=history)]
+    for trans in transformations:
+        new = []
+        for ts in transformed_structures:
+            new += ts.append_transformation(trans, extend_collection) or []
+        transformed_structures += new
+    return transformed_structures
+
+
+def _transform_and_fingerprint(args):
+    """Apply transformations and fingerprint the results, so that the writer process only has to dedupe."""
+    return [(ts, structure_fingerprint(ts.final_structure)) for ts in _transform(args)]
+
+
+class StreamingQeTransmuter:
+    """
+    A memory-bounded alternative to QeTransmuter for large queries. Entries
+    are read from the QueryEngine cursor in chunks, the transformations are
+    applied chunk by chunk (optionally in a process pool), and the resulting
+    TransformedStructures are yielded or written out as they are produced,
+    so that only one chunk is in memory at any time.
+
+    The history of each TransformedStructure records a reference to the
+    source task (database, criteria and task_id) rather than the entire entry.
+    """
+
+    def __init__(self, queryengine, criteria, transformations, extend_collection=0, ncores=None, chunk_size=100):
+        """Constructor.
+
+        Args:
+            queryengine:
+                QueryEngine object for database access
+            criteria:
+                A criteria to search on, which is passed to queryengine's
+                iter_entries method.
+            transformations:
+                New transformations to be applied to all structures
+            extend_collection:
+                Whether to use more than one output structure from one-to-many
+                transformations. extend_collection can be a number, which
+                determines the maximum branching for each transformation.
+            ncores:
+                Number of cores to use for applying transformations.
+                Uses multiprocessing.Pool. None means serial.
+            chunk_size:
+                Number of source structures transformed at a time. Also used
+                as the cursor batch size.
+        """
+        self.queryengine = queryengine
+        self.criteria = criteria
+        self.transformations = list(transformations)
+        self.extend_collection = extend_collection
+        self.ncores = ncores
+        self.chunk_size = chunk_size
+
+    def _jobs(self):
+        qe = self.queryengine
+        source = f"{qe.host}:{qe.port}/{qe.database_name}/{qe.collection_name}"
+        for entry in qe.iter_entries(self.criteria, inc_structure=True, batch_size=self.chunk_size):
+            history = [
+                {
+                    "source": source,
+                    "criteria": self.criteria,
+                    "task_id": entry.entry_id,
+                    "datetime": datetime.datetime.utcnow(),
+                }
+            ]
+            yield entry.structure, history, self.transformations, self.extend_collection
+
+    def _run(self, func):
+        pool = multiprocessing.Pool(self.ncores) if self.ncores else None
+        try:
+            for chunk in chunked(self._jobs(), self.chunk_size):
+                results = pool.map(func, chunk) if pool else map(func, chunk)
+                for transformed_structures in results:
+                    yield from transformed_structures
+        finally:
+            if pool:
+                pool.terminate()
+
+    def __iter__(self):
+        """Yield TransformedStructures as they are generated."""
+        return self._run(_transform)
+
+    def write_to_collection(self, collection, batch_size=500, matcher=None, dedupe=True):
+        """
+        Store the transformed structures in a Mongo collection, skipping duplicates.
+        See MongoStructureSink.
+
+        The transformations and the structure fingerprints are computed by the
+        worker processes, whose results are queued to this process, the single
+        writer, which dedupes against the collection and inserts in batches.
+
+        Args:
+            collection: pymongo Collection to write to.
+            batch_size: Number of structures per insert_many.
+            matcher: StructureMatcher used to confirm duplicates. See MongoStructureSink.
+            dedupe: Whether to skip duplicates.
+
+        Returns:
+            The MongoStructureSink, whose ninserted and nduplicates attributes
+            summarize the run.
+        """
+        with MongoStructureSink(collection, batch_size=batch_size, matcher=matcher, dedupe=dedupe) as sink:
+            for ts, fingerprint in self._run(_transform_and_fingerprint):
+                sink.add(ts, fingerprint)
+        return sink
+
+    def write_vasp_input(
+        self, vasp_input_set=MPRelaxSet, output_dir=".", create_directory=True, subfolder=None, **kwargs
+    ):
+        """
+        Write vasp input for each transformed structure as it is generated, following the
+        format output_dir/{formula}_{number}, as in pymatgen's batch_write_vasp_input.
+
+        Args:
+            vasp_input_set: pymatgen.io.vasp.sets.VaspInputSet to create vasp input files from structures.
+            output_dir: Directory to output files.
+            create_directory: Create the directory if not present. Defaults to True.
+            subfolder: Function to create subdirectory name from transformed_structure.
+            **kwargs: Any kwargs supported by vasp_input_set.
+
+        Returns:
+            Number of transformed structures written.
+        """
+        n = 0
+        for n, ts in enumerate(self, 1):
+            formula = re.sub(r"\s+", "", ts.final_structure.formula)
+            dirname = os.path.join(output_dir, subfolder(ts) if subfolder else "", f"{formula}_{n - 1}")
+            ts.write_vasp_input(vasp_input_set, dirname, create_directory=create_directory, **kwargs)
+        return n
+
+    def write_json(self, filename):
+        """
+        Write the transformed structures as JSON lines, one TransformedStructure dict per line,
+        as they are generated. The file is compressed if filename ends with .gz, .bz2, etc.
+
+        Args:
+            filename: Output filename.
+
+        Returns:
+            Number of transformed structures written.
+        """
+        n = 0
+        with zopen(filename, "wt") as f:
+            for ts in self:
+                f.write(json.dumps(ts.as_dict()) + "\n")
+                n += 1
+        return n
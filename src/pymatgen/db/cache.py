@@ -0,0 +1,234 @@
+"""
+Caching of query results for QueryEngine.
+
+A QueryCache stores the (mapped) results of QueryEngine.query and the
+entries of QueryEngine.get_entries in a pluggable backend, MemoryCache (an
+LRU dict) or DiskCache (a directory of pickle files that can be shared by
+several processes). Keys are hashes of the parsed criteria, projection and
+cursor options, so equivalent queries written with aliases or in another key
+order share an entry.
+
+Entries are invalidated when the collection is written to. Writers, such as
+VaspToDbTaskDrone, pymatgen.db.synth.insert_docs, MPDB.create and sync, and
+MongoStructureSink, call bump_generation after each write, which increments
+a counter doc in the "counter" collection (next to the task id counter). The
+current generation is part of every key, so stale entries are never read and
+age out of the backend. Entries also expire after a TTL.
+
+Usage::
+
+    qe = QueryEngine(..., cache=QueryCache(MemoryCache(maxsize=2048), ttl=3600))
+    qe.query(["task_id", "energy"], {"chemsys": "Li-O"})  # cached
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from bson import json_util
+
+#: Suffix of the generation counter doc id of a collection.
+GENERATION_SUFFIX = "_generation"
+
+
+def _generation_id(collection_name):
+    return f"{collection_name}{GENERATION_SUFFIX}"
+
+
+def bump_generation(db, collection_name):
+    """
+    Invalidate the cached query results of a collection. Call after writing to it.
+
+    Args:
+        db: pymongo Database.
+        collection_name: Name of the collection that was written to.
+    """
+    db.counter.update_one({"_id": _generation_id(collection_name)}, {"$inc": {"c": 1}}, upsert=True)
+
+
+def get_generation(db, collection_name):
+    """Current generation of a collection, 0 if it was never bumped."""
+    doc = db.counter.find_one({"_id": _generation_id(collection_name)})
+    return doc["c"] if doc else 0
+
+
+class MemoryCache:
+    """
+    In-memory LRU cache backend. Values are stored pickled, so callers get a
+    fresh copy on every hit and can modify it freely. Thread-safe.
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        Args:
+            maxsize: Maximum number of entries.
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Value for a key, or None if it is missing or expired."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, data = item
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+        return pickle.loads(data)
+
+    def set(self, key, value, ttl=None):
+        """Store a value, expiring after ttl seconds, or never if ttl is None."""
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._data[key] = (expires, data)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """
+    On-disk cache backend storing one pickle file per entry. Files are
+    written atomically, so several processes, e.g. the workers of a web
+    frontend, can share a directory. Expired entries are removed when read;
+    entries of older generations are never read again, so clear or prune the
+    directory from time to time.
+    """
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory: Directory to store the entries in. Created if needed.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pkl")
+
+    def get(self, key):
+        """Value for a key, or None if it is missing or expired."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                expires, value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires is not None and expires < time.time():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store a value, expiring after ttl seconds, or never if ttl is None."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        expires = None if ttl is None else time.time() + ttl
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def clear(self):
+        """Remove all entries."""
+        for name in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+
+class QueryCache:
+    """Query result cache for QueryEngine. See the module docstring."""
+
+    def __init__(self, backend=None, ttl=3600, max_results=10000, generation_check_interval=0):
+        """
+        Args:
+            backend: MemoryCache, DiskCache or any object with the same get,
+                set and clear methods. Defaults to MemoryCache().
+            ttl: Seconds after which entries expire. None for no expiry, so
+                that only writes invalidate entries.
+            max_results: Queries with more results are not cached, and are
+                streamed as usual.
+            generation_check_interval: Seconds for which the generation of a
+                collection is reused before it is read again. 0 reads it for
+                every query, i.e. one find_one by _id, so writes are seen
+                immediately. A few seconds saves the round trip on busy
+                frontends.
+        """
+        self.backend = MemoryCache() if backend is None else backend
+        self.ttl = ttl
+        self.max_results = max_results
+        self.generation_check_interval = generation_check_interval
+        self._generations = {}
+        #: Number of cache hits and misses.
+        self.hits = self.misses = 0
+
+    def generation(self, collection):
+        """Current generation of a pymongo Collection."""
+        key = collection.full_name
+        now = time.monotonic()
+        cached = self._generations.get(key)
+        if cached is not None and now - cached[0] < self.generation_check_interval:
+            return cached[1]
+        generation = get_generation(collection.database, collection.name)
+        self._generations[key] = (now, generation)
+        return generation
+
+    def make_key(self, namespace, collection, *parts):
+        """
+        Cache key for a query.
+
+        Args:
+            namespace: Identifies the server, e.g. "host:port".
+            collection: pymongo Collection queried.
+            *parts: Anything identifying the query, e.g. the parsed criteria
+                and projection. Must be encodable by bson.json_util. Dict keys
+                are sorted, so their order does not matter.
+        """
+        text = json_util.dumps(
+            [namespace, collection.full_name, self.generation(collection), *parts], sort_keys=True, default=str
+        )
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Cached value for a key, or None."""
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Cache a value."""
+        self.backend.set(key, value, ttl=self.ttl)
+
+    def clear(self):
+        """Remove all entries."""
+        self.backend.clear()
+        self._generations.clear()
@@ -9,15 +9,11 @@ import logging
 import multiprocessing
 import sys
 
-from pymongo import ASCENDING, MongoClient
-
-from pymatgen.apps.borg.queen import BorgQueen
-from pymatgen.db import SETTINGS
+from pymongo import ASCENDING, DESCENDING, MongoClient
 
 from .config import DBConfig, get_settings
-from .creator import VaspToDbTaskDrone
-from .query_engine import QueryEngine
-from .util import MongoJSONEncoder
+from .query_engine import CHANGES_SORT, QueryEngine
+from .util import JSON_SERIALIZERS
 
 _log = logging.getLogger("mg")  # parent
 
@@ -75,6 +71,10 @@ def update_db(args):
             - author: Name of the author to include in the task (Optional[str])
             - tag: Tags to append to the tasks in the database (Optional[list[str]])
             - parse_dos: Boolean indicating whether to parse density of states (bool)
+            - ionic_step_skip: Only parse every n-th ionic step (Optional[int])
+            - arrays_to_gridfs: Store large arrays in gridfs in binary form (bool)
+            - offload_threshold: Size in bytes above which doc fields are moved to gridfs (Optional[int])
+            - dos_codec: Codec to compress the DOS with (Optional[str])
             - force_update_dupes: Boolean to indicate updating duplicates in the database (bool)
             - ncpus: Number of CPUs to use for parallel processing (Optional[int])
             - directory: Directory path with task data to assimilate (str)
@@ -82,6 +82,11 @@ def update_db(args):
     Supported types for attributes are either explicitly stated in the function's input
     or inferred through parameter type hints.
     """
+    # The drone pulls in most of pymatgen, so only import it when inserting.
+    from pymatgen.apps.borg.queen import BorgQueen
+
+    from .creator import VaspToDbTaskDrone
+
     FORMAT = "%(relativeCreated)d msecs : %(message)s"
 
     if args.logfile:
@@ -104,6 +109,10 @@ def update_db(args):
         update_duplicates=args.force_update_dupes,
         additional_fields=additional_fields,
         mapi_key=d.get("mapi_key", None),
+        ionic_step_skip=args.ionic_step_skip,
+        arrays_to_gridfs=args.arrays_to_gridfs,
+        offload_threshold=args.offload_threshold,
+        dos_codec=args.dos_codec,
     )
     ncpus = multiprocessing.cpu_count() if not args.ncpus else args.ncpus
     _log.info(f"Using {ncpus} cpus...")
@@ -114,6 +123,68 @@ def update_db(args):
     _log.info(f"{len(tids)} new task ids inserted.")
 
 
+def synth_db(args):
+    """
+    Generate synthetic task documents and bulk load them into the database.
+
+    The documents follow the VaspToDbTaskDrone schema and are generated and
+    inserted in parallel by worker processes. See pymatgen.db.synth.
+
+    Arguments:
+        args: argparse.Namespace
+            A namespace object containing the following attributes:
+            - config_file: Path to the configuration file (str)
+            - count: Number of docs to generate (int)
+            - elements: Element symbols, optionally weighted as "Fe:2" (list[str])
+            - nelements: Min and max number of elements per structure (list[int])
+            - nsites: Min and max number of sites per structure (list[int])
+            - ionic_steps: Number of ionic steps per calculation (int)
+            - dos_npoints: Number of DOS energy points, 0 for no DOS (int)
+            - compress_dos: zlib compression level for the DOS (int)
+            - dos_codec: Codec to compress the DOS with (Optional[str])
+            - tag: Tags to add to the generated docs (list[str])
+            - ncpus: Number of worker processes (Optional[int])
+            - chunk_size: Number of docs per insert batch (int)
+            - seed: Random seed (Optional[int])
+    """
+    from .synth import TaskDocGenerator, bulk_load
+
+    logging.basicConfig(level=logging.INFO, format="%(relativeCreated)d msecs : %(message)s")
+    d = get_settings(args.config_file)
+    elements = None
+    if args.elements:
+        elements = {}
+        for token in args.elements:
+            el, _, weight = token.partition(":")
+            elements[el] = float(weight) if weight else 1.0
+    generator = TaskDocGenerator(
+        elements=elements,
+        nelements=tuple(args.nelements),
+        nsites=tuple(args.nsites),
+        nionic_steps=args.ionic_steps,
+        dos_npoints=args.dos_npoints,
+        additional_fields={"tags": ["synthetic", *args.tag]},
+    )
+    start = datetime.datetime.now()
+    n = bulk_load(
+        generator,
+        args.count,
+        host=d["host"],
+        port=d["port"],
+        database=d["database"],
+        collection=d["collection"],
+        user=d.get("admin_user"),
+        password=d.get("admin_password"),
+        compress_dos=args.compress_dos,
+        dos_codec=args.dos_codec,
+        ncpus=args.ncpus,
+        chunk_size=args.chunk_size,
+        seed=args.seed,
+    )
+    elapsed = (datetime.datetime.now() - start).total_seconds()
+    _log.info(f"{n} synthetic tasks inserted in {elapsed:.1f} s ({n / max(elapsed, 1e-6):.0f} docs/s).")
+
+
 def optimize_indexes(args):
     """
     Optimize indexes for a MongoDB collection based on provided configuration.
@@ -122,7 +193,8 @@ def optimize_indexes(args):
     the MongoDB instance, and modifies the indexes for a specified collection.
     It removes all existing indexes, creates a unique index on the "task_id" field,
     and builds indexes on a predefined set of fields. Additionally, it creates
-    a compound index based on "nelements" and "elements".
+    a compound index based on "nelements" and "elements", and one on
+    "last_updated" and "_id" for QueryEngine.query_since.
 
     Parameters:
         args (argparse.Namespace): The arguments provided to the function,
@@ -149,6 +221,7 @@ def optimize_indexes(args):
         "pretty_formula",
         "analysis.e_above_hull",
         "icsd_ids",
+        "fingerprint",
     ]:
         print(f"Building {key} index")
         coll.ensure_index(key)
@@ -156,62 +229,229 @@ def optimize_indexes(args):
     compound_index = [("nelements", ASCENDING), ("elements", ASCENDING)]
     coll.ensure_index(compound_index)
     coll.ensure_index(compound_index)
+    print("Building last_updated index for incremental pulls")
+    coll.ensure_index(CHANGES_SORT)
 
 
-def query_db(args):
-    """
-    Query the database based on specified properties and criteria, and output the
-    results in either JSON format or as a tabulated table. The function retrieves
-    database connection settings, initializes a query engine, processes input
-    parameters, and executes a query with the provided properties and criteria.
-
-    Parameters:
-        args: argparse.Namespace
-            Command-line arguments containing configuration file path, query
-            criteria, database properties, and output format options.
-
-    Raises:
-        SystemExit
-            Raised when the specified criteria argument is not a valid JSON string.
-    """
-    from tabulate import tabulate
-
-    d = get_settings(args.config_file)
-    qe = QueryEngine(
+def _get_query_engine(config_file, use_admin=False):
+    cfg = DBConfig(config_file)
+    d = cfg.settings
+    return QueryEngine(
         host=d["host"],
         port=d["port"],
         database=d["database"],
-        user=d["readonly_user"],
-        password=d["readonly_password"],
+        user=d.get("admin_user", d["readonly_user"]) if use_admin else d["readonly_user"],
+        password=d.get("admin_password", d["readonly_password"]) if use_admin else d["readonly_password"],
         collection=d["collection"],
         aliases_config=d.get("aliases_config", None),
+        offload_fs=d.get("offload_fs", None),
+        **cfg.connection_options,
     )
-    criteria = None
-    if args.criteria:
-        try:
-            criteria = json.loads(args.criteria)
-        except ValueError:
-            print(f"Criteria {args.criteria} is not a valid JSON string!")
-            sys.exit(-1)
+
+
+def _get_criteria(args):
+    if not args.criteria:
+        return None
+    try:
+        return json.loads(args.criteria)
+    except ValueError:
+        print(f"Criteria {args.criteria} is not a valid JSON string!")
+        sys.exit(-1)
+
+
+def _get_criteria_and_properties(args):
+    criteria = _get_criteria(args)
 
     # TODO: document this 'feature' --dang 4/4/2013
     def is_a_file(s):
         return len(s) == 1 and s[0].startswith(":")
 
     if is_a_file(args.properties):
-        with open(args.properties[0][1:], "rb") as f:
+        with open(args.properties[0][1:]) as f:
             props = [s.strip() for s in f]
     else:
         props = args.properties
+    return criteria, props
+
+
+def _sort_key(value):
+    """Parse a --sort value, 'key', 'key:asc' or 'key:desc', into (key, direction)."""
+    key, _, order = value.partition(":")
+    if not key or order not in ("", "asc", "desc"):
+        raise argparse.ArgumentTypeError(f"invalid sort key {value!r}, use 'key', 'key:asc' or 'key:desc'")
+    return key, DESCENDING if order == "desc" else ASCENDING
+
+
+def _get_cursor_kwargs(args, qe):
+    """Translate --limit, --batch_size, --sort and the other cursor options into QueryEngine.query kwargs."""
+    kwargs = {}
+    if getattr(args, "read_preference", None):
+        kwargs["read_preference"] = args.read_preference
+    for opt in ("no_cursor_timeout", "allow_disk_use", "exhaust", "raw"):
+        if getattr(args, opt, False):
+            kwargs[opt] = True
+    if args.limit:
+        kwargs["limit"] = args.limit
+    if args.batch_size:
+        kwargs["batch_size"] = args.batch_size
+    if args.sort:
+        kwargs["sort"] = [(qe.aliases.get(key, key), direction) for key, direction in args.sort]
+    return kwargs
+
+
+def query_db(args):
+    """
+    Query the database based on specified properties and criteria, and output the
+    results as JSON lines, a text table, or CSV/TSV. Rows are written as they arrive
+    from the cursor; the text table fixes its column widths from the first rows, so
+    large queries neither hold all results in memory nor wait for the cursor to be
+    exhausted before printing.
+
+    Parameters:
+        args: argparse.Namespace
+            Command-line arguments containing configuration file path, query
+            criteria, database properties, output format and cursor options
+            (limit, batch size, sort, read preference, no cursor timeout, allow
+            disk use, exhaust and raw).
+
+    Raises:
+        SystemExit
+            Raised when the specified criteria argument is not a valid JSON string.
+    """
+    from .export import DelimitedWriter, JSONLinesWriter, TableWriter, open_binary_stdout
+
+    qe = _get_query_engine(args.config_file)
+    criteria, props = _get_criteria_and_properties(args)
+    fmt = "json" if args.dump_json else args.output_format
+    if args.raw and fmt != "json":
+        print("--raw requires JSON output.")
+        sys.exit(-1)
+    results = qe.query(properties=props, criteria=criteria, **_get_cursor_kwargs(args, qe))
+
+    if fmt == "json":
+        with open_binary_stdout() as out:
+            writer = JSONLinesWriter(out, serializer=args.serializer)
+            for r in results:
+                writer.write_row(r)
+            writer.close()
+        return
+    if fmt == "table":
+        writer = TableWriter(sys.stdout, props)
+    else:
+        writer = DelimitedWriter(sys.stdout, props, delimiter="\t" if fmt == "tsv" else ",")
+    for r in results:
+        writer.write_row([r[p] for p in props])
+    writer.close()
+
+
+def dedupe_db(args):
+    """
+    Report clusters of tasks with equivalent final structures. Structures are
+    only compared within fingerprint buckets, see QueryEngine.find_duplicates.
+
+    Parameters:
+        args: argparse.Namespace
+            Command-line arguments containing configuration file path and
+            query criteria.
+
+    Raises:
+        SystemExit
+            Raised when the specified criteria argument is not a valid JSON string.
+    """
+    qe = _get_query_engine(args.config_file)
+    clusters = qe.find_duplicates(_get_criteria(args))
+    for c in clusters:
+        print(f"{c['fingerprint']}\t{' '.join(str(t) for t in c['task_ids'])}")
+    print(f"{len(clusters)} clusters with {sum(len(c['task_ids']) for c in clusters)} tasks found.")
 
-    if args.dump_json:
-        for r in qe.query(properties=props, criteria=criteria):
-            print(json.dumps(r, cls=MongoJSONEncoder))
+
+def benchmark_codecs(args):
+    """
+    Benchmark the compression codecs on DOS payloads sampled from the dos_fs
+    gridfs of the database, and print ratio against compress and decompress
+    speed for each codec and level.
+
+    Parameters:
+        args: argparse.Namespace
+            Command-line arguments containing the configuration file path, the
+            number of DOS files to sample and the codecs and levels to try.
+    """
+    import gridfs
+
+    from .compression import CODECS, benchmark_codecs, get_payload
+
+    qe = _get_query_engine(args.config_file)
+    fs = gridfs.GridFS(qe.db, "dos_fs")
+    payloads = [get_payload(fs, f._id) for f in fs.find().limit(args.limit)]
+    if not payloads:
+        print("No DOS found in dos_fs. Insert tasks with -d first.")
+        return
+    levels = {}
+    for token in args.levels or []:
+        name, _, level = token.partition(":")
+        levels.setdefault(name, []).append(int(level))
+    results = benchmark_codecs(payloads, codecs=args.codecs or list(CODECS), levels=levels)
+    print(f"{len(payloads)} DOS payloads, {sum(len(p) for p in payloads) / 1e6:.1f} MB uncompressed.")
+    print(f"{'codec':<8}{'level':>6}{'ratio':>8}{'comp MB/s':>12}{'decomp MB/s':>13}")
+    for r in results:
+        level = "-" if r["level"] is None else r["level"]
+        print(f"{r['codec']:<8}{level:>6}{r['ratio']:>8.2f}{r['compress_mb_s']:>12.1f}{r['decompress_mb_s']:>13.1f}")
+
+
+def update_views(args):
+    """
+    Build materialized views and keep them up to date as tasks are inserted,
+    see pymatgen.db.views.
+
+    Parameters:
+        args: argparse.Namespace
+            Command-line arguments containing the configuration file path, the
+            JSON file declaring the views and the worker options.
+    """
+    from .views import ViewWorker, view_from_dict
+
+    with open(args.views_file) as f:
+        views = [view_from_dict(d) for d in json.load(f)]
+    qe = _get_query_engine(args.config_file, use_admin=True)
+    worker = ViewWorker(qe, views, name=args.name, poll_interval=args.interval)
+    if args.rebuild:
+        worker.rebuild()
+    if args.once:
+        print(f"{worker.poll_once()} updated tasks processed.")
     else:
-        t = []
-        for r in qe.query(properties=props, criteria=criteria):
-            t.append([r[p] for p in props])
-        print(tabulate(t, headers=props))
+        worker.run(change_stream=not args.poll)
+
+
+def export_db(args):
+    """
+    Export the results of a query to a Parquet, Feather or JSON lines file.
+    Results are streamed from the cursor in chunks, so memory use stays
+    constant. Parquet and Feather require pyarrow.
+
+    Parameters:
+        args: argparse.Namespace
+            Command-line arguments containing configuration file path, query
+            criteria, properties, output file, format, chunk size, compression
+            and cursor options.
+
+    Raises:
+        SystemExit
+            Raised when the specified criteria argument is not a valid JSON string.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(relativeCreated)d msecs : %(message)s")
+    qe = _get_query_engine(args.config_file)
+    criteria, props = _get_criteria_and_properties(args)
+    n = qe.export(
+        args.output,
+        props,
+        criteria=criteria,
+        fmt=args.format,
+        chunk_size=args.chunk_size,
+        compression=args.compression,
+        serializer=args.serializer,
+        **_get_cursor_kwargs(args, qe),
+    )
+    print(f"{n} results exported to {args.output}.")
 
 
 def main():
@@ -221,19 +461,25 @@ def main():
     This function serves as the entry point for the mgdb command line utility, which provides
     tools for database management, including inserting VASP calculation data, running queries,
     and initializing configurations. The main subcommands available are `init`, `insert`,
-    `query`, and `optimize`.
+    `synth`, `query`, `export`, and `optimize`.
 
     Summary:
     - `init`: Sets up an initial database configuration file.
     - `insert`: Inserts VASP calculation data from specified directory into the database.
+    - `synth`: Generates synthetic task docs for load testing.
     - `query`: Allows querying the database for specific properties or criteria.
+    - `export`: Streams query results to Parquet, Feather or JSON lines files.
+    - `dedupe`: Reports clusters of tasks with duplicate structures.
     - `optimize`: Tools for optimizing database indexes.
     - Configuration options and verbosity levels can be specified globally for the commands.
 
     Subcommands:
     - init: Sets up an initial configuration file.
     - insert: Inserts calculation data into the database.
+    - synth: Bulk loads synthetic task docs into the database.
     - query: Queries the database for specified criteria and properties.
+    - export: Exports query results to a columnar file.
+    - dedupe: Reports duplicate structures.
     - optimize: Optimizes database indexes.
 
     Raises:
@@ -245,6 +491,16 @@ def main():
     Returns:
     - None
     """
+    args = _get_parser().parse_args()
+
+    # Run appropriate subparser function.
+    args.func(args)
+
+
+def _get_parser():
+    """Argument parser of the mgdb command."""
+    from . import SETTINGS
+
     db_file = SETTINGS.get("PMGDB_DB_FILE")
     parser = argparse.ArgumentParser(
         description="""
@@ -339,6 +595,34 @@ def main():
         help="Force update duplicates. This forces the analyzer to reanalyze already inserted data.",
     )
     pinsert.add_argument("-d", "--parse_dos", dest="parse_dos", action="store_true", help="Whether to parse the dos.")
+    pinsert.add_argument(
+        "--ionic_step_skip",
+        dest="ionic_step_skip",
+        type=int,
+        default=None,
+        help="Only parse every n-th ionic step. Bounds memory use and doc size for long MD runs.",
+    )
+    pinsert.add_argument(
+        "--arrays_to_gridfs",
+        dest="arrays_to_gridfs",
+        action="store_true",
+        help="Store eigenvalues and projections in gridfs in binary form instead of in the task doc.",
+    )
+    pinsert.add_argument(
+        "--offload_threshold",
+        dest="offload_threshold",
+        type=int,
+        default=None,
+        help="Move any part of a task doc larger than this many bytes to gridfs, e.g. 1048576. "
+        "Set offload_fs to 'offload_fs' in the config file to read them back in queries.",
+    )
+    pinsert.add_argument(
+        "--dos_codec",
+        dest="dos_codec",
+        type=str,
+        default=None,
+        help="Compress the DOS with this codec: zlib, or zstd or lz4 if installed. Requires -d.",
+    )
     pinsert.add_argument(
         "-a",
         "--author",
@@ -360,10 +644,142 @@ def main():
     )
     pinsert.set_defaults(func=update_db)
 
-    # The 'query' subcommand.
-    pquery = subparsers.add_parser(
-        "query", help="Query tools. Requires the use of pretty_table.", parents=[parent_vb, parent_cfg]
+    # The 'synth' subcommand.
+    psynth = subparsers.add_parser(
+        "synth", help="Generate synthetic task docs for load testing.", parents=[parent_vb, parent_cfg]
+    )
+    psynth.add_argument("count", metavar="count", type=int, help="Number of task docs to generate.")
+    psynth.add_argument(
+        "-e",
+        "--elements",
+        dest="elements",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Elements to sample from, optionally weighted. E.g., '--elements Li:2 Fe O:4'. "
+        "Defaults to most of the periodic table, uniformly.",
+    )
+    psynth.add_argument(
+        "--nelements",
+        dest="nelements",
+        type=int,
+        nargs=2,
+        default=[1, 4],
+        metavar=("MIN", "MAX"),
+        help="Range of the number of elements per structure.",
+    )
+    psynth.add_argument(
+        "--nsites",
+        dest="nsites",
+        type=int,
+        nargs=2,
+        default=[2, 32],
+        metavar=("MIN", "MAX"),
+        help="Range of the number of sites per structure.",
+    )
+    psynth.add_argument(
+        "--ionic_steps", dest="ionic_steps", type=int, default=3, help="Number of ionic steps per calculation."
+    )
+    psynth.add_argument(
+        "-d",
+        "--dos_npoints",
+        dest="dos_npoints",
+        type=int,
+        default=0,
+        help="Number of energy points in the generated DOS. Defaults to 0, i.e., no DOS.",
+    )
+    psynth.add_argument(
+        "--compress_dos", dest="compress_dos", type=int, default=0, help="zlib compression level for the DOS."
+    )
+    psynth.add_argument(
+        "--dos_codec",
+        dest="dos_codec",
+        type=str,
+        default=None,
+        help="Compress the DOS with this codec: zlib, or zstd or lz4 if installed.",
+    )
+    psynth.add_argument(
+        "-t", "--tag", dest="tag", type=str, nargs="+", default=[], help="Additional tags for the generated docs."
+    )
+    psynth.add_argument(
+        "-n",
+        "--ncpus",
+        dest="ncpus",
+        type=int,
+        default=None,
+        help="Number of worker processes. Defaults to the number of cpus detected.",
+    )
+    psynth.add_argument(
+        "--chunk_size", dest="chunk_size", type=int, default=500, help="Number of docs per insert batch."
+    )
+    psynth.add_argument("--seed", dest="seed", type=int, default=None, help="Random seed.")
+    psynth.set_defaults(func=synth_db)
+
+    # Cursor options shared by the 'query' and 'export' subcommands.
+    parent_cursor = argparse.ArgumentParser(add_help=False)
+    parent_cursor.add_argument(
+        "--limit", dest="limit", type=int, default=0, help="Maximum number of results. Defaults to no limit."
+    )
+    parent_cursor.add_argument(
+        "--batch-size",
+        "--batch_size",
+        dest="batch_size",
+        type=int,
+        default=0,
+        help="Number of documents per cursor batch fetched from the server.",
+    )
+    parent_cursor.add_argument(
+        "--serializer",
+        dest="serializer",
+        type=str,
+        choices=JSON_SERIALIZERS,
+        default="auto",
+        help="JSON serializer for JSON output. 'auto' uses orjson if installed. 'bson' writes MongoDB extended JSON.",
+    )
+    parent_cursor.add_argument(
+        "--sort",
+        dest="sort",
+        type=_sort_key,
+        nargs="+",
+        default=None,
+        help="Properties to sort by. Append ':desc' for descending order, e.g. '--sort nelements energy:desc'.",
+    )
+    parent_cursor.add_argument(
+        "--read_preference",
+        dest="read_preference",
+        type=str,
+        default=None,
+        help="Read preference for this query, e.g. 'secondary' to keep large scans off the primary. "
+        "Overrides the read_preference in the config file.",
+    )
+    parent_cursor.add_argument(
+        "--no_cursor_timeout",
+        dest="no_cursor_timeout",
+        action="store_true",
+        help="Keep the cursor open on the server for long scans. Exports also reopen killed cursors.",
+    )
+    parent_cursor.add_argument(
+        "--allow_disk_use",
+        dest="allow_disk_use",
+        action="store_true",
+        help="Allow the server to use temporary files for sorts larger than its memory limit.",
+    )
+    parent_cursor.add_argument(
+        "--exhaust",
+        dest="exhaust",
+        action="store_true",
+        help="Use an exhaust cursor, which streams all batches without round trips. Not supported with mongos.",
+    )
+    parent_cursor.add_argument(
+        "--raw",
+        dest="raw",
+        action="store_true",
+        help="Pass raw BSON through to JSON or BSON output without decoding whole documents. "
+        "Offloaded fields are not resolved.",
     )
+
+    # The 'query' subcommand.
+    pquery = subparsers.add_parser("query", help="Query tools.", parents=[parent_vb, parent_cfg, parent_cursor])
     pquery.add_argument(
         "--crit",
         dest="criteria",
@@ -385,12 +801,116 @@ def main():
         dest="dump_json",
         action="store_true",
         default=False,
-        help="Simply dump results to JSON instead of a tabular view",
+        help="Simply dump results to JSON instead of a tabular view. Same as '--format json'.",
+    )
+    pquery.add_argument(
+        "-f",
+        "--format",
+        dest="output_format",
+        type=str,
+        choices=["table", "csv", "tsv", "json"],
+        default="table",
+        help="Output format. Rows are written as they are retrieved. Defaults to table.",
     )
     pquery.set_defaults(func=query_db)
 
-    # Parse args
-    args = parser.parse_args()
+    # The 'export' subcommand.
+    pexport = subparsers.add_parser(
+        "export",
+        help="Export query results to Parquet, Feather (both require pyarrow) or JSON lines.",
+        parents=[parent_vb, parent_cfg, parent_cursor],
+    )
+    pexport.add_argument(
+        "--crit",
+        dest="criteria",
+        type=str,
+        default=None,
+        help="Query criteria in typical json format. E.g., {'task_id': 1}.",
+    )
+    pexport.add_argument(
+        "--props",
+        dest="properties",
+        type=str,
+        default=[],
+        nargs="+",
+        required=True,
+        help="Properties to export, one column each. E.g., pretty_formula, task_id, energy...",
+    )
+    pexport.add_argument(
+        "-o", "--output", dest="output", type=str, required=True, help="Output file, e.g. tasks.parquet."
+    )
+    pexport.add_argument(
+        "-f",
+        "--format",
+        dest="format",
+        type=str,
+        choices=["parquet", "feather", "jsonl", "bson"],
+        default=None,
+        help="Output format. Defaults to a guess from the output file extension.",
+    )
+    pexport.add_argument(
+        "--chunk_size", dest="chunk_size", type=int, default=10000, help="Number of rows per record batch."
+    )
+    pexport.add_argument(
+        "--compression", dest="compression", type=str, default=None, help="Compression codec, e.g. zstd or lz4."
+    )
+    pexport.set_defaults(func=export_db)
 
-    # Run appropriate subparser function.
-    args.func(args)
+    # The 'dedupe' subcommand.
+    pdedupe = subparsers.add_parser(
+        "dedupe", help="Report clusters of duplicate structures.", parents=[parent_vb, parent_cfg]
+    )
+    pdedupe.add_argument(
+        "--crit",
+        dest="criteria",
+        type=str,
+        default=None,
+        help="Query criteria in typical json format to restrict the tasks compared. E.g., {'chemsys': 'Li-O'}.",
+    )
+    pdedupe.set_defaults(func=dedupe_db)
+
+    # The 'codecs' subcommand.
+    pcodecs = subparsers.add_parser(
+        "codecs", help="Benchmark DOS compression codecs on the database.", parents=[parent_vb, parent_cfg]
+    )
+    pcodecs.add_argument(
+        "-l", "--limit", dest="limit", type=int, default=20, help="Number of DOS files to sample. Defaults to 20."
+    )
+    pcodecs.add_argument(
+        "--codecs", dest="codecs", type=str, nargs="+", default=None, help="Codecs to try. Defaults to all available."
+    )
+    pcodecs.add_argument(
+        "--levels",
+        dest="levels",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Levels to try, as codec:level, e.g. zlib:1 zlib:6 zstd:3. Defaults to each codec's default level.",
+    )
+    pcodecs.set_defaults(func=benchmark_codecs)
+
+    # The 'views' subcommand.
+    pviews = subparsers.add_parser(
+        "views", help="Maintain materialized views of the tasks.", parents=[parent_vb, parent_cfg]
+    )
+    pviews.add_argument(
+        "views_file",
+        metavar="views_file",
+        type=str,
+        help="JSON file with a list of views, e.g. "
+        '[{"type": "BestTaskView", "name": "ground_states", "group_by": "pretty_formula"}].',
+    )
+    pviews.add_argument("--rebuild", dest="rebuild", action="store_true", help="Rebuild all views first.")
+    pviews.add_argument(
+        "--once", dest="once", action="store_true", help="Process the tasks updated since the last run and exit."
+    )
+    pviews.add_argument(
+        "--poll", dest="poll", action="store_true", help="Poll last_updated instead of following a change stream."
+    )
+    pviews.add_argument(
+        "--interval", dest="interval", type=float, default=10, help="Seconds between polls. Defaults to 10."
+    )
+    pviews.add_argument("--name", dest="name", type=str, default="views", help="Worker name, to keep its state.")
+    pviews.set_defaults(func=update_views)
+
+    return parser
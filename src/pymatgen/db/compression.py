@@ -0,0 +1,189 @@
+"""
+Registry of compression codecs for GridFS payloads (DOS, offloaded fields).
+
+The codec used for a payload is stored in the "codec" key of the GridFS file
+metadata, so readers dispatch directly to the right decompressor instead of
+guessing. zlib is always available; zstd and lz4 are registered when the
+zstandard and lz4 packages are installed.
+
+Usage::
+
+    file_id = put_payload(fs, payload, "zstd", level=3)
+    ...
+    payload = get_payload(fs, file_id)
+
+benchmark_codecs, or "mgdb codecs" on a database, compares the compression
+ratio against the compress and decompress speed on real payloads.
+"""
+
+from __future__ import annotations
+
+import time
+import zlib
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+
+class Codec(NamedTuple):
+    """A compression codec. compress takes the data and a level; decompress takes the data."""
+
+    name: str
+    compress: Callable
+    decompress: Callable
+    default_level: int | None
+
+
+#: Registered codecs, by name.
+CODECS: dict[str, Codec] = {}
+
+#: Default codec for each payload type written to GridFS.
+DEFAULT_CODECS = {"dos": "zlib", "offload": "zlib"}
+
+
+def register_codec(name, compress, decompress, default_level=None):
+    """
+    Register a codec.
+
+    Args:
+        name: Codec name, stored in the GridFS metadata.
+        compress: Function (data: bytes, level: int | None) -> bytes.
+        decompress: Function (data: bytes) -> bytes.
+        default_level: Level used when none is given.
+    """
+    CODECS[name] = Codec(name, compress, decompress, default_level)
+
+
+def get_codec(name):
+    """
+    Get a registered codec.
+
+    Raises:
+        ValueError: If the codec is unknown, or its package is not installed.
+    """
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown or unavailable codec {name!r}. Available codecs: {', '.join(CODECS)}.") from None
+
+
+def compress(data, codec, level=None):
+    """Compress bytes with the named codec."""
+    c = get_codec(codec)
+    return c.compress(data, c.default_level if level is None else level)
+
+
+def decompress(data, codec):
+    """Decompress bytes with the named codec."""
+    return get_codec(codec).decompress(data)
+
+
+def put_payload(fs, data, codec="none", level=None, **metadata):
+    """
+    Compress bytes and store them in GridFS, recording the codec in the file metadata.
+
+    Args:
+        fs: gridfs.GridFS.
+        data: Bytes to store.
+        codec: Codec name.
+        level: Compression level. None for the codec default.
+        **metadata: Additional metadata for the file.
+
+    Returns:
+        The GridFS file id.
+    """
+    return fs.put(compress(data, codec, level), metadata={"codec": codec, **metadata})
+
+
+def get_payload(fs, file_id, codec=None):
+    """
+    Read and decompress a payload from GridFS.
+
+    Args:
+        fs: gridfs.GridFS.
+        file_id: GridFS file id.
+        codec: Codec to use if the file metadata does not record one, e.g. for
+            files written by older versions. If neither gives a codec, the
+            payload is taken to be zlib if it starts with a zlib header and
+            uncompressed otherwise, which is how older versions stored the DOS.
+
+    Returns:
+        The decompressed bytes.
+    """
+    with fs.get(file_id) as f:
+        codec = (f.metadata or {}).get("codec", codec)
+        data = f.read()
+    if codec is None:
+        codec = "zlib" if data[:1] == b"\x78" else "none"
+    return decompress(data, codec)
+
+
+def benchmark_codecs(payloads, codecs=None, levels=None, repeat=3):
+    """
+    Compare codecs on sample payloads, e.g. DOS files read from dos_fs.
+
+    Args:
+        payloads: List of uncompressed payloads (bytes).
+        codecs: Codec names. Defaults to all registered codecs.
+        levels: Dict of codec name to list of levels to try. Codecs that are
+            not in it are run at their default level.
+        repeat: Number of timing repeats. The best time is reported.
+
+    Returns:
+        List of dicts with codec, level, ratio (uncompressed / compressed size),
+        and compress and decompress throughput in MB/s, one per codec and level.
+    """
+    levels = levels or {}
+    nbytes = sum(len(p) for p in payloads)
+    results = []
+    for name in codecs or list(CODECS):
+        codec = get_codec(name)
+        for level in levels.get(name, [codec.default_level]):
+            best_c = best_d = float("inf")
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                compressed = [codec.compress(p, level) for p in payloads]
+                t1 = time.perf_counter()
+                for c in compressed:
+                    codec.decompress(c)
+                t2 = time.perf_counter()
+                best_c, best_d = min(best_c, t1 - t0), min(best_d, t2 - t1)
+            results.append(
+                {
+                    "codec": name,
+                    "level": level,
+                    "ratio": nbytes / max(sum(len(c) for c in compressed), 1),
+                    "compress_mb_s": nbytes / 1e6 / max(best_c, 1e-9),
+                    "decompress_mb_s": nbytes / 1e6 / max(best_d, 1e-9),
+                }
+            )
+    return results
+
+
+register_codec("none", lambda data, level: data, lambda data: data)
+register_codec("zlib", zlib.compress, zlib.decompress, default_level=1)
+
+try:
+    import zstandard
+
+    register_codec(
+        "zstd",
+        lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+        default_level=3,
+    )
+except ImportError:
+    pass
+
+try:
+    import lz4.frame
+
+    register_codec(
+        "lz4",
+        lambda data, level: lz4.frame.compress(data, compression_level=level),
+        lz4.frame.decompress,
+        default_level=0,
+    )
+except ImportError:
+    pass
@@ -8,14 +8,25 @@ passed in as a file or object. For example::
     cfg3 = DBConfig(f)  # read from file object
     # access dict of parsed conf. settings
     settings = cfg1.settings.
+
+Besides the connection settings, a configuration may set read routing and
+connection pool options, which are passed on to QueryEngine::
+
+    {
+        "host": "mongo.example.com", ...,
+        "read_preference": "secondaryPreferred",
+        "tag_sets": [{"nodeType": "ANALYTICS"}, {}],
+        "max_staleness": 120,
+        "read_concern": "majority",
+        "max_pool_size": 50
+    }
 """
 
 from __future__ import annotations
 
+import json
 import os
 
-from ruamel import yaml
-
 __author__ = "Dan Gunter <dkgunter@lbl.gov>"
 __date__ = "4/25/14"
 
@@ -27,6 +38,22 @@ COLL_KEY = "collection"
 USER_KEY = "user"
 PASS_KEY = "password"
 ALIASES_KEY = "aliases"
+READ_PREF_KEY = "read_preference"
+TAG_SETS_KEY = "tag_sets"
+MAX_STALENESS_KEY = "max_staleness"
+READ_CONCERN_KEY = "read_concern"
+MAX_POOL_KEY = "max_pool_size"
+MIN_POOL_KEY = "min_pool_size"
+
+#: Optional settings that are passed as-is to QueryEngine.
+CONNECTION_OPTION_KEYS = (
+    READ_PREF_KEY,
+    TAG_SETS_KEY,
+    MAX_STALENESS_KEY,
+    READ_CONCERN_KEY,
+    MAX_POOL_KEY,
+    MIN_POOL_KEY,
+)
 
 
 class ConfigurationFileError(Exception):
@@ -140,6 +167,31 @@ class DBConfig:
         """Return password."""
         return self._cfg.get(PASS_KEY, None)
 
+    @property
+    def read_preference(self):
+        """Read preference mode, e.g. "secondaryPreferred"."""
+        return self._cfg.get(READ_PREF_KEY, None)
+
+    @property
+    def tag_sets(self):
+        """Replica set tag sets for the read preference."""
+        return self._cfg.get(TAG_SETS_KEY, None)
+
+    @property
+    def max_staleness(self):
+        """Maximum replication lag of secondaries to read from, in seconds."""
+        return self._cfg.get(MAX_STALENESS_KEY, None)
+
+    @property
+    def read_concern(self):
+        """Read concern level, e.g. "majority"."""
+        return self._cfg.get(READ_CONCERN_KEY, None)
+
+    @property
+    def connection_options(self):
+        """Read routing and pool options that are set, as QueryEngine kwargs."""
+        return {k: self._cfg[k] for k in CONNECTION_OPTION_KEYS if self._cfg.get(k) is not None}
+
 
 def get_settings(infile):
     """Read settings from input file.
@@ -148,8 +200,14 @@ def get_settings(infile):
     :return: Settings parsed from file
     :rtype: dict.
     """
-    yml = yaml.YAML()
-    settings = yml.load(_as_file(infile))
+    text = _as_file(infile).read()
+    try:
+        # Most config files are JSON (db.json), which does not need a YAML parser.
+        settings = json.loads(text)
+    except ValueError:
+        from ruamel import yaml
+
+        settings = yaml.YAML().load(text)
     if not hasattr(settings, "keys"):
         raise ValueError(f"Settings not found in {infile}")
 
@@ -7,13 +7,13 @@ from __future__ import annotations
 
 import datetime
 import glob
+import io
 import json
 import logging
 import os
 import re
 import socket
 import string
-import zlib
 from collections import OrderedDict
 from fnmatch import fnmatch
 
@@ -35,6 +35,11 @@ from pymatgen.io.cif import CifWriter
 from pymatgen.io.vasp import Incar, Kpoints, Oszicar, Outcar, Poscar, Potcar, Vasprun
 from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
 
+from .cache import bump_generation
+from .compression import DEFAULT_CODECS, put_payload
+from .fingerprint import make_fingerprint
+from .offload import offload_large_fields
+
 __author__ = "Shyue Ping Ong"
 __copyright__ = "Copyright 2012, The Materials Project"
 __version__ = "2.0.0"
@@ -45,6 +50,17 @@ __date__ = "Mar 18, 2012"
 
 logger = logging.getLogger(__name__)
 
+#: Vasprun arrays stored in gridfs with arrays_to_gridfs, with the dtypes they are stored as. Projections
+#: are only printed to a few decimals in vasprun.xml, so single precision loses nothing.
+GRIDFS_ARRAY_KEYS = {
+    "eigenvalues": np.float64,
+    "projected_eigenvalues": np.float32,
+    "projected_magnetization": np.float32,
+}
+
+#: Top-level keys of the task doc that are never offloaded to gridfs, since they are queried on.
+OFFLOAD_EXCLUDE = ("dir_name", "task_id", "elements", "spacegroup", "analysis", "fingerprint")
+
 
 class VaspToDbTaskDrone(AbstractDrone):
     """
@@ -85,6 +101,10 @@ class VaspToDbTaskDrone(AbstractDrone):
         mapi_key=None,
         use_full_uri=True,
         runs=None,
+        ionic_step_skip=None,
+        arrays_to_gridfs=False,
+        offload_threshold=None,
+        dos_codec=None,
     ):
         """Constructor.
 
@@ -117,6 +137,12 @@ class VaspToDbTaskDrone(AbstractDrone):
             compress_dos:
                 Whether to compress the DOS data. Valid options are integers 1-9,
                 corresponding to zlib compression level. 1 is usually adequate.
+            dos_codec:
+                Codec to compress the DOS with, e.g. "zstd" or "lz4" if the
+                zstandard or lz4 packages are installed. See
+                pymatgen.db.compression. Overrides compress_dos, except that
+                compress_dos is still used as the level for "zlib". The codec
+                is recorded in the gridfs file metadata.
             simulate_mode:
                 Allows one to simulate db insertion without actually performing
                 the insertion.
@@ -148,6 +174,29 @@ class VaspToDbTaskDrone(AbstractDrone):
                 Ordered list of runs to look for e.g. ["relax1", "relax2"].
                 Automatically detects whether the runs are stored in the
                 subfolder or file extension schema.
+            ionic_step_skip:
+                If > 1, only every ionic_step_skip-th ionic step is stored,
+                counting back from the last one, which bounds the doc size of
+                long MD or relaxation runs. The last ionic step, and so the
+                final structure and energy, is always kept. The vasprun.xml is
+                still read in full. Defaults to None, i.e. all ionic steps.
+            arrays_to_gridfs:
+                Whether to keep the eigenvalues, projected eigenvalues and
+                projected magnetization as
+                numpy arrays, rather than nested lists, while parsing and
+                store them in a gridfs collection called arrays_fs in a
+                compact binary (npz) form instead of in the doc. The doc keeps
+                a ref in output.{key}_fs_id. Use
+                QueryEngine.get_array_from_id to read them back.
+            offload_threshold:
+                If set, any sub-document or array of the doc larger than this
+                many bytes (in BSON) is moved to a gridfs collection called
+                offload_fs, compressed, and replaced by a ref. A QueryEngine
+                created with offload_fs="offload_fs" resolves the refs in the
+                fields it returns. Mongo only sees the refs, so criteria on
+                and projections of paths inside an offloaded value match
+                nothing and return None; project the offloaded field itself.
+                See pymatgen.db.offload. Defaults to None, i.e. no offloading.
         """
         self.host = host
         self.database = database
@@ -163,11 +212,15 @@ class VaspToDbTaskDrone(AbstractDrone):
         self.parse_projected_eigen = parse_projected_eigen
         self.parse_dos = parse_dos
         self.compress_dos = compress_dos
+        self.dos_codec = dos_codec
         self.additional_fields = additional_fields or {}
         self.update_duplicates = update_duplicates
         self.mapi_key = mapi_key
         self.use_full_uri = use_full_uri
         self.runs = runs or ["relax1", "relax2"]
+        self.ionic_step_skip = ionic_step_skip
+        self.arrays_to_gridfs = arrays_to_gridfs
+        self.offload_threshold = offload_threshold
         if not simulate_mode:
             self.connection = MongoClient(self.host, self.port, username=user, password=password)
             self.db = self.connection[self.database]
@@ -261,14 +314,30 @@ class VaspToDbTaskDrone(AbstractDrone):
                 if self.parse_dos and "calculations" in d:
                     for calc in d["calculations"]:
                         if "dos" in calc:
-                            dos = json.dumps(calc["dos"], cls=MontyEncoder)
-                            if self.compress_dos:
-                                dos = zlib.compress(dos.encode("utf-8"), self.compress_dos)
-                                calc["dos_compression"] = "zlib"
+                            dos = json.dumps(calc["dos"], cls=MontyEncoder).encode("utf-8")
+                            codec = self.dos_codec or (DEFAULT_CODECS["dos"] if self.compress_dos else "none")
+                            level = self.compress_dos if codec == "zlib" and self.compress_dos else None
+                            if codec != "none":
+                                calc["dos_compression"] = codec
                             fs = gridfs.GridFS(db, "dos_fs")
-                            dosid = fs.put(dos)
-                            calc["dos_fs_id"] = dosid
+                            calc["dos_fs_id"] = put_payload(fs, dos, codec, level=level, format="json")
                             del calc["dos"]
+                if self.arrays_to_gridfs and "calculations" in d:
+                    fs = gridfs.GridFS(db, "arrays_fs")
+                    for calc in d["calculations"]:
+                        for key in GRIDFS_ARRAY_KEYS:
+                            if key in calc.get("output", {}):
+                                arrays = calc["output"].pop(key)
+                                buf = io.BytesIO()
+                                np.savez_compressed(buf, **arrays)
+                                calc["output"][f"{key}_fs_id"] = fs.put(
+                                    buf.getvalue(), metadata={"key": key, "format": "npz"}
+                                )
+
+                if self.offload_threshold:
+                    paths = offload_large_fields(d, db, threshold=self.offload_threshold, exclude=OFFLOAD_EXCLUDE)
+                    if paths:
+                        logger.info(f"Offloaded {', '.join(paths)} of {d['dir_name']} to gridfs")
 
                 d["last_updated"] = datetime.datetime.today()
                 if result is None:
@@ -281,6 +350,8 @@ class VaspToDbTaskDrone(AbstractDrone):
                     logger.info(f"Updating {d['dir_name']} with taskid = {d['task_id']}")
 
                 coll.update_one({"dir_name": d["dir_name"]}, {"$set": d}, upsert=True)
+                # Invalidate the query results cached by QueryEngines on this collection.
+                bump_generation(db, self.collection)
                 return d["task_id"]
             logger.info(f"Skipping duplicate {d['dir_name']}")
         else:
@@ -470,8 +541,35 @@ class VaspToDbTaskDrone(AbstractDrone):
         parse_projected_eigen = self.parse_projected_eigen and (
             self.parse_projected_eigen != "final" or taskname == self.runs[-1]
         )
-        r = Vasprun(vasprun_file, parse_projected_eigen=parse_projected_eigen)
+        skip_kwargs = {}
+        if self.ionic_step_skip and self.ionic_step_skip > 1:
+            # Offset the skip so that the last ionic step, which holds the final energy, is always parsed.
+            nsteps = count_ionic_steps(vasprun_file)
+            if nsteps:
+                skip_kwargs = {
+                    "ionic_step_skip": self.ionic_step_skip,
+                    "ionic_step_offset": (nsteps - 1) % self.ionic_step_skip,
+                }
+        r = Vasprun(vasprun_file, parse_projected_eigen=parse_projected_eigen, **skip_kwargs)
+        if skip_kwargs:
+            # Vasprun only reads the POTCARs when it parses all ionic steps.
+            r.update_potcar_spec(True)
+            r.update_charge_from_potcar(True)
+        arrays = {}
+        if self.arrays_to_gridfs:
+            # Take the big arrays off the Vasprun so that as_dict does not convert them to nested lists.
+            if r.eigenvalues:
+                gap, cbm, vbm, is_direct = r.eigenvalue_band_properties
+                arrays = {"bandgap": gap, "cbm": cbm, "vbm": vbm, "is_gap_direct": is_direct}
+            for key, dtype in GRIDFS_ARRAY_KEYS.items():
+                values = getattr(r, key)
+                if isinstance(values, dict) and values:
+                    arrays[key] = {str(spin): np.asarray(v, dtype=dtype) for spin, v in values.items()}
+                elif values is not None and not isinstance(values, dict):
+                    arrays[key] = {"data": np.asarray(values, dtype=dtype)}
+                setattr(r, key, None)
         d = r.as_dict()
+        d["output"].update(arrays)
         d["dir_name"] = os.path.abspath(dir_name)
         d["completed_at"] = str(datetime.datetime.fromtimestamp(os.path.getmtime(vasprun_file)))
         d["cif"] = str(CifWriter(r.final_structure))
@@ -557,7 +655,8 @@ class VaspToDbTaskDrone(AbstractDrone):
                 d["state"] = "stopped"
             d["analysis"] = get_basic_analysis_and_error_checks(d)
 
-            sg = SpacegroupAnalyzer(Structure.from_dict(d["output"]["crystal"]), 0.1)
+            final_structure = Structure.from_dict(d["output"]["crystal"])
+            sg = SpacegroupAnalyzer(final_structure, 0.1)
             d["spacegroup"] = {
                 "symbol": sg.get_space_group_symbol(),
                 "number": sg.get_space_group_number(),
@@ -566,6 +665,10 @@ class VaspToDbTaskDrone(AbstractDrone):
                 "crystal_system": sg.get_crystal_system(),
                 "hall": sg.get_hall(),
             }
+            # Cheap canonical key used to bucket near-duplicate structures.
+            d["fingerprint"] = make_fingerprint(
+                d["pretty_formula"], d["spacegroup"]["number"], final_structure.volume / len(final_structure)
+            )
             d["oxide_type"] = d2["oxide_type"]
             d["last_updated"] = datetime.datetime.today()
             return d
@@ -619,7 +722,12 @@ class VaspToDbTaskDrone(AbstractDrone):
             "password": self.password,
             "collection": self.collection,
             "parse_dos": self.parse_dos,
+            "compress_dos": self.compress_dos,
+            "dos_codec": self.dos_codec,
             "simulate_mode": self.simulate,
+            "ionic_step_skip": self.ionic_step_skip,
+            "arrays_to_gridfs": self.arrays_to_gridfs,
+            "offload_threshold": self.offload_threshold,
             "additional_fields": self.additional_fields,
             "update_duplicates": self.update_duplicates,
         }
@@ -730,6 +838,29 @@ def get_coordination_numbers(d):
     return cn
 
 
+def count_ionic_steps(filename, chunk_size=1 << 20):
+    """
+    Count the ionic steps, i.e. the <calculation> elements, of a vasprun.xml
+    without parsing it.
+
+    Args:
+        filename: Path of the vasprun.xml, optionally compressed.
+        chunk_size: Number of bytes read at a time.
+
+    Returns:
+        Number of ionic steps.
+    """
+    tag = b"<calculation>"
+    n, tail = 0, b""
+    with zopen(filename, mode="rb") as f:
+        while chunk := f.read(chunk_size):
+            buf = tail + chunk
+            n += buf.count(tag)
+            # Keep a partial tag split across chunks, but never a whole one.
+            tail = buf[1 - len(tag) :]
+    return n
+
+
 def get_uri(dir_name):
     """
     Returns the URI path for a directory. This allows files hosted on
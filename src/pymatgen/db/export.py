@@ -0,0 +1,432 @@
+"""
+Streaming output of query results.
+
+ArrowWriter writes Parquet or Feather files. Results are pulled from the
+cursor in fixed-size chunks and each chunk is written as one Arrow record
+batch, so memory use is bounded by the chunk size rather than the number of
+results. Export requires pyarrow, which is imported only when an export is
+performed.
+
+TableWriter and DelimitedWriter write text tables and CSV/TSV row by row, as
+results arrive, for the mgdb query command. JSONLinesWriter writes one JSON
+document per line through a pluggable serializer (see
+pymatgen.db.util.get_json_serializer) into a buffered binary stream.
+BSONWriter writes concatenated BSON documents, as mongodump does. Results of
+raw queries (QueryEngine.query with raw=True) are written without being
+decoded to Python objects first: whole raw documents are copied as bytes.
+
+Example::
+
+    qe = QueryEngine.from_config("db.json")
+    qe.export("tasks.parquet", ["task_id", "pretty_formula", "energy_per_atom"], criteria={"nelements": 2})
+"""
+
+from __future__ import annotations
+
+import csv
+import datetime
+import itertools
+import json
+import logging
+import numbers
+import os
+import sys
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+from .util import MongoJSONEncoder, get_json_serializer
+
+_log = logging.getLogger("mg." + __name__)
+
+#: Supported export formats, keyed by file extension.
+FORMATS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".bson": "bson",
+}
+
+DEFAULT_CHUNK_SIZE = 10000
+
+#: Buffer size used for binary output streams.
+BUFFER_SIZE = 1 << 20
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("Exporting to Parquet/Feather requires pyarrow. Install it with `pip install pyarrow`.")
+    return pa
+
+
+def guess_format(path):
+    """
+    Guess the export format from a file name.
+
+    Args:
+        path: Output file name.
+
+    Returns:
+        Format name, e.g. "parquet", "feather" or "jsonl".
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Cannot guess export format from {path}. Supported extensions are {sorted(FORMATS)}.")
+    return FORMATS[ext]
+
+
+def chunked(iterable, size):
+    """Yield lists of at most `size` items from an iterable."""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _to_arrow_value(v):
+    """Convert Mongo-specific scalars that Arrow does not understand."""
+    if isinstance(v, bson.ObjectId):
+        return str(v)
+    if isinstance(v, dict):
+        return {k: _to_arrow_value(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_to_arrow_value(x) for x in v]
+    return v
+
+
+class ArrowWriter:
+    """
+    Writes chunks of result dicts as Arrow record batches to a Parquet or
+    Feather (Arrow IPC) file. The schema is fixed by the first chunk, with one
+    column per property, in the order the properties were requested. Columns
+    that are entirely null in the first chunk are typed as strings, and any
+    value that does not fit a string column is stored as JSON.
+    """
+
+    def __init__(self, path, columns, fmt=None, compression=None):
+        """Constructor.
+
+        Args:
+            path: Output file name.
+            columns: Column names, i.e., the (aliased) property names.
+            fmt: "parquet" or "feather". Defaults to a guess from `path`.
+            compression: Compression codec passed to pyarrow, e.g. "zstd".
+                Defaults to pyarrow's default for the format.
+        """
+        self._pa = _import_pyarrow()
+        self.path = path
+        self.columns = list(columns)
+        self.fmt = fmt or guess_format(path)
+        if self.fmt not in ("parquet", "feather"):
+            raise ValueError(f"Unsupported export format {self.fmt}.")
+        self.compression = compression
+        self.schema = None
+        self.nrows = 0
+        self._writer = None
+
+    def infer_schema(self, rows):
+        """
+        Infer the Arrow schema from a chunk of rows.
+
+        Args:
+            rows: List of result dicts.
+
+        Returns:
+            pyarrow.Schema
+        """
+        pa = self._pa
+        fields = []
+        for col in self.columns:
+            arr = pa.array([_to_arrow_value(r.get(col)) for r in rows])
+            dtype = pa.string() if pa.types.is_null(arr.type) else arr.type
+            fields.append(pa.field(col, dtype))
+        return pa.schema(fields)
+
+    def _column(self, field, values):
+        pa = self._pa
+        try:
+            return pa.array(values, type=field.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            if not pa.types.is_string(field.type):
+                raise ValueError(
+                    f"Values of {field.name} do not match the type {field.type} inferred from the first chunk. "
+                    "Use a larger chunk size or project a more specific property."
+                )
+            return pa.array(
+                [v if v is None or isinstance(v, str) else json.dumps(v, cls=MongoJSONEncoder) for v in values],
+                type=field.type,
+            )
+
+    def _open(self):
+        pa = self._pa
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            kwargs = {} if self.compression is None else {"compression": self.compression}
+            self._writer = pq.ParquetWriter(self.path, self.schema, **kwargs)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=self.compression)
+            self._writer = pa.ipc.new_file(self.path, self.schema, options=options)
+
+    def write_rows(self, rows):
+        """
+        Write a chunk of result dicts as one record batch.
+
+        Args:
+            rows: List of result dicts.
+        """
+        if not rows:
+            return
+        if self.schema is None:
+            self.schema = self.infer_schema(rows)
+            self._open()
+        arrays = [self._column(field, [_to_arrow_value(r.get(field.name)) for r in rows]) for field in self.schema]
+        batch = self._pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        self._writer.write_batch(batch)
+        self.nrows += len(rows)
+
+    def close(self):
+        """Close the file. An empty file with string columns is written if no rows were seen."""
+        if self._writer is None:
+            pa = self._pa
+            self.schema = pa.schema([pa.field(c, pa.string()) for c in self.columns])
+            self._open()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def export_results(
+    results, path, columns, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE, compression=None, serializer="auto"
+):
+    """
+    Stream an iterable of result dicts to a Parquet, Feather, JSON lines or BSON file.
+
+    Args:
+        results: Iterable of result dicts, e.g. from QueryEngine.query.
+        path: Output file name.
+        columns: Column names, i.e., the (aliased) property names.
+        fmt: "parquet", "feather", "jsonl" or "bson". Defaults to a guess from `path`.
+        chunk_size: Number of rows per record batch.
+        compression: Compression codec passed to pyarrow. Not used for jsonl and bson.
+        serializer: JSON serializer backend for jsonl. See pymatgen.db.util.get_json_serializer.
+
+    Returns:
+        Number of rows written.
+    """
+    start = datetime.datetime.now()
+    fmt = fmt or guess_format(path)
+    if fmt in ("jsonl", "bson"):
+        with open(path, "wb", buffering=BUFFER_SIZE) as f:
+            writer = JSONLinesWriter(f, serializer=serializer) if fmt == "jsonl" else BSONWriter(f)
+            for r in results:
+                writer.write_row(r)
+            writer.close()
+    else:
+        with ArrowWriter(path, columns, fmt=fmt, compression=compression) as writer:
+            for rows in chunked(results, chunk_size):
+                writer.write_rows(rows)
+                _log.debug(f"{writer.nrows} rows written to {path}")
+    _log.info(f"Exported {writer.nrows} rows to {path} in {datetime.datetime.now() - start}.")
+    return writer.nrows
+
+
+def format_value(v, floatfmt=None):
+    """
+    Format a single value for text output. None becomes an empty string,
+    floats use `floatfmt` if given and dicts/lists are written as JSON.
+    """
+    if v is None:
+        return ""
+    if floatfmt is not None and isinstance(v, float):
+        return format(v, floatfmt)
+    if isinstance(v, dict | list):
+        return json.dumps(v, cls=MongoJSONEncoder)
+    return str(v)
+
+
+class TableWriter:
+    """
+    Writes rows as a plain-text table as they arrive. Column widths are fixed
+    from the first `sample_size` rows, which are buffered; every later row is
+    written immediately. Values wider than their column are written in full,
+    which shifts the rest of that line rather than truncating data.
+    """
+
+    def __init__(self, stream, columns, sample_size=100, floatfmt="g"):
+        """Constructor.
+
+        Args:
+            stream: Text stream to write to, e.g. sys.stdout.
+            columns: Column headers.
+            sample_size: Number of rows buffered to size the columns.
+            floatfmt: Format spec for floats.
+        """
+        self.stream = stream
+        self.columns = list(columns)
+        self.sample_size = sample_size
+        self.floatfmt = floatfmt
+        self.nrows = 0
+        self._sample = []
+        self._widths = None
+        self._numeric = None
+
+    def _fix_widths(self):
+        self._widths = [len(c) for c in self.columns]
+        self._numeric = [True] * len(self.columns)
+        for row in self._sample:
+            for i, v in enumerate(row):
+                self._widths[i] = max(self._widths[i], len(format_value(v, self.floatfmt)))
+                if v is not None and (isinstance(v, bool) or not isinstance(v, numbers.Number)):
+                    self._numeric[i] = False
+        self._write_line(self.columns)
+        self.stream.write("  ".join("-" * w for w in self._widths).rstrip() + "\n")
+        for row in self._sample:
+            self._write_line([format_value(v, self.floatfmt) for v in row])
+        self._sample = None
+
+    def _write_line(self, cells):
+        parts = [
+            c.rjust(w) if numeric else c.ljust(w)
+            for c, w, numeric in zip(cells, self._widths, self._numeric, strict=True)
+        ]
+        self.stream.write("  ".join(parts).rstrip() + "\n")
+
+    def write_row(self, row):
+        """
+        Write one row.
+
+        Args:
+            row: Sequence of values, in the same order as the columns.
+        """
+        self.nrows += 1
+        if self._widths is None:
+            self._sample.append(list(row))
+            if len(self._sample) >= self.sample_size:
+                self._fix_widths()
+        else:
+            self._write_line([format_value(v, self.floatfmt) for v in row])
+
+    def close(self):
+        """Flush any buffered rows. Writes just the header if there were no rows."""
+        if self._widths is None:
+            self._fix_widths()
+        self.stream.flush()
+
+
+class DelimitedWriter:
+    """Writes rows as CSV (or TSV, etc.) as they arrive, with a header line."""
+
+    def __init__(self, stream, columns, delimiter=","):
+        """Constructor.
+
+        Args:
+            stream: Text stream to write to, e.g. sys.stdout.
+            columns: Column headers.
+            delimiter: Field delimiter, e.g. "," or a tab.
+        """
+        self.columns = list(columns)
+        self.stream = stream
+        self.nrows = 0
+        self._writer = csv.writer(stream, delimiter=delimiter, lineterminator="\n")
+        self._writer.writerow(self.columns)
+
+    def write_row(self, row):
+        """
+        Write one row. Floats are written in full precision.
+
+        Args:
+            row: Sequence of values, in the same order as the columns.
+        """
+        self.nrows += 1
+        self._writer.writerow([format_value(v) for v in row])
+
+    def close(self):
+        """Flush the stream."""
+        self.stream.flush()
+
+
+class JSONLinesWriter:
+    """
+    Writes one JSON document per line to a binary stream, using a pluggable
+    serializer backend. Wrap unbuffered or line-buffered streams in a
+    large buffer (see open_binary_stdout) for best throughput.
+    """
+
+    def __init__(self, stream, serializer="auto"):
+        """Constructor.
+
+        Args:
+            stream: Binary stream to write to.
+            serializer: Backend name for pymatgen.db.util.get_json_serializer.
+        """
+        self.stream = stream
+        self.nrows = 0
+        self._dumps = get_json_serializer(serializer)
+
+    def write_row(self, doc):
+        """
+        Write one document.
+
+        Args:
+            doc: Document (dict) to write.
+        """
+        self.stream.write(self._dumps(doc))
+        self.stream.write(b"\n")
+        self.nrows += 1
+
+    def close(self):
+        """Flush the stream."""
+        self.stream.flush()
+
+
+class BSONWriter:
+    """
+    Writes concatenated BSON documents to a binary stream, readable with
+    bson.decode_file_iter or mongorestore. RawBSONDocuments are written as
+    they are, without decoding and re-encoding.
+    """
+
+    def __init__(self, stream):
+        """Constructor.
+
+        Args:
+            stream: Binary stream to write to.
+        """
+        self.stream = stream
+        self.nrows = 0
+
+    def write_row(self, doc):
+        """
+        Write one document.
+
+        Args:
+            doc: Document (dict or RawBSONDocument) to write.
+        """
+        self.stream.write(doc.raw if isinstance(doc, RawBSONDocument) else bson.encode(doc))
+        self.nrows += 1
+
+    def close(self):
+        """Flush the stream."""
+        self.stream.flush()
+
+
+def open_binary_stdout(buffer_size=BUFFER_SIZE):
+    """
+    Open stdout as a binary stream with a large buffer, which avoids a write
+    system call per line when dumping many documents. The returned stream
+    does not close the underlying file descriptor.
+    """
+    sys.stdout.flush()
+    return open(sys.stdout.fileno(), "wb", buffering=buffer_size, closefd=False)
@@ -0,0 +1,82 @@
+"""
+Cheap canonical fingerprints of structures, used to bucket candidate
+duplicates so that the expensive StructureMatcher comparisons only run
+within a bucket instead of over a whole collection.
+
+A fingerprint has the form "{reduced_formula}:{spacegroup_number}:{volume_bin}",
+where the volume per atom is binned on a log scale with a relative width of
+volume_tol. Two structures that StructureMatcher considers equivalent will
+almost always share the formula and spacegroup, and have volumes within a
+few percent, so they fall in the same or an adjacent bin. Use
+fingerprint_neighbors to get all fingerprints that should be searched.
+"""
+
+from __future__ import annotations
+
+import math
+
+#: Default symmetry tolerance used to determine the spacegroup.
+SYMPREC = 0.1
+
+#: Default relative width of the volume per atom bins.
+VOLUME_TOL = 0.05
+
+
+def make_fingerprint(reduced_formula, spacegroup_number, volume_per_atom, volume_tol=VOLUME_TOL):
+    """
+    Make a fingerprint from precomputed properties, e.g. those already stored in a task doc.
+
+    Args:
+        reduced_formula: Reduced formula, e.g. "Li2O".
+        spacegroup_number: International spacegroup number, or None if unknown.
+        volume_per_atom: Volume per atom in A^3.
+        volume_tol: Relative width of the volume bins.
+
+    Returns:
+        Fingerprint string.
+    """
+    volume_bin = round(math.log(volume_per_atom) / math.log1p(volume_tol))
+    return f"{reduced_formula}:{spacegroup_number or 0}:{volume_bin}"
+
+
+def structure_fingerprint(structure, symprec=SYMPREC, volume_tol=VOLUME_TOL):
+    """
+    Compute the fingerprint of a pymatgen Structure.
+
+    Args:
+        structure: Structure.
+        symprec: Symmetry tolerance for the spacegroup determination.
+        volume_tol: Relative width of the volume bins.
+
+    Returns:
+        Fingerprint string.
+    """
+    from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+    try:
+        spacegroup_number = SpacegroupAnalyzer(structure, symprec=symprec).get_space_group_number()
+    except Exception:
+        # spglib can fail on pathological structures. Such structures all go in one bucket per formula.
+        spacegroup_number = None
+    return make_fingerprint(
+        structure.composition.reduced_formula,
+        spacegroup_number,
+        structure.volume / len(structure),
+        volume_tol=volume_tol,
+    )
+
+
+def fingerprint_neighbors(fingerprint):
+    """
+    Fingerprints whose structures may be duplicates of structures with the given
+    fingerprint, i.e. the fingerprint itself and the adjacent volume bins.
+
+    Args:
+        fingerprint: Fingerprint string.
+
+    Returns:
+        List of fingerprint strings.
+    """
+    prefix, _, volume_bin = fingerprint.rpartition(":")
+    volume_bin = int(volume_bin)
+    return [f"{prefix}:{b}" for b in (volume_bin - 1, volume_bin, volume_bin + 1)]
@@ -6,89 +6,414 @@ See https://medium.com/@shyuep/a-local-materials-project-database-1ea909430c95
 
 from __future__ import annotations
 
+import hashlib
 import itertools
+import json
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
 
 import pymongo
+from monty.io import zopen
+from monty.json import MontyDecoder, MontyEncoder
 
-from pymatgen.entries.computed_entries import ComputedStructureEntry
+from pymatgen.analysis.phase_diagram import PhaseDiagram
+from pymatgen.entries.computed_entries import ComputedEntry, ComputedStructureEntry
 from pymatgen.ext.matproj import MPRester
 
+from .cache import bump_generation
+from .export import chunked
+
+logger = logging.getLogger(__name__)
+
+
+class MPRestEntrySource:
+    """
+    Pages ComputedStructureEntries from the Materials Project API. Each page is
+    one chemical system or formula, or a block of material ids, so only one
+    page of entries is held in memory at a time.
+    """
+
+    def __init__(self, criteria=None, property_data=None, page_size=500, mpr=None):
+        """
+        @param criteria: Chemical system, formula or material id, or a list of these. E.g., "Li-Fe-O" or
+            ["Li-O", "Fe-O"]. A dict with "chemsys", "formula" or "material_id" keys is also accepted. None
+            means the entire MP database, which is paged by material id.
+        @param property_data: List of additional property data to obtain. These are stored in the data.* keys.
+        @param page_size: Number of material ids per page when paging by id.
+        @param mpr: MPRester to use. Defaults to MPRester().
+        """
+        if isinstance(criteria, dict):
+            keys = ("chemsys", "formula", "material_id")
+            unsupported = sorted(set(criteria) - set(keys))
+            if unsupported:
+                raise ValueError(f"Unsupported criteria keys {unsupported}, only {list(keys)} are supported.")
+            criteria = [v for k in keys if k in criteria for v in _as_list(criteria[k])]
+        self.criteria = criteria
+        self.property_data = property_data or []
+        self.page_size = page_size
+        self.mpr = mpr
+
+    def pages(self):
+        """Yield (page key, list of entries) tuples."""
+        mpr = self.mpr or MPRester()
+        if self.criteria is None:
+            ids = sorted({d["material_id"] for d in mpr.summary_search(_fields=["material_id"])}, key=_id_sort_key)
+        else:
+            ids = [c for c in _as_list(self.criteria) if c.startswith("mp-")]
+            for crit in _as_list(self.criteria):
+                if not crit.startswith("mp-"):
+                    yield crit, mpr.get_entries(crit, property_data=self.property_data)
+        for page in chunked(ids, self.page_size):
+            yield f"{page[0]}..{page[-1]}", mpr.get_entries(page, property_data=self.property_data)
+
+
+class LocalEntrySource:
+    """
+    Pages entries from a local dump, for offline builds. The dump is either a
+    JSON file holding a list of ComputedStructureEntry dicts, or a JSON lines
+    file (.jsonl, optionally gzipped) with one entry dict per line. JSON lines
+    files are streamed; JSON lists have to be loaded in full.
+    """
+
+    def __init__(self, filename, page_size=1000):
+        """
+        @param filename: Path to the dump.
+        @param page_size: Number of entries per page.
+        """
+        self.filename = filename
+        self.page_size = page_size
+
+    def _iter_dicts(self):
+        with zopen(self.filename, "rt") as f:
+            first = f.read(1)
+            while first and first.isspace():
+                first = f.read(1)
+            if first == "[":
+                yield from json.loads(first + f.read())
+                return
+            yield json.loads(first + f.readline())
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def pages(self):
+        """Yield (page key, list of entry dicts) tuples."""
+        name = os.path.basename(self.filename)
+        for i, page in enumerate(chunked(self._iter_dicts(), self.page_size)):
+            yield f"{name}:{i * self.page_size}", page
+
+
+def _as_list(v):
+    if isinstance(v, str):
+        return v.split(",")
+    return list(v)
+
+
+def _subsystems(elements):
+    """All chemical systems spanned by subsets of elements, e.g. Li, O, Li-O."""
+    return ["-".join(sorted(els)) for i in range(len(elements)) for els in itertools.combinations(elements, i + 1)]
+
+
+def _build_phase_diagram(entry_dicts):
+    return PhaseDiagram([ComputedEntry.from_dict(d) for d in entry_dicts]).as_dict()
+
+
+def _id_sort_key(material_id):
+    prefix, _, num = material_id.rpartition("-")
+    return (prefix, int(num)) if num.isdigit() else (prefix, 0, num)
+
 
 class MPDB:
     """This module allows you to create a local MP database based on ComputedStructureEntries."""
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, pd_cache_size=128, **kwargs):
         """
         @param args: Pass through to MongoClient. E.g., you can create a connection using uri strings, etc.
+        @param pd_cache_size: Number of phase diagrams kept in memory by get_phase_diagram.
         @param kwargs: Pass through to MongoClient. E.g., you can create a connection using uri strings, etc.
         """
         client = pymongo.MongoClient(*args, **kwargs)
-        db = client.matproj
-        self.collection = db.entries
+        self.db = client.matproj
+        self.collection = self.db.entries
+        self.progress = self.db.entries_progress
+        self.versions = self.db.chemsys_versions
+        self.phase_diagrams = self.db.phase_diagrams
+        self.pd_cache_size = pd_cache_size
+        self._pd_cache = OrderedDict()
+
+    @staticmethod
+    def entry_to_doc(entry):
+        """
+        Convert an entry, or an entry dict, to the document stored in the entries collection.
+
+        @param entry: ComputedStructureEntry or its dict representation.
+        @return: Document with pretty_formula, elements, nelements and chemsys added, and a content_hash
+            of the document used by sync to detect changed entries.
+        """
+        if isinstance(entry, dict):
+            entry = MontyDecoder().process_decoded(entry)
+        comp = entry.composition
+        elements_str = sorted(el.symbol for el in comp.elements)
+        d = entry.as_dict()
+        d["pretty_formula"] = comp.reduced_formula
+        d["elements"] = elements_str
+        d["nelements"] = len(comp)
+        d["chemsys"] = "-".join(elements_str)
+        d["content_hash"] = hashlib.sha1(json.dumps(d, sort_keys=True, cls=MontyEncoder).encode()).hexdigest()
+        return d
 
-    def create(self, criteria=None, property_data: list | None = None):
+    def create(self, criteria=None, property_data: list | None = None, source=None, chunk_size=1000, resume=True):
         """
         Creates the database. Typically only used once.
 
-        @param criteria: Criteria passed to MPRester.get_entries to obtain the entries. None means you get the entire
-            MP database.
+        Entries are fetched page by page from the source, converted and upserted by entry_id in unordered
+        bulk_write chunks, so memory use is bounded by the page size. Completed pages are checkpointed in the
+        entries_progress collection: if a build is interrupted, calling create again skips the completed pages
+        and redoes the others. entry_id is unique, so entries of a redone page, or of pages that shifted
+        between runs, are replaced rather than duplicated. The entry_id index is built first, and the other
+        indexes once at the end.
+
+        @param criteria: Criteria passed to MPRester.get_entries to obtain the entries, e.g. a chemical system
+            or list of them. None means you get the entire MP database. See MPRestEntrySource.
         @param property_data: List of additional property data to obtain. These are stored in the data.* keys.
+        @param source: Entry source with a pages() method, e.g. LocalEntrySource("entries.jsonl.gz") for offline
+            builds. Defaults to MPRestEntrySource(criteria, property_data).
+        @param chunk_size: Number of docs per bulk_write.
+        @param resume: Whether to skip pages checkpointed by a previous run. If False, the checkpoints are
+            cleared first.
+        @return: Number of entries inserted.
+        """
+        source = source or MPRestEntrySource(criteria, property_data=property_data)
+        if not resume:
+            self.progress.drop()
+        status = {d["_id"]: d["complete"] for d in self.progress.find({}, ["complete"])}
+        self._create_entry_id_index()
+        total = 0
+        for key, entries in source.pages():
+            if status.get(key):
+                logger.info(f"Skipping page {key}, which was completed by a previous run.")
+                continue
+            docs = [self.entry_to_doc(e) for e in entries]
+            self.progress.update_one({"_id": key}, {"$set": {"complete": False}}, upsert=True)
+            for chunk in chunked(docs, chunk_size):
+                ops = [pymongo.ReplaceOne({"entry_id": d["entry_id"]}, d, upsert=True) for d in chunk]
+                self.collection.bulk_write(ops, ordered=False)
+            bump_generation(self.db, self.collection.name)
+            self._bump_versions({d["chemsys"] for d in docs})
+            self.progress.update_one({"_id": key}, {"$set": {"complete": True, "nentries": len(docs)}})
+            total += len(docs)
+            logger.info(f"Inserted {len(docs)} entries from page {key} ({total} in total).")
+        self._create_indexes()
+        return total
+
+    def sync(self, criteria=None, property_data: list | None = None, source=None, chunk_size=1000, delete=None):
         """
-        mpr = MPRester()
-        criteria = criteria or {}
-        property_data = property_data or []
-        entries = mpr.get_entries(  # type:ignore[attr-defined]
-            criteria,
-            inc_structure=True,
-            property_data=property_data,
+        Incrementally updates an existing database from the source, instead of rebuilding it with create.
+
+        Each entry from the source is compared by entry_id and content_hash against the stored docs. New and
+        changed entries are upserted with unordered bulk_write batches, and stored entries that the source no
+        longer has are deleted, see delete.
+
+        @param criteria: Criteria passed to MPRester.get_entries. See create.
+        @param property_data: List of additional property data to obtain. See create.
+        @param source: Entry source with a pages() method. Defaults to MPRestEntrySource(criteria, property_data).
+        @param chunk_size: Number of operations per bulk_write.
+        @param delete: Whether to delete stored entries that are not in the source. Defaults to True if criteria
+            is None, i.e. the source covers the whole database, and to False otherwise, as a source narrowed to
+            e.g. a single chemical system would delete the entries of all other systems. Pass False when a
+            custom source only covers part of the database.
+        @return: Diff summary, a dict of the form {"added": [entry_ids], "updated": [entry_ids],
+            "deleted": [entry_ids], "unchanged": int}.
+        """
+        source = source or MPRestEntrySource(criteria, property_data=property_data)
+        if delete is None:
+            delete = criteria is None
+        stored = {}
+        for d in self.collection.find({}, {"entry_id": 1, "content_hash": 1, "chemsys": 1}):
+            stored[d["entry_id"]] = (d.get("content_hash"), d.get("chemsys"))
+        diff = {"added": [], "updated": [], "deleted": [], "unchanged": 0}
+        seen = set()
+        changed_chemsys = set()
+
+        def ops():
+            for key, entries in source.pages():
+                logger.info(f"Comparing page {key}.")
+                for e in entries:
+                    doc = self.entry_to_doc(e)
+                    eid = doc["entry_id"]
+                    seen.add(eid)
+                    if eid not in stored:
+                        diff["added"].append(eid)
+                    elif stored[eid][0] != doc["content_hash"]:
+                        diff["updated"].append(eid)
+                        changed_chemsys.add(stored[eid][1])
+                    else:
+                        diff["unchanged"] += 1
+                        continue
+                    changed_chemsys.add(doc["chemsys"])
+                    yield pymongo.ReplaceOne({"entry_id": eid}, doc, upsert=True)
+
+        for chunk in chunked(ops(), chunk_size):
+            self.collection.bulk_write(chunk, ordered=False)
+        if delete:
+            diff["deleted"] = [eid for eid in stored if eid not in seen]
+            for chunk in chunked(diff["deleted"], chunk_size):
+                self.collection.delete_many({"entry_id": {"$in": chunk}})
+            changed_chemsys.update(stored[eid][1] for eid in diff["deleted"])
+        if diff["added"] or diff["updated"] or diff["deleted"]:
+            bump_generation(self.db, self.collection.name)
+        self._bump_versions(changed_chemsys)
+        logger.info(
+            f"Sync done: {len(diff['added'])} added, {len(diff['updated'])} updated, "
+            f"{len(diff['deleted'])} deleted, {diff['unchanged']} unchanged."
         )
-        docs = []
-        for e in entries:
-            comp = e.composition
-            elements = sorted(e.composition.keys())
-            elements_str = sorted([el.symbol for el in elements])
-            d = e.as_dict()
-            d["pretty_formula"] = comp.reduced_formula
-            d["elements"] = elements_str
-            d["nelements"] = len(comp)
-            d["chemsys"] = "-".join(elements_str)
-            docs.append(d)
-
-        self.collection.insert_many(docs)
+        self._create_indexes()
+        return diff
+
+    def _bump_versions(self, chemsyses):
+        """Increment the version counters of chemical systems whose entries changed."""
+        ops = [pymongo.UpdateOne({"_id": c}, {"$inc": {"version": 1}}, upsert=True) for c in chemsyses if c]
+        if ops:
+            self.versions.bulk_write(ops, ordered=False)
 
+    def _get_versions(self, chemsys):
+        """Versions of all subsystems of a sorted chemsys. The phase diagram depends on all of them."""
+        subsystems = _subsystems(chemsys.split("-"))
+        versions = {d["_id"]: d["version"] for d in self.versions.find({"_id": {"$in": subsystems}})}
+        return {c: versions.get(c, 0) for c in subsystems}
+
+    def get_phase_diagram(self, chemsys, additional_criteria=None):
+        """
+        Get the phase diagram of a chemical system, built from the ComputedEntries of all its subsystems.
+
+        Phase diagrams are cached in memory (LRU, see pd_cache_size) and persisted in the phase_diagrams
+        collection. Every create or sync bumps a version counter for each chemical system whose entries
+        changed, and a cached diagram is only used if the versions of all its subsystems are unchanged, so
+        only the version lookup hits Mongo when the cache is warm.
+
+        @param chemsys: Chemical system, e.g. "Li-Fe-O" or ["Li", "Fe", "O"].
+        @param additional_criteria: Additional criteria to filter entries. Diagrams built with additional
+            criteria are not cached.
+        @return: PhaseDiagram.
+        """
+        elements = sorted(chemsys.split("-") if isinstance(chemsys, str) else chemsys)
+        if additional_criteria:
+            return PhaseDiagram(self.get_entries_in_chemsys(elements, additional_criteria, inc_structure=False))
+        chemsys = "-".join(elements)
+        versions = self._get_versions(chemsys)
+
+        cached = self._pd_cache.get(chemsys)
+        if cached is not None and cached[0] == versions:
+            self._pd_cache.move_to_end(chemsys)
+            return cached[1]
+        doc = self.phase_diagrams.find_one({"_id": chemsys, "versions": versions})
+        if doc is not None:
+            pd = PhaseDiagram.from_dict(doc["phase_diagram"])
+        else:
+            pd = PhaseDiagram(self.get_entries_in_chemsys(elements, inc_structure=False))
+            self._save_phase_diagram(chemsys, versions, pd.as_dict())
+        self._cache_phase_diagram(chemsys, versions, pd)
+        return pd
+
+    def warm_phase_diagrams(self, chemsyses, ncpus=None):
+        """
+        Build and persist the phase diagrams of many chemical systems, computing the hulls in parallel.
+        Diagrams that are already persisted and up to date are skipped.
+
+        @param chemsyses: List of chemical systems, e.g. ["Li-O", "Li-Fe-O"].
+        @param ncpus: Number of processes. Defaults to the number of cpus.
+        @return: List of the chemical systems that were (re)built.
+        """
+        todo = []
+        for chemsys in {"-".join(sorted(c.split("-") if isinstance(c, str) else c)) for c in chemsyses}:
+            versions = self._get_versions(chemsys)
+            if self.phase_diagrams.count_documents({"_id": chemsys, "versions": versions}, limit=1) == 0:
+                todo.append((chemsys, versions))
+        todo.sort()
+
+        def jobs():
+            for chemsys, _ in todo:
+                yield [e.as_dict() for e in self.get_entries_in_chemsys(chemsys, inc_structure=False)]
+
+        with multiprocessing.Pool(ncpus) as pool:
+            for (chemsys, versions), pd_dict in zip(todo, pool.imap(_build_phase_diagram, jobs()), strict=True):
+                self._save_phase_diagram(chemsys, versions, pd_dict)
+                logger.info(f"Built phase diagram for {chemsys}.")
+        return [c for c, _ in todo]
+
+    def _save_phase_diagram(self, chemsys, versions, pd_dict):
+        doc = {"versions": versions, "phase_diagram": json.loads(json.dumps(pd_dict, cls=MontyEncoder))}
+        self.phase_diagrams.replace_one({"_id": chemsys}, doc, upsert=True)
+
+    def _cache_phase_diagram(self, chemsys, versions, pd):
+        self._pd_cache[chemsys] = (versions, pd)
+        self._pd_cache.move_to_end(chemsys)
+        while len(self._pd_cache) > self.pd_cache_size:
+            self._pd_cache.popitem(last=False)
+
+    def _create_entry_id_index(self):
+        info = self.collection.index_information().get("entry_id_1")
+        if info is not None and not info.get("unique"):
+            # Databases built by earlier versions have a non-unique index.
+            self.collection.drop_index("entry_id_1")
+        self.collection.create_index("entry_id", unique=True)
+
+    def _create_indexes(self):
         # These create useful indexes to speed up querying.
-        self.collection.create_index("entry_id")
+        self._create_entry_id_index()
         self.collection.create_index("pretty_formula")
         self.collection.create_index("chemsys")
         self.collection.create_index("nelements")
         self.collection.create_index("elements")
 
-    def get_entries_in_chemsys(self, elements, additional_criteria=None):
+    def get_entries_in_chemsys(
+        self,
+        elements,
+        additional_criteria=None,
+        inc_structure=True,
+        property_data: list | None = None,
+        ncpus=1,
+        batch_size=1000,
+    ):
         """
         Method get_entries_in_chemsys.
 
         Parameters:
         elements (str): A string of chemical elements separated by '-'. Can also be a list of chemical elements.
         additional_criteria (dict, optional): Additional criteria to filter entries. Default is None.
+        inc_structure (bool): Whether to return ComputedStructureEntries. If False, the structures are not
+            fetched and lighter ComputedEntries are returned, which is all that e.g. a phase diagram needs.
+            Default is True.
+        property_data (list, optional): Keys of the data.* property blobs to fetch. Default is None, which fetches
+            all of them. Use [] to fetch none.
+        ncpus (int): Number of processes used to decode structures. Only used if inc_structure is True.
+            Default is 1.
+        batch_size (int): Cursor batch size. Default is 1000.
 
         Returns:
-        list: A list of ComputedStructureEntry objects retrieved based on the given chemical systems and criteria.
+        list: A list of ComputedStructureEntry (or ComputedEntry) objects retrieved based on the given chemical
+        systems and criteria.
 
         """
         if isinstance(elements, str):
             elements = elements.split("-")
 
-        all_chemsyses = []
-        for i in range(len(elements)):
-            for els in itertools.combinations(elements, i + 1):
-                all_chemsyses.append("-".join(sorted(els)))
-
-        criteria = {"chemsys": {"$in": all_chemsyses}}
+        criteria = {"chemsys": {"$in": _subsystems(elements)}}
         if additional_criteria:
             criteria.update(additional_criteria)
 
-        entries = []
-        for r in self.collection.find(criteria):
-            entries.append(ComputedStructureEntry.from_dict(r))
+        fields = ["energy", "composition", "entry_id", "correction", "energy_adjustments", "parameters"]
+        fields += ["data"] if property_data is None else [f"data.{p}" for p in property_data]
+        if inc_structure:
+            fields.append("structure")
+        projection = {"_id": 0, **dict.fromkeys(fields, 1)}
+        cursor = self.collection.find(criteria, projection, batch_size=batch_size)
 
-        return entries
+        if not inc_structure:
+            return [ComputedEntry.from_dict(r) for r in cursor]
+        if ncpus > 1:
+            with multiprocessing.Pool(ncpus) as pool:
+                return list(pool.imap(ComputedStructureEntry.from_dict, cursor, chunksize=max(1, batch_size // ncpus)))
+        return [ComputedStructureEntry.from_dict(r) for r in cursor]
@@ -0,0 +1,144 @@
+"""
+Size-aware offloading of large fields of task docs to GridFS.
+
+MongoDB docs are limited to 16 MB, and big fields (ionic steps, eigenvalues,
+OUTCAR dicts, etc.) slow down every query that touches the doc even if they
+are not projected. offload_large_fields moves every sub-document or array
+whose BSON size exceeds a threshold into GridFS, compressed, and leaves a
+small reference of the form::
+
+    {"@gridfs": ObjectId(...), "collection": "offload_fs", "nbytes": 1234567}
+
+in its place, where nbytes is the uncompressed BSON size. The codec (see
+pymatgen.db.compression) is recorded in the GridFS file metadata. The
+smallest enclosing values above the threshold are offloaded, e.g.
+calculations.0.output.ionic_steps rather than the whole calculations array.
+OffloadResolver, which QueryEngine installs as a result_post function when
+created with offload_fs="offload_fs", replaces references in query results
+with the original values. Only the projected fields are returned by Mongo,
+so only those are fetched from GridFS. Paths inside an offloaded value
+cannot be projected or queried on, as Mongo only sees the reference.
+"""
+
+from __future__ import annotations
+
+import bson
+
+from .compression import DEFAULT_CODECS, get_payload, put_payload
+
+#: Default GridFS collection for offloaded fields.
+OFFLOAD_FS = "offload_fs"
+
+#: Default size threshold in bytes above which a field is offloaded.
+OFFLOAD_THRESHOLD = 1 << 20
+
+#: Key that marks a reference to an offloaded value.
+REF_KEY = "@gridfs"
+
+
+def _bson_size(value):
+    return len(bson.encode({"v": value}))
+
+
+def is_ref(value):
+    """Whether a value is a reference to an offloaded field."""
+    return isinstance(value, dict) and REF_KEY in value
+
+
+def offload_large_fields(
+    doc, db, collection=OFFLOAD_FS, threshold=OFFLOAD_THRESHOLD, exclude=(), codec=DEFAULT_CODECS["offload"], level=None
+):
+    """
+    Move large fields of a doc to GridFS in place.
+
+    Args:
+        doc: Task doc. Modified in place.
+        db: pymongo Database to write to.
+        collection: GridFS collection to write to.
+        threshold: Size in bytes above which a sub-document or array is offloaded.
+        exclude: Top-level keys that are never offloaded, e.g. fields that are queried on.
+        codec: Compression codec, see pymatgen.db.compression.
+        level: Compression level. None for the codec default.
+
+    Returns:
+        List of the dotted paths that were offloaded.
+    """
+    offloaded = []
+    fs = None
+
+    def put(value, path):
+        nonlocal fs
+        if fs is None:
+            import gridfs
+
+            fs = gridfs.GridFS(db, collection)
+        data = bson.encode({"v": value})
+        fs_id = put_payload(fs, data, codec, level=level, path=path, format="bson")
+        offloaded.append(path)
+        return {REF_KEY: fs_id, "collection": collection, "nbytes": len(data)}
+
+    def visit(value, path):
+        # Offload the deepest values above the threshold first, then the parent if still too big.
+        if isinstance(value, dict):
+            items = value.items()
+        elif isinstance(value, list):
+            items = enumerate(value)
+        else:
+            return value
+        if _bson_size(value) <= threshold:
+            return value
+        for k, v in list(items):
+            value[k] = visit(v, f"{path}.{k}")
+        if _bson_size(value) > threshold:
+            return put(value, path)
+        return value
+
+    for key in list(doc):
+        if key not in exclude and key != "_id":
+            doc[key] = visit(doc[key], key)
+    return offloaded
+
+
+def get_offloaded(fs, ref):
+    """Read the value of an offloaded field given its reference."""
+    return bson.decode(get_payload(fs, ref[REF_KEY]))["v"]
+
+
+class OffloadResolver:
+    """
+    A QueryEngine result_post function that replaces references to offloaded
+    fields in a result with their values. The GridFS handle is created on the
+    first reference found, so collections without offloaded fields pay only
+    for a walk over the projected fields.
+    """
+
+    def __init__(self, db, collection=OFFLOAD_FS):
+        """
+        Args:
+            db: pymongo Database.
+            collection: GridFS collection of the offloaded fields.
+        """
+        self.db = db
+        self.collection = collection
+        self._fs = None
+
+    def _resolve(self, value):
+        if isinstance(value, dict):
+            if REF_KEY in value:
+                if self._fs is None:
+                    import gridfs
+
+                    self._fs = gridfs.GridFS(self.db, self.collection)
+                return self._resolve(get_offloaded(self._fs, value))
+            for k, v in value.items():
+                if isinstance(v, dict | list):
+                    value[k] = self._resolve(v)
+        elif isinstance(value, list):
+            for i, v in enumerate(value):
+                if isinstance(v, dict | list):
+                    value[i] = self._resolve(v)
+        return value
+
+    def __call__(self, record):
+        """Resolve references in a record in place."""
+        self._resolve(record)
@@ -13,24 +13,109 @@ __email__ = "shyuep@gmail.com"
 __status__ = "Production"
 __date__ = "Mar 2 2013"
 
+import copy
+import datetime
 import itertools
 import json
 import logging
 import os
-import zlib
+import queue
+import threading
+import time
 from collections import OrderedDict
 from collections.abc import Iterable
 
-import gridfs
+import bson
 import pymongo
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
 
-from pymatgen.core import Composition, Structure
-from pymatgen.electronic_structure.core import Orbital, Spin
-from pymatgen.electronic_structure.dos import CompleteDos, Dos
-from pymatgen.entries.computed_entries import ComputedEntry, ComputedStructureEntry
+from .config import CONNECTION_OPTION_KEYS
+
+# pymatgen and gridfs are imported in the methods that need them, which keeps
+# `import pymatgen.db.query_engine` (and hence mgdb and worker start-up) fast.
 
 _log = logging.getLogger("mg." + __name__)
 
+#: find kwargs that change the results of a query, and hence are part of its cache key.
+_CACHE_KEY_KWARGS = ("sort", "limit", "skip", "hint", "collation", "min", "max")
+#: find kwargs that only change how results are read. Queries with other kwargs are not cached.
+_CACHE_IGNORED_KWARGS = ("batch_size", "allow_disk_use", "no_cursor_timeout", "max_time_ms", "comment", "cursor_type")
+
+#: Read preference modes, keyed by their lower case name without underscores.
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primarypreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondarypreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def make_read_preference(mode, tag_sets=None, max_staleness=None):
+    """
+    Make a pymongo read preference.
+
+    Args:
+        mode (str): Read preference mode, e.g. "secondaryPreferred" or
+            "secondary_preferred". A pymongo read preference is returned as is.
+        tag_sets (list): Replica set tag sets, tried in order, e.g.
+            [{"nodeType": "ANALYTICS"}, {}] to prefer analytics nodes and fall
+            back to any secondary.
+        max_staleness (int): Maximum replication lag in seconds of the
+            secondaries to read from. At least 90. None for no limit.
+
+    Returns:
+        pymongo read preference.
+
+    Raises:
+        ValueError: If the mode is unknown, or tag sets or max staleness are
+            given for the primary.
+    """
+    if isinstance(mode, tuple(READ_PREFERENCES.values())):
+        return mode
+    try:
+        cls = READ_PREFERENCES[mode.lower().replace("_", "")]
+    except KeyError:
+        raise ValueError(f"Unknown read preference {mode}. Supported modes are {list(READ_PREFERENCES)}.") from None
+    if cls is Primary:
+        if tag_sets or max_staleness is not None:
+            raise ValueError("Tag sets and max staleness cannot be used with the primary read preference.")
+        return Primary()
+    return cls(tag_sets=tag_sets, max_staleness=-1 if max_staleness is None else max_staleness)
+
+
+def _read_options(read_preference=None, tag_sets=None, max_staleness=None, read_concern=None):
+    """Database or collection options for get_database and with_options."""
+    options = {}
+    if read_preference is not None:
+        options["read_preference"] = make_read_preference(read_preference, tag_sets, max_staleness)
+    elif tag_sets or max_staleness is not None:
+        raise ValueError("Tag sets and max staleness require a read preference.")
+    if read_concern is not None:
+        options["read_concern"] = read_concern if isinstance(read_concern, ReadConcern) else ReadConcern(read_concern)
+    return options
+
+
+#: Sort order of incremental pulls, see QueryEngine.query_since. mgdb optimize indexes it.
+CHANGES_SORT = [("last_updated", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+
+
+def _updated_after_criteria(mark):
+    """Criteria for the docs updated after a high-water mark, see QueryEngine.query_since."""
+    if not isinstance(mark, dict):
+        return {"last_updated": {"$gt": mark}}
+    if mark.get("last_updated") is None:
+        return {"last_updated": {"$ne": None}}
+    if mark.get("_id") is None:
+        return {"last_updated": {"$gt": mark["last_updated"]}}
+    return {
+        "$or": [
+            {"last_updated": {"$gt": mark["last_updated"]}},
+            {"last_updated": mark["last_updated"], "_id": {"$gt": mark["_id"]}},
+        ]
+    }
+
 
 class QueryEngine:
     """This class defines a QueryEngine interface to a Mongo Collection based on
@@ -82,6 +167,15 @@ class QueryEngine:
         result_post=None,
         connection=None,
         replicaset=None,
+        offload_fs=None,
+        read_preference=None,
+        tag_sets=None,
+        max_staleness=None,
+        read_concern=None,
+        max_pool_size=None,
+        min_pool_size=None,
+        client_options=None,
+        cache=None,
         **ignore,
     ):
         """Constructor.
@@ -131,6 +225,36 @@ class QueryEngine:
                 Function takes one arg, the document for the current record,
                 that is modified in-place.
             replicaset: Replica set to use.
+            offload_fs (str): GridFS collection of fields offloaded by the drone
+                (see pymatgen.db.offload), usually "offload_fs". If given,
+                references to offloaded fields in query results are replaced
+                by their values, which are only read for the fields that are
+                returned. Paths inside an offloaded value cannot be projected
+                or queried on, see query. Defaults to None, i.e. refs are
+                returned as is.
+            read_preference (str): Read preference, e.g. "secondaryPreferred"
+                to send reads to secondaries and leave the primary to ingestion.
+                See make_read_preference. Defaults to the connection's, i.e.
+                the primary. Use with_options to override it per query.
+            tag_sets (list): Replica set tag sets for the read preference,
+                e.g. [{"nodeType": "ANALYTICS"}] for Atlas analytics nodes.
+            max_staleness (int): Maximum replication lag in seconds of the
+                secondaries to read from.
+            read_concern (str): Read concern level, e.g. "majority" or "local".
+            max_pool_size (int): Maximum number of connections in the pool.
+            min_pool_size (int): Minimum number of connections in the pool.
+            client_options (dict): Other pymongo.MongoClient options, e.g.
+                {"maxIdleTimeMS": 60000}. Ignored if `connection` is given,
+                as are the pool sizes.
+            cache (pymatgen.db.cache.QueryCache): Cache for the results of
+                query and get_entries. None, the default, disables caching.
+                Cached results are invalidated when the drone,
+                pymatgen.db.synth.insert_docs, MPDB or MongoStructureSink
+                write to the collection; other writers must call
+                pymatgen.db.cache.bump_generation. Cached queries return a
+                QueryListResults, whose len() raises TypeError for queries
+                with more results than the cache's max_results, which are
+                streamed rather than stored.
             **ignore: Not used.
         """
         self.host = host
@@ -138,21 +262,30 @@ class QueryEngine:
         self.replicaset = replicaset
         self.database_name = database
         if connection is None:
+            kwargs = dict(client_options or {})
             # can't pass replicaset=None to MongoClient (fails validation)
             if self.replicaset:
-                self.connection = pymongo.MongoClient(
-                    self.host, self.port, replicaset=self.replicaset, username=user, password=password
-                )
-            else:
-                self.connection = pymongo.MongoClient(self.host, self.port, username=user, password=password)
+                kwargs["replicaset"] = self.replicaset
+            if max_pool_size is not None:
+                kwargs["maxPoolSize"] = max_pool_size
+            if min_pool_size is not None:
+                kwargs["minPoolSize"] = min_pool_size
+            self.connection = pymongo.MongoClient(self.host, self.port, username=user, password=password, **kwargs)
         else:
             self.connection = connection
-        self.db = self.connection[database]
+        self.db = self.connection.get_database(
+            database, **_read_options(read_preference, tag_sets, max_staleness, read_concern)
+        )
         self.collection_name = collection
+        self.cache = cache
         self.set_aliases_and_defaults(aliases_config=aliases_config, default_properties=default_properties)
         # Post-processing functions
         self.query_post = query_post or []
-        self.result_post = result_post or []
+        self.result_post = list(result_post or [])
+        if offload_fs:
+            from .offload import OffloadResolver
+
+            self.result_post.append(OffloadResolver(self.db, offload_fs))
 
     @property
     def collection_name(self):
@@ -168,6 +301,38 @@ class QueryEngine:
         self._collection_name = value
         self.collection = self.db[value]
 
+    def with_options(self, read_preference=None, tag_sets=None, max_staleness=None, read_concern=None):
+        """
+        Get a copy of this QueryEngine that reads with other options.
+
+        The copy shares the connection, aliases and post-processing. This is
+        meant to send heavy analytical scans to secondaries or analytics
+        nodes while the rest of the application keeps reading from the
+        primary::
+
+            analytics = qe.with_options("secondary", tag_sets=[{"nodeType": "ANALYTICS"}])
+            entries = analytics.get_entries({"chemsys": "Li-Fe-O"})
+
+        Args:
+            read_preference: Read preference, see make_read_preference. None
+                keeps the current one.
+            tag_sets: Replica set tag sets for the read preference.
+            max_staleness: Maximum replication lag of secondaries, in seconds.
+            read_concern: Read concern level. None keeps the current one.
+
+        Returns:
+            QueryEngine
+        """
+        from .offload import OffloadResolver
+
+        qe = copy.copy(self)
+        qe.db = self.db.with_options(**_read_options(read_preference, tag_sets, max_staleness, read_concern))
+        qe.collection_name = self.collection_name
+        qe.result_post = [
+            OffloadResolver(qe.db, f.collection) if isinstance(f, OffloadResolver) else f for f in self.result_post
+        ]
+        return qe
+
     def set_aliases_and_defaults(self, aliases_config=None, default_properties=None):
         """
         Set the alias config and defaults to use. Typically used when
@@ -215,6 +380,7 @@ class QueryEngine:
         inc_structure=False,
         optional_data=None,
         additional_criteria=None,
+        **kwargs,
     ):
         """
         Gets all entries in a chemical system, e.g. Li-Fe-O will return all
@@ -242,6 +408,10 @@ class QueryEngine:
             additional_criteria:
                 Added ability to provide additional criteria other than just
                 the chemical system.
+            **kwargs:
+                Cursor options passed to query, e.g. batch_size,
+                no_cursor_timeout, allow_disk_use, exhaust, session or
+                read_preference.
 
         Returns:
             List of ComputedEntries in the chemical system.
@@ -254,9 +424,9 @@ class QueryEngine:
         crit = {"chemsys": {"$in": chemsys_list}}
         if additional_criteria is not None:
             crit.update(additional_criteria)
-        return self.get_entries(crit, inc_structure, optional_data=optional_data)
+        return self.get_entries(crit, inc_structure, optional_data=optional_data, **kwargs)
 
-    def get_entries(self, criteria, inc_structure=False, optional_data=None):
+    def get_entries(self, criteria, inc_structure=False, optional_data=None, cache=True, **kwargs):
         """
         Get ComputedEntries satisfying a particular criteria.
 
@@ -279,11 +449,44 @@ class QueryEngine:
             optional_data:
                 Optional data to include with the entry. This allows the data
                 to be access via entry.data[key].
+            cache:
+                Whether to use the QueryEngine's cache, if it has one. The
+                entries are cached, so hits also save building them.
+            **kwargs:
+                Cursor options passed to query, e.g. batch_size,
+                no_cursor_timeout, allow_disk_use, exhaust, session or
+                read_preference.
 
         Returns:
             List of pymatgen.entries.ComputedEntries satisfying criteria.
         """
-        all_entries = []
+        key = None
+        if cache:
+            key = self._cache_key("entries", self._parse_criteria(criteria), kwargs, inc_structure, optional_data)
+            if key is not None:
+                entries = self.cache.get(key)
+                if entries is not None:
+                    return entries
+        entries = list(
+            self.iter_entries(criteria, inc_structure=inc_structure, optional_data=optional_data, cache=False, **kwargs)
+        )
+        if key is not None and len(entries) <= self.cache.max_results:
+            self.cache.set(key, entries)
+        return entries
+
+    def iter_entries(self, criteria, inc_structure=False, optional_data=None, **kwargs):
+        r"""
+        Same as get_entries, but yields the ComputedEntries one at a time as
+        they are read from the cursor instead of returning a list, so that
+        large result sets can be processed without holding all entries in
+        memory.
+
+        :param criteria: Criteria obeying the same syntax as query.
+        :param inc_structure: Whether to include a structure with the ComputedEntry.
+        :param optional_data: Optional data to include with the entry.
+        :param \*\*kwargs: Cursor options passed to query, e.g. batch_size or exhaust.
+        :return: Generator of pymatgen.entries.ComputedEntries satisfying criteria.
+        """
         optional_data = [] if not optional_data else list(optional_data)
         optional_data.append("oxide_type")
         fields = list(optional_data)
@@ -305,7 +508,10 @@ class QueryEngine:
         if inc_structure:
             fields.append("output.crystal")
 
-        for c in self.query(fields, criteria):
+        from pymatgen.core import Composition, Structure
+        from pymatgen.entries.computed_entries import ComputedEntry, ComputedStructureEntry
+
+        for c in self.query(fields, criteria, **kwargs):
             func = c["pseudo_potential.functional"]
             labels = c["pseudo_potential.labels"]
             symbols = [f"{func} {label}" for label in labels]
@@ -318,29 +524,26 @@ class QueryEngine:
                 "potcar_spec": c.get("input.potcar_spec"),
                 "xc_override": c.get("input.xc_override"),
             }
-            optional_data = {k: c[k] for k in optional_data}
+            data = {k: c[k] for k in optional_data}
             if inc_structure:
                 struct = Structure.from_dict(c["output.crystal"])
-                entry = ComputedStructureEntry(
+                yield ComputedStructureEntry(
                     struct,
                     c["energy"],
                     0.0,
                     parameters=parameters,
-                    data=optional_data,
+                    data=data,
                     entry_id=c["task_id"],
                 )
             else:
-                entry = ComputedEntry(
+                yield ComputedEntry(
                     Composition(c["unit_cell_formula"]),
                     c["energy"],
                     0.0,
                     parameters=parameters,
-                    data=optional_data,
+                    data=data,
                     entry_id=c["task_id"],
                 )
-            all_entries.append(entry)
-
-        return all_entries
 
     def _parse_criteria(self, criteria):
         """
@@ -362,9 +565,13 @@ class QueryEngine:
 
         for key, crit in list(criteria.items()):
             if key in ["normalized_formula", "reduced_cell_formula"]:
+                from pymatgen.core import Composition
+
                 comp = Composition(crit)
                 parsed_crit["pretty_formula"] = comp.reduced_formula
             elif key == "unit_cell_formula":
+                from pymatgen.core import Composition
+
                 comp = Composition(crit)
                 crit = comp.as_dict()
                 for el, amt in crit.items():
@@ -381,7 +588,21 @@ class QueryEngine:
         """Wrapper for pymongo.Collection.ensure_index."""
         return self.collection.ensure_index(key, unique=unique)
 
-    def query(self, properties=None, criteria=None, distinct_key=None, **kwargs):
+    def query(
+        self,
+        properties=None,
+        criteria=None,
+        distinct_key=None,
+        read_preference=None,
+        read_concern=None,
+        exhaust=False,
+        after_id=None,
+        key_range=None,
+        updated_after=None,
+        raw=False,
+        cache=True,
+        **kwargs,
+    ):
         r"""
         Convenience method for database access.  All properties and criteria
         can be specified using simplified names defined in Aliases.  You can
@@ -403,11 +624,50 @@ class QueryEngine:
         returned as r['analysis'] and then the subkeys can be accessed in the
         usual form, i.e., r['analysis']['e_above_hull']
 
+        Fields offloaded to GridFS by the drone (see pymatgen.db.offload) are
+        stored as refs, which the server cannot look into. Criteria on paths
+        inside an offloaded field match nothing, and projecting such a path
+        returns None instead of the value. Project the offloaded field itself,
+        e.g. "calculations.output.ionic_steps" rather than
+        "calculations.output.ionic_steps.e_fr_energy".
+
         :param properties: Properties to query for. Defaults to None which means all supported properties.
         :param criteria: Criteria to query for as a dict.
         :param distinct_key: If not None, the key for which to get distinct results
+        :param read_preference: Read preference for this query only, e.g. "secondary".
+            See make_read_preference. Use with_options for tag sets and max staleness.
+        :param read_concern: Read concern level for this query only.
+        :param exhaust: Use an exhaust cursor, for which the server streams all
+            batches without waiting for getMore requests. Fastest for reading a
+            whole large result set, but not supported through mongos or with limit.
+        :param after_id: Only return docs with an _id greater than this. Used
+            with sort=[("_id", 1)] to resume a scan, see scan.
+        :param key_range: (key, lo, hi) to only return docs with lo <= key < hi.
+            Either bound may be None. key may be an alias. Used by parallel_query.
+            If only lo is None, docs without key, or whose key is of another
+            BSON type than hi, are returned as well.
+        :param updated_after: Only return docs updated after this high-water
+            mark, a last_updated datetime or a {"last_updated": ..., "_id": ...}
+            dict. Used with sort=[("last_updated", 1), ("_id", 1)] to pull
+            changes incrementally, see query_since.
+        :param raw: Return the documents as bson RawBSONDocuments, which are
+            only decoded as they are accessed, one level at a time. Properties
+            are mapped as usual, but sub-documents stay raw. Use this to pass
+            results through to a JSON or BSON writer (see pymatgen.db.export)
+            without decoding whole documents to Python objects. result_post
+            functions are not applied, so offloaded fields are returned as
+            references.
+        :param cache: Whether to use the QueryEngine's cache, if it has one.
+            Cached queries return a QueryListResults on a list of the results
+            (or a generator, if there are more than the cache's max_results),
+            so cursor methods such as explain are not available. Queries with
+            raw, after_id, key_range, updated_after, a session or other find
+            kwargs than sort, limit, skip, hint, collation, min, max and those
+            that only tune the cursor are never cached.
         :param \*\*kwargs: Other kwargs supported by pymongo.collection.find.
-            Useful examples are limit, skip, sort, etc.
+            Useful examples are limit, skip, sort, batch_size (documents per
+            round trip, 101 for the first batch by default), no_cursor_timeout
+            (for long scans), allow_disk_use (for large sorts) and session.
         :return: A QueryResults Iterable, which is somewhat like pymongo's
             cursor except that it performs mapping. In general, the dev does
             not need to concern himself with the form. It is sufficient to know
@@ -422,13 +682,304 @@ class QueryEngine:
         if self.query_post:
             for func in self.query_post:
                 func(crit, props)
-        cur = self.collection.find(filter=crit, projection=props, **kwargs)
+        if after_id is not None:
+            id_crit = {"_id": {"$gt": after_id}}
+            crit = {"$and": [crit, id_crit]} if "_id" in crit else {**crit, **id_crit}
+        if key_range is not None:
+            key, lo, hi = key_range
+            key = self.aliases.get(key, key)
+            if lo is None and hi is not None:
+                # Unlike $lt, this also matches docs without the key or with another BSON type.
+                bounds = {"$not": {"$gte": hi}}
+            else:
+                bounds = {op: v for op, v in (("$gte", lo), ("$lt", hi)) if v is not None}
+            if bounds:
+                crit = {"$and": [crit, {key: bounds}]} if key in crit else {**crit, key: bounds}
+        if updated_after is not None:
+            mark_crit = _updated_after_criteria(updated_after)
+            crit = {"$and": [crit, mark_crit]} if crit else mark_crit
+        cache_key = None
+        if cache and not raw and after_id is None and key_range is None and updated_after is None:
+            cache_key = self._cache_key("query", crit, kwargs, properties, props, distinct_key)
+            if cache_key is not None:
+                rows = self.cache.get(cache_key)
+                if rows is not None:
+                    return QueryListResults(None, rows)
+        if exhaust:
+            kwargs["cursor_type"] = pymongo.CursorType.EXHAUST
+        coll = self.collection
+        options = _read_options(read_preference, read_concern=read_concern)
+        if raw:
+            from bson.raw_bson import RawBSONDocument
+
+            options["codec_options"] = coll.codec_options.with_options(document_class=RawBSONDocument)
+        if options:
+            coll = coll.with_options(**options)
+        cur = coll.find(filter=crit, projection=props, **kwargs)
+        postprocess = None if raw else self.result_post
 
         if distinct_key is not None:
             cur = cur.distinct(distinct_key)
-            return QueryListResults(prop_dict, cur, postprocess=self.result_post)
+            results = QueryListResults(prop_dict, cur, postprocess=postprocess)
+        else:
+            results = QueryResults(prop_dict, cur, postprocess=postprocess)
+        if cache_key is None:
+            return results
+
+        it = iter(results)
+        rows = list(itertools.islice(it, self.cache.max_results + 1))
+        if len(rows) > self.cache.max_results:
+            return QueryListResults(None, itertools.chain(rows, it))
+        self.cache.set(cache_key, rows)
+        return QueryListResults(None, rows)
+
+    def _cache_key(self, kind, crit, kwargs, *parts):
+        """
+        Key of a query in self.cache, or None if there is no cache or the
+        query has kwargs that are not known to be safe to cache.
+        """
+        if self.cache is None:
+            return None
+        options = {}
+        for k, v in kwargs.items():
+            if k in _CACHE_KEY_KWARGS:
+                options[k] = v
+            elif v is not None and k not in _CACHE_IGNORED_KWARGS:
+                return None
+        return self.cache.make_key(repr(self.connection), self.collection, kind, crit, options, *parts)
+
+    def scan(self, properties=None, criteria=None, resume_after=None, max_retries=3, **kwargs):
+        r"""
+        Same as query, but resumes the scan if the cursor is lost.
+
+        Results are returned in _id order, and the cursor is transparently
+        reopened after the last _id seen if it is killed or the connection
+        drops. Use this for long scans, e.g. exports. The last _id is
+        available as the `last_id` attribute of the returned iterable, so that
+        a scan interrupted for other reasons can be resumed later::
+
+            scan = qe.scan(["task_id", "energy"], {"nelements": 3}, batch_size=1000)
+            for r in scan:
+                ...  # save scan.last_id every now and then
+
+            qe.scan(["task_id", "energy"], {"nelements": 3}, resume_after=saved_id)
+
+        :param properties: Properties to query for.
+        :param criteria: Criteria to query for as a dict.
+        :param resume_after: Start after the doc with this _id.
+        :param max_retries: Maximum number of times the cursor is reopened.
+        :param \*\*kwargs: Other kwargs supported by query, except sort. If
+            no_cursor_timeout is set, the scan runs in a session that is
+            refreshed periodically so the server does not reap it.
+        :return: ResumableScan
+        """
+        return ResumableScan(self, properties, criteria, resume_after=resume_after, max_retries=max_retries, **kwargs)
 
-        return QueryResults(prop_dict, cur, postprocess=self.result_post)
+    def query_since(self, since=None, properties=None, criteria=None, max_retries=3, **kwargs):
+        r"""
+        Docs updated after a high-water mark.
+
+        This is for consumers that keep a copy of the collection in sync
+        without pulling it in full. The drone sets last_updated on every
+        insert and update, and mgdb optimize indexes it. Results are returned
+        in (last_updated, _id) order, so the mark of the last result seen can
+        be saved and passed back later::
+
+            changes = qe.query_since(saved_mark, ["task_id", "energy"])
+            for r in changes:
+                ...
+            saved_mark = changes.high_water_mark
+
+        The mark is a dict of a datetime and an ObjectId, which can be saved
+        with bson.json_util or to Mongo. Tasks written without a
+        last_updated, and deletions, are not seen. last_updated is the time
+        on the inserting host, so if several hosts insert, consumers that
+        need every change should pass back a mark a little older than the
+        one returned, e.g. {"last_updated": mark["last_updated"] - lag}.
+
+        :param since: High-water mark returned by a previous call, or a
+            datetime to get the docs updated after it, or None for all docs
+            with a last_updated.
+        :param properties: Properties to query for. last_updated is always
+            included.
+        :param criteria: Criteria to query for as a dict.
+        :param max_retries: Maximum number of times the cursor is reopened,
+            see scan.
+        :param \*\*kwargs: Other kwargs supported by query, except sort.
+        :return: ChangeScan, with the mark in its high_water_mark attribute.
+        """
+        return ChangeScan(self, properties, criteria, since=since, max_retries=max_retries, **kwargs)
+
+    def iter_changes(
+        self,
+        since=None,
+        properties=None,
+        criteria=None,
+        batch_size=1000,
+        follow=False,
+        poll_interval=10,
+        stop=None,
+        **kwargs,
+    ):
+        r"""
+        Pull the docs updated after a high-water mark in batches.
+
+        See query_since. Yields (results, high_water_mark) tuples, so that
+        the mark can be saved once a batch has been processed::
+
+            for batch, mark in qe.iter_changes(saved_mark, ["task_id", "energy"]):
+                process(batch)
+                save(mark)
+
+        :param since: High-water mark, datetime or None, see query_since.
+        :param properties: Properties to query for.
+        :param criteria: Criteria to query for as a dict.
+        :param batch_size: Maximum number of results per batch.
+        :param follow: Keep polling for changes once caught up, until stop is
+            set, instead of returning.
+        :param poll_interval: Seconds between polls when following.
+        :param stop: threading.Event to stop following.
+        :param \*\*kwargs: Other kwargs supported by query, except sort.
+        :return: Generator of (list of results, high-water mark) tuples.
+        """
+        kwargs.setdefault("batch_size", batch_size)
+        mark = since
+        while True:
+            changes = self.query_since(mark, properties, criteria, **kwargs)
+            batch = []
+            for r in changes:
+                batch.append(r)
+                if len(batch) >= batch_size:
+                    yield batch, changes.high_water_mark
+                    batch = []
+            if batch:
+                yield batch, changes.high_water_mark
+            mark = changes.high_water_mark
+            if not follow or (stop is not None and stop.wait(poll_interval)):
+                return
+            if stop is None:
+                time.sleep(poll_interval)
+
+    def parallel_query(
+        self,
+        properties=None,
+        criteria=None,
+        nworkers=4,
+        split_key="_id",
+        split_method="sample",
+        sample_size=None,
+        **kwargs,
+    ):
+        r"""
+        Same as query, but splits the criteria into `nworkers` disjoint ranges
+        of `split_key` and reads each range with its own cursor in its own
+        thread. Results are yielded in no particular order as they arrive.
+        The alias mapping and result_post functions run in the worker threads,
+        and pymongo releases the GIL while waiting on the network and while
+        decoding BSON, so a full scan is no longer bound by one round trip at
+        a time.
+
+        Threads are used rather than processes. Results would have to be
+        pickled back to the parent process, which costs about as much as
+        decoding them in the first place.
+
+        :param properties: Properties to query for.
+        :param criteria: Criteria to query for as a dict.
+        :param nworkers: Number of ranges, threads and cursors.
+        :param split_key: Indexed key to split on, e.g. "_id" or "task_id".
+            Docs without the key, or whose key is of another type than most
+            sampled values, are all read by the first range.
+        :param split_method: "sample" to take the split points from a $sample
+            of the matching docs, which balances the ranges for any key and
+            criteria. "bounds" to split the range between the min and max
+            of the key evenly, which only needs two index lookups but may be
+            unbalanced. It works for numeric keys and ObjectIds.
+        :param sample_size: Number of docs to $sample. Defaults to 100 per worker.
+        :param \*\*kwargs: Other kwargs supported by query, e.g. batch_size.
+            sort and limit apply within each range.
+        :return: Generator of results.
+        """
+        bounds = [None, *self._split_points(criteria, nworkers, split_key, split_method, sample_size), None]
+        ranges = list(itertools.pairwise(bounds))
+        results = queue.Queue(maxsize=max(kwargs.get("batch_size") or 1000, 100) * len(ranges))
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def work(lo, hi):
+            try:
+                for r in self.query(properties, criteria, key_range=(split_key, lo, hi), **kwargs):
+                    if not put(r):
+                        return
+            except BaseException as ex:
+                put(_WorkerError(ex))
+            put(done)
+
+        threads = [threading.Thread(target=work, args=r, daemon=True) for r in ranges]
+        for t in threads:
+            t.start()
+        try:
+            nfinished = 0
+            while nfinished < len(threads):
+                item = results.get()
+                if item is done:
+                    nfinished += 1
+                elif isinstance(item, _WorkerError):
+                    raise item.error
+                else:
+                    yield item
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+
+    def _split_points(self, criteria, n, key, method="sample", sample_size=None):
+        """Values of key that split the docs matching criteria into n ranges."""
+        if n <= 1:
+            return []
+        key = self.aliases.get(key, key)
+        crit = self._parse_criteria(criteria)
+        if method == "bounds":
+            end = self.collection.find_one(crit, {key: 1}, sort=[(key, pymongo.DESCENDING)])
+            hi = _get_path(end, key)
+            if hi is None:
+                return []
+            # Docs without the key, or with values of a type sorted before hi's, are not in the range.
+            lo_crit = {key: {"$lte": hi}}
+            lo_crit = {"$and": [crit, lo_crit]} if key in crit else {**crit, **lo_crit}
+            lo = _get_path(self.collection.find_one(lo_crit, {key: 1}, sort=[(key, pymongo.ASCENDING)]), key)
+            if isinstance(lo, bson.ObjectId):
+                t0, t1 = lo.generation_time.timestamp(), hi.generation_time.timestamp()
+                utc = datetime.timezone.utc
+                times = {t0 + (t1 - t0) * i // n for i in range(1, n)}
+                return [bson.ObjectId.from_datetime(datetime.datetime.fromtimestamp(t, utc)) for t in sorted(times)]
+            if isinstance(lo, int) and isinstance(hi, int) and not isinstance(lo, bool):
+                return sorted({lo + (hi - lo) * i // n for i in range(1, n)})
+            if isinstance(lo, int | float) and isinstance(hi, int | float) and not isinstance(lo, bool):
+                return sorted({lo + (hi - lo) * i / n for i in range(1, n)})
+            raise ValueError(f"Cannot split the range of {key} evenly. Use split_method='sample'.")
+        if method != "sample":
+            raise ValueError(f"Unknown split method {method}. Use 'sample' or 'bounds'.")
+        pipeline = [{"$match": crit}] if crit else []
+        pipeline += [{"$sample": {"size": sample_size or 100 * n}}, {"$project": {key: 1}}]
+        groups = {}
+        for d in self.collection.aggregate(pipeline, allowDiskUse=True):
+            value = _get_path(d, key)
+            if value is not None:
+                groups.setdefault(_sort_type(value), []).append(value)
+        if not groups:
+            return []
+        # Split on the values of the most common type, which can be ordered.
+        values = sorted(max(groups.values(), key=len))
+        return sorted({values[len(values) * i // n] for i in range(1, n)})
 
     def _parse_properties(self, properties):
         """Make list of properties into 2 things:
@@ -468,6 +1019,62 @@ class QueryEngine:
             return r
         return None
 
+    def export(
+        self,
+        path,
+        properties,
+        criteria=None,
+        fmt=None,
+        chunk_size=10000,
+        compression=None,
+        serializer="auto",
+        resumable=True,
+        **kwargs,
+    ):
+        r"""
+        Stream the results of a query to a Parquet, Feather, JSON lines or BSON file.
+        Parquet and Feather results are written as Arrow record batches of
+        `chunk_size` rows, so memory use stays constant regardless of the
+        number of results. These two formats require pyarrow.
+
+        The columns are the (aliased) property names, in the order given, and
+        their types are inferred from the first chunk of results. See
+        pymatgen.db.export.ArrowWriter for details.
+
+        :param path: Output file name.
+        :param properties: Properties to export.
+        :param criteria: Criteria to query for as a dict.
+        :param fmt: "parquet", "feather", "jsonl" or "bson". Defaults to a guess from the extension of `path`.
+        :param chunk_size: Number of rows per record batch. Also used as the cursor batch size.
+        :param compression: Compression codec passed to pyarrow, e.g. "zstd".
+        :param serializer: JSON serializer backend for jsonl, see pymatgen.db.util.get_json_serializer.
+        :param resumable: Read the results with scan, in _id order, so that a
+            killed cursor is reopened where it stopped. Ignored if sort is given.
+        :param \*\*kwargs: Other kwargs supported by query, e.g. sort, limit or
+            no_cursor_timeout. raw=True streams jsonl and bson without decoding
+            whole documents.
+        :return: Number of rows written.
+        """
+        from .export import export_results, guess_format
+
+        if kwargs.get("raw") and (fmt or guess_format(path)) not in ("jsonl", "bson"):
+            raise ValueError("Raw results can only be exported to jsonl or bson.")
+
+        kwargs.setdefault("batch_size", chunk_size)
+        if resumable and "sort" not in kwargs:
+            results = self.scan(properties=properties, criteria=criteria, **kwargs)
+        else:
+            results = self.query(properties=properties, criteria=criteria, cache=False, **kwargs)
+        return export_results(
+            results,
+            path,
+            list(properties),
+            fmt=fmt,
+            chunk_size=chunk_size,
+            compression=compression,
+            serializer=serializer,
+        )
+
     def get_structure_from_id(self, task_id, final_structure=True):
         """
         Returns a structure from the database given the task id.
@@ -488,13 +1095,75 @@ class QueryEngine:
         if len(results) == 0:
             raise QueryError(f"No structure found for task_id {task_id}!")
         c = results[0]
+        from pymatgen.core import Structure
+
         return Structure.from_dict(c[field])
 
+    def find_duplicates(self, criteria=None, matcher=None):
+        """
+        Find clusters of tasks with equivalent final structures.
+
+        Tasks are bucketed by the "fingerprint" key computed by the drone at
+        ingest (see pymatgen.db.fingerprint), and structures are only compared
+        with the StructureMatcher within a bucket and its adjacent volume bins,
+        instead of pairwise over the whole collection. Tasks without a
+        fingerprint are ignored.
+
+        Args:
+            criteria:
+                Criteria obeying the same syntax as query, to restrict the
+                tasks considered.
+            matcher:
+                StructureMatcher to compare structures with. Defaults to
+                StructureMatcher().
+
+        Returns:
+            List of clusters, each a dict of the form
+            {"fingerprint": fingerprint, "task_ids": [task_id, ...]}, with
+            at least two task_ids. The fingerprint is that of the first task.
+        """
+        from pymatgen.analysis.structure_matcher import StructureMatcher
+        from pymatgen.core import Structure
+
+        from .fingerprint import fingerprint_neighbors
+
+        matcher = matcher or StructureMatcher()
+        crit = self._parse_criteria(criteria or {})
+        crit.setdefault("fingerprint", {"$exists": True})
+        pipeline = [{"$match": crit}, {"$group": {"_id": "$fingerprint", "task_ids": {"$push": "$task_id"}}}]
+        buckets = {d["_id"]: d["task_ids"] for d in self.collection.aggregate(pipeline)}
+
+        clusters = []
+        seen = set()
+        for fingerprint in sorted(buckets):
+            # Merge runs of adjacent volume bins so that near-duplicates on a bin edge are compared.
+            group, stack = [], [fingerprint]
+            while stack:
+                fp = stack.pop()
+                if fp in buckets and fp not in seen:
+                    seen.add(fp)
+                    group.append(fp)
+                    stack.extend(fingerprint_neighbors(fp))
+            task_fingerprints = {t: fp for fp in group for t in buckets[fp]}
+            task_ids = list(task_fingerprints)
+            if len(task_ids) < 2:
+                continue
+            docs = self.collection.find({"task_id": {"$in": task_ids}}, {"task_id": 1, "output.crystal": 1})
+            structures = {}
+            for d in docs:
+                s = Structure.from_dict(d["output"]["crystal"])
+                structures[id(s)] = (d["task_id"], s)
+            for matches in matcher.group_structures([s for _, s in structures.values()]):
+                if len(matches) > 1:
+                    ids = sorted(structures[id(s)][0] for s in matches)
+                    clusters.append({"fingerprint": task_fingerprints[ids[0]], "task_ids": ids})
+        return clusters
+
     def __repr__(self):
         return f"QueryEngine: {self.host}:{self.port}/{self.database_name}"
 
     @staticmethod
-    def from_config(config_file, use_admin=False):
+    def from_config(config_file, use_admin=False, **kwargs):
         """
         Initialize a QueryEngine from a JSON config file generated using mgdb
         init.
@@ -506,6 +1175,11 @@ class QueryEngine:
                 If True, the admin user and password in the config file is
                 used. Otherwise, the readonly_user and password is used.
                 Defaults to False.
+            **kwargs:
+                Other QueryEngine args, which override those in the config
+                file, e.g. read_preference="secondary" for an analysis job.
+                The config file may set read_preference, tag_sets,
+                max_staleness, read_concern, max_pool_size and min_pool_size.
 
         Returns:
             QueryEngine
@@ -522,6 +1196,7 @@ class QueryEngine:
                 password=password,
                 collection=d["collection"],
                 aliases_config=d.get("aliases_config", None),
+                **{**{k: d[k] for k in CONNECTION_OPTION_KEYS if d.get(k) is not None}, **kwargs},
             )
 
     def __getitem__(self, item):
@@ -530,37 +1205,172 @@ class QueryEngine:
         """
         return self.db[item]
 
-    def get_dos_from_id(self, task_id):
-        """Overrides the get_dos_from_id for the MIT gridfs format."""
+    def get_array_from_id(self, task_id, key="eigenvalues", calc_index=-1):
+        """
+        Get an array stored in the arrays_fs gridfs collection by a drone with
+        arrays_to_gridfs=True.
+
+        Args:
+            task_id:
+                The task_id to query for.
+            key:
+                One of "eigenvalues", "projected_eigenvalues" or
+                "projected_magnetization".
+            calc_index:
+                Index of the calculation in the task. Defaults to the last one.
+
+        Returns:
+            Dict of numpy arrays, keyed by spin ("1", "-1") for eigenvalues and
+            projected eigenvalues, or {"data": array} for the projected
+            magnetization. None if the array was not stored.
+        """
+        doc = self.collection.find_one({"task_id": task_id}, {"calculations.output": 1})
+        if doc is None:
+            raise QueryError(f"No task found for task_id {task_id}!")
+        fs_id = doc["calculations"][calc_index]["output"].get(f"{key}_fs_id")
+        if fs_id is None:
+            return None
+        import io
+
+        import gridfs
+        import numpy as np
+
+        with gridfs.GridFS(self.db, "arrays_fs").get(fs_id) as f, np.load(io.BytesIO(f.read())) as npz:
+            return dict(npz.items())
+
+    def get_dos_from_id(self, task_id, **kwargs):
+        r"""
+        Overrides the get_dos_from_id for the MIT gridfs format.
+
+        :param task_id: Task id.
+        :param \*\*kwargs: Query options, e.g. session or read_preference.
+        :return: CompleteDos, or None if the task has no DOS.
+        """
         args = {"task_id": task_id}
-        fields = ["calculations"]
+        fields = ["calculations.dos_fs_id", "calculations.dos_compression"]
         structure = self.get_structure_from_id(task_id)
-        dosid = None
-        for r in self.query(fields, args):
-            dosid = r["calculations"][-1]["dos_fs_id"]
+        dosid = codec = None
+        for r in self.query(fields, args, **kwargs):
+            dosid = (r["calculations.dos_fs_id"] or [None])[-1]
+            codec = (r["calculations.dos_compression"] or [None])[-1]
         if dosid is not None:
+            import gridfs
+
+            from pymatgen.electronic_structure.core import Orbital, Spin
+            from pymatgen.electronic_structure.dos import CompleteDos, Dos
+
+            from .compression import get_payload
+
             self._fs = gridfs.GridFS(self.db, "dos_fs")
-            with self._fs.get(dosid) as dosfile:
-                s = dosfile.read()
-                try:
-                    d = json.loads(s)
-                except Exception:
-                    s = zlib.decompress(s)
-                    d = json.loads(s.decode("utf-8"))
-                tdos = Dos.from_dict(d)
-                pdoss = {}
-                for i in range(len(d["pdos"])):
-                    ados = d["pdos"][i]
-                    all_ados = {}
-                    for j in range(len(ados)):
-                        orb = Orbital(j)
-                        odos = ados[str(orb)]
-                        all_ados[orb] = {Spin(int(k)): v for k, v in odos["densities"].items()}
-                    pdoss[structure[i]] = all_ados
-                return CompleteDos(structure, tdos, pdoss)
+            d = json.loads(get_payload(self._fs, dosid, codec=codec).decode("utf-8"))
+            tdos = Dos.from_dict(d)
+            pdoss = {}
+            for i, ados in enumerate(d["pdos"]):
+                pdoss[structure[i]] = {
+                    Orbital[orb]: {Spin(int(k)): v for k, v in odos["densities"].items()} for orb, odos in ados.items()
+                }
+            return CompleteDos(structure, tdos, pdoss)
         return None
 
 
+_MISSING = object()
+
+
+def _compile_mapping(prop_dict):
+    """
+    Compile a prop_dict, {result key: list of path segments}, into a function
+    that maps a record to a result dict. The paths are merged into a tree, so
+    shared prefixes such as "output" in "output.crystal" and
+    "output.final_energy" are looked up once and every projected value is
+    extracted in a single pass over the record. When all paths are top-level
+    keys, the result is built with plain dict lookups.
+
+    The results are the same as mapping each path with
+    QueryResults._mapped_result_path: a missing key gives None, and a list
+    met before the end of a path is mapped element-wise.
+    """
+    keys = list(prop_dict)
+    tree = {}
+    for k, path in prop_dict.items():
+        node = tree
+        for seg in path[:-1]:
+            node = node.setdefault(seg, ([], {}))[1]
+        node.setdefault(path[-1], ([], {}))[0].append(k)
+    fill = _compile_node(tree)
+
+    def map_tree(r):
+        result = dict.fromkeys(keys)
+        fill(r, result)
+        return result
+
+    if any(len(path) > 1 for path in prop_dict.values()):
+        return map_tree
+    flat = [(k, path[0]) for k, path in prop_dict.items()]
+
+    def map_flat(r):
+        if type(r) is not dict:
+            return map_tree(r)
+        get = r.get
+        return {k: get(seg) for k, seg in flat}
+
+    return map_flat
+
+
+def _compile_node(children):
+    """Compile a node of the path tree of _compile_mapping into a function filling in its result keys."""
+    # Leaves ending a single path are the common case and are set with one lookup.
+    leaves, entries = [], []
+    all_keys = []
+    for seg, (keys, sub) in children.items():
+        if len(keys) == 1 and not sub:
+            leaves.append((seg, keys[0]))
+        else:
+            entries.append((seg, tuple(keys), _compile_node(sub) if sub else None))
+        all_keys.extend(keys)
+        all_keys.extend(_tree_keys(sub))
+
+    def fill(data, out):
+        if isinstance(data, list):
+            parts = []
+            for d in data:
+                part = {}
+                fill(d, part)
+                parts.append(part)
+            for k in all_keys:
+                out[k] = [part.get(k) for part in parts]
+            return
+        if isinstance(data, dict):
+            get = data.get
+            for seg, k in leaves:
+                out[k] = get(seg)
+            for seg, keys, subfill in entries:
+                value = get(seg, _MISSING)
+                if value is not _MISSING:
+                    for k in keys:
+                        out[k] = value
+                    if subfill is not None:
+                        subfill(value, out)
+            return
+        for seg, keys, subfill in [(seg, (k,), None) for seg, k in leaves] + entries:
+            try:
+                value = data[seg]
+            except (IndexError, KeyError, ValueError):
+                continue
+            for k in keys:
+                out[k] = value
+            if subfill is not None:
+                subfill(value, out)
+
+    return fill
+
+
+def _tree_keys(children):
+    """All result keys under a node of the path tree of _compile_mapping."""
+    for keys, sub in children.values():
+        yield from keys
+        yield from _tree_keys(sub)
+
+
 class QueryResults(Iterable):
     """
     Iterable wrapper for results from QueryEngine.
@@ -582,6 +1392,7 @@ class QueryResults(Iterable):
         self._results = result_cursor
         self._prop_dict = prop_dict
         self._pproc = postprocess or []  # make empty values iterable
+        self._mapper = _compile_mapping(prop_dict) if prop_dict else None
 
     def _wrapper(self, func):
         """
@@ -637,20 +1448,17 @@ class QueryResults(Iterable):
         for func in self._pproc:
             func(r)
         # If we haven't asked for specific properties, just return object
-        if not self._prop_dict:
-            result = r
-        else:
-            result = {}
-            # Map aliased keys back to original key
-            for k, v in self._prop_dict.items():
-                try:
-                    result[k] = self._mapped_result_path(v[1:], data=r[v[0]])
-                except (IndexError, KeyError, ValueError):
-                    result[k] = None
-        return result
+        if self._mapper is None:
+            return r
+        # Map aliased keys back to original key
+        return self._mapper(r)
 
     @staticmethod
     def _mapped_result_path(path, data=None):
+        """
+        Value of a path of keys in data, mapped over lists. Missing keys give None.
+        Kept for reference and subclasses; QueryResults uses _compile_mapping.
+        """
         if not path:
             return data
         if isinstance(data, list):
@@ -665,6 +1473,132 @@ class QueryResults(Iterable):
             yield self._mapped_result(r)
 
 
+class ResumableScan(Iterable):
+    """
+    Iterable over the results of a query in _id order that reopens the cursor
+    after the last _id seen when it is killed (CursorNotFound) or the
+    connection drops (AutoReconnect). Obtain it from QueryEngine.scan.
+    """
+
+    #: Seconds between refreshes of the session of a no_cursor_timeout scan.
+    #: The server reaps sessions that are idle for 30 minutes.
+    SESSION_REFRESH = 300
+
+    def __init__(self, queryengine, properties=None, criteria=None, resume_after=None, max_retries=3, **kwargs):
+        """Constructor. See QueryEngine.scan for the args."""
+        if "sort" in kwargs:
+            raise ValueError(f"{type(self).__name__} results are always in scan order, sort is not supported.")
+        self._qe = queryengine
+        self._properties = properties
+        self._criteria = criteria
+        self._kwargs = kwargs
+        self.max_retries = max_retries
+        #: _id of the last result returned.
+        self.last_id = resume_after
+        #: Number of times the cursor was reopened.
+        self.nretries = 0
+
+    def __iter__(self):
+        kwargs = dict(self._kwargs)
+        session = None
+        if kwargs.get("no_cursor_timeout") and kwargs.get("session") is None:
+            session = kwargs["session"] = self._qe.connection.start_session()
+        try:
+            yield from self._scan(kwargs)
+        finally:
+            if session is not None:
+                session.end_session()
+
+    def _query(self, kwargs):
+        """Query for the results after the last one returned."""
+        return self._qe.query(
+            self._properties,
+            self._criteria,
+            after_id=self.last_id,
+            sort=[("_id", pymongo.ASCENDING)],
+            cache=False,
+            **kwargs,
+        )
+
+    def _advance(self, r):
+        """Record the last result returned, as the raw doc."""
+        self.last_id = r["_id"]
+
+    def _scan(self, kwargs):
+        session = kwargs.get("session")
+        refreshed = time.monotonic()
+        while True:
+            results = self._query(kwargs)
+            try:
+                for r in results._results:
+                    self._advance(r)
+                    yield results._mapped_result(r)
+                    if session is not None and time.monotonic() - refreshed > self.SESSION_REFRESH:
+                        self._qe.connection.admin.command("refreshSessions", [session.session_id], session=session)
+                        refreshed = time.monotonic()
+                return
+            except (pymongo.errors.CursorNotFound, pymongo.errors.AutoReconnect) as ex:
+                if self.nretries >= self.max_retries:
+                    raise
+                self.nretries += 1
+                _log.warning(f"Cursor lost after _id {self.last_id} ({ex}). Resuming, retry {self.nretries}.")
+
+
+class ChangeScan(ResumableScan):
+    """
+    Iterable over the docs updated after a high-water mark, in
+    (last_updated, _id) order, that reopens the cursor after the last doc
+    seen if it is lost. Obtain it from QueryEngine.query_since.
+    """
+
+    def __init__(self, queryengine, properties=None, criteria=None, since=None, max_retries=3, **kwargs):
+        """Constructor. See QueryEngine.query_since for the args."""
+        if properties is not None and "last_updated" not in properties:
+            properties = [*properties, "last_updated"]
+        super().__init__(queryengine, properties, criteria, max_retries=max_retries, **kwargs)
+        if since is not None and not isinstance(since, dict):
+            since = {"last_updated": since, "_id": None}
+        #: High-water mark of the last result returned, a dict with the
+        #: last_updated and _id of the doc. Pass it to query_since to resume.
+        self.high_water_mark = since
+
+    def _query(self, kwargs):
+        return self._qe.query(
+            self._properties,
+            self._criteria,
+            updated_after=self.high_water_mark or {"last_updated": None},
+            sort=CHANGES_SORT,
+            cache=False,
+            **kwargs,
+        )
+
+    def _advance(self, r):
+        self.high_water_mark = {"last_updated": r["last_updated"], "_id": r["_id"]}
+
+
+def _get_path(doc, key):
+    """Value of a dotted key in a doc, or None if it is missing."""
+    for k in key.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(k)
+    return doc
+
+
+def _sort_type(value):
+    """Type of a value for sorting, with all numbers alike."""
+    if isinstance(value, int | float) and not isinstance(value, bool):
+        return "number"
+    return type(value)
+
+
+class _WorkerError:
+    """Wraps an exception raised in a parallel_query worker thread."""
+
+    def __init__(self, error):
+        self.error = error
+
+
 class QueryListResults(QueryResults):
     """Set of QueryResults on a list instead of a MongoDB cursor."""
 
@@ -678,6 +1612,9 @@ class QueryListResults(QueryResults):
         """
         if hasattr(self._results, "__len__"):
             return len(self._results)
+        if not hasattr(self._results, "clone"):
+            # e.g. results too large for the cache, which are streamed
+            raise TypeError("The number of results is not known until they are read.")
         return QueryResults.__len__(self)
 
 
@@ -0,0 +1,293 @@
+"""
+Structures as compact NumPy arrays in shared memory, for fanning them out to
+worker processes without pickling.
+
+StructureArrays holds many ordered structures as a handful of arrays: the
+lattice matrices, the fractional coordinates and species index of all sites,
+and the offset of the first site of each structure. It is built once in the
+parent, from query results, ComputedStructureEntries or Structures, and
+copied into one multiprocessing.shared_memory block with share(). The handle
+returned is small and pickles cheaply, and workers attach to the block and
+read the arrays in place, or rebuild Structures from them::
+
+    from multiprocessing import Pool
+
+    from pymatgen.db.shared_structures import StructureArrays
+
+    def volume(shared, i):
+        return shared.attach().structure(i).volume
+
+    arrays = StructureArrays.from_query(qe, {"chemsys": "Li-Fe-O"})
+    with arrays.share() as shared, Pool() as pool:
+        volumes = pool.starmap(volume, [(shared, i) for i in range(len(shared))])
+
+Site properties and disordered (partially occupied) sites are not supported.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+#: Arrays of a StructureArrays, and their dtypes.
+ARRAY_DTYPES = {
+    "lattices": np.float64,
+    "offsets": np.int64,
+    "frac_coords": np.float64,
+    "species": np.int32,
+    "ids": np.int64,
+}
+
+# StructureArrays attached to in this process, by shared memory block name.
+_attached = {}
+
+
+def _species_key(site_species):
+    if len(site_species) != 1 or site_species[0].get("occu", 1) != 1:
+        raise ValueError("Disordered structures are not supported.")
+    sp = site_species[0]
+    return sp["element"], sp.get("oxidation_state")
+
+
+def _species_name(element, oxidation_state):
+    if oxidation_state is None:
+        return element
+    from pymatgen.core import Species
+
+    return str(Species(element, oxidation_state))
+
+
+class StructureArrays:
+    """
+    Ordered structures stored as NumPy arrays. Structure i has the sites
+    offsets[i]:offsets[i + 1] of frac_coords and species, and the lattice
+    lattices[i]. species are indices into species_table, a list of species
+    names such as "Fe" or "Fe2+".
+    """
+
+    def __init__(self, lattices, offsets, frac_coords, species, species_table, ids=None, shm=None):
+        """
+        Args:
+            lattices: (n, 3, 3) array of lattice matrices.
+            offsets: (n + 1,) array of site offsets.
+            frac_coords: (nsites, 3) array of fractional coordinates.
+            species: (nsites,) array of indices into species_table.
+            species_table: List of species names.
+            ids: Ids of the structures, e.g. task ids, or None. Stored in
+                shared memory if they are all ints, otherwise pickled with
+                the handle.
+            shm: SharedMemory block that the arrays are views of, kept open.
+        """
+        self.lattices = lattices
+        self.offsets = offsets
+        self.frac_coords = frac_coords
+        self.species = species
+        self.species_table = list(species_table)
+        self.ids = ids
+        self._shm = shm
+
+    @classmethod
+    def from_dicts(cls, dicts, ids=None):
+        """
+        Decode structures from their as_dict form, e.g. the output.crystal of
+        task docs, without building Structure objects.
+
+        Args:
+            dicts: Iterable of Structure dicts.
+            ids: Ids of the structures, or None.
+        """
+        lattices, counts, coords, species = [], [0], [], []
+        table = {}
+        for d in dicts:
+            lattices.append(d["lattice"]["matrix"])
+            counts.append(len(d["sites"]))
+            for site in d["sites"]:
+                coords.append(site["abc"])
+                species.append(table.setdefault(_species_key(site["species"]), len(table)))
+        return cls(
+            np.array(lattices, dtype=ARRAY_DTYPES["lattices"]).reshape(-1, 3, 3),
+            np.cumsum(counts, dtype=ARRAY_DTYPES["offsets"]),
+            np.array(coords, dtype=ARRAY_DTYPES["frac_coords"]).reshape(-1, 3),
+            np.array(species, dtype=ARRAY_DTYPES["species"]),
+            [_species_name(*k) for k in table],
+            ids=ids,
+        )
+
+    @classmethod
+    def from_structures(cls, structures, ids=None):
+        """
+        Build from ordered pymatgen Structures.
+
+        Args:
+            structures: Iterable of Structures.
+            ids: Ids of the structures, or None.
+        """
+        lattices, counts, coords, species = [], [0], [], []
+        table = {}
+        for s in structures:
+            if not s.is_ordered:
+                raise ValueError("Disordered structures are not supported.")
+            lattices.append(s.lattice.matrix)
+            counts.append(len(s))
+            coords.append(s.frac_coords)
+            species.extend(table.setdefault(str(sp), len(table)) for sp in s.species)
+        return cls(
+            np.array(lattices, dtype=ARRAY_DTYPES["lattices"]).reshape(-1, 3, 3),
+            np.cumsum(counts, dtype=ARRAY_DTYPES["offsets"]),
+            np.concatenate(coords, dtype=ARRAY_DTYPES["frac_coords"]) if coords else np.zeros((0, 3)),
+            np.array(species, dtype=ARRAY_DTYPES["species"]),
+            list(table),
+            ids=ids,
+        )
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Build from ComputedStructureEntries, with the entry_ids as ids."""
+        entries = list(entries)
+        return cls.from_structures([e.structure for e in entries], ids=[e.entry_id for e in entries])
+
+    @classmethod
+    def from_query(cls, qe, criteria=None, key="output.crystal", id_key="task_id", **kwargs):
+        """
+        Build from the structures of the results of a query, decoded once.
+
+        Args:
+            qe: QueryEngine.
+            criteria: Criteria to query for as a dict.
+            key: Property, or alias, of the structure dicts.
+            id_key: Property, or alias, of the ids, or None.
+            **kwargs: Other kwargs supported by QueryEngine.query, e.g. sort.
+        """
+        properties = [key] if id_key is None else [key, id_key]
+        results = list(qe.query(properties, criteria, **kwargs))
+        ids = None if id_key is None else [r[id_key] for r in results]
+        return cls.from_dicts((r[key] for r in results), ids=ids)
+
+    def __len__(self):
+        return len(self.lattices)
+
+    @property
+    def nbytes(self):
+        """Size of the arrays in bytes."""
+        return sum(a.nbytes for a in self._arrays().values())
+
+    def _arrays(self):
+        arrays = {k: getattr(self, k) for k in ("lattices", "offsets", "frac_coords", "species")}
+        if self.ids is not None and all(isinstance(i, int | np.integer) for i in self.ids):
+            arrays["ids"] = np.asarray(self.ids, dtype=ARRAY_DTYPES["ids"])
+        return arrays
+
+    def sites(self, i):
+        """Slice of the sites of structure i in frac_coords and species."""
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def species_names(self, i):
+        """Species names of the sites of structure i."""
+        return [self.species_table[j] for j in self.species[self.sites(i)]]
+
+    def structure(self, i):
+        """Rebuild structure i as a pymatgen Structure."""
+        from pymatgen.core import Lattice, Structure
+
+        sites = self.sites(i)
+        return Structure(Lattice(self.lattices[i]), self.species_names(i), self.frac_coords[sites])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.structure(i)
+
+    def share(self):
+        """
+        Copy the arrays into a new shared memory block.
+
+        Returns:
+            SharedStructureArrays handle, which owns the block. Close it, or
+            use it as a context manager, to free the block.
+        """
+        from multiprocessing import shared_memory
+
+        arrays = self._arrays()
+        layout, offset = [], 0
+        for name, a in arrays.items():
+            layout.append((name, a.dtype.str, a.shape, offset))
+            # Keep every array 8-byte aligned
+            offset += -(-a.nbytes // 8) * 8
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for (_name, dtype, shape, start), a in zip(layout, arrays.values(), strict=True):
+            np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)[...] = a
+        ids = None if "ids" in arrays or self.ids is None else list(self.ids)
+        return SharedStructureArrays(shm.name, layout, self.species_table, ids=ids, shm=shm)
+
+
+class SharedStructureArrays:
+    """
+    Picklable handle to StructureArrays in shared memory. Obtain it from
+    StructureArrays.share and pass it to workers, which call attach.
+    """
+
+    def __init__(self, name, layout, species_table, ids=None, shm=None):
+        """
+        Args:
+            name: Name of the shared memory block.
+            layout: List of (array name, dtype, shape, offset in bytes).
+            species_table: List of species names.
+            ids: Ids of the structures, if they are not stored in the block.
+            shm: SharedMemory block, if this handle owns it.
+        """
+        self.name = name
+        self.layout = layout
+        self.species_table = species_table
+        self.ids = ids
+        self._shm = shm
+
+    def __getstate__(self):
+        return {**self.__dict__, "_shm": None}
+
+    def __len__(self):
+        shapes = {name: shape for name, _, shape, _ in self.layout}
+        return shapes["lattices"][0]
+
+    def attach(self):
+        """
+        StructureArrays whose arrays are read-only views of the shared
+        memory block. Attaching again in the same process is free.
+        """
+        arrays = _attached.get(self.name)
+        if arrays is None:
+            from multiprocessing import shared_memory
+
+            shm = shared_memory.SharedMemory(name=self.name)
+            views = {}
+            for name, dtype, shape, offset in self.layout:
+                views[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+                views[name].flags.writeable = False
+            ids = views.pop("ids", None)
+            arrays = StructureArrays(
+                **views, species_table=self.species_table, ids=self.ids if ids is None else ids, shm=shm
+            )
+            _attached[self.name] = arrays
+        return arrays
+
+    def close(self):
+        """Detach this process, and free the block if this handle owns it."""
+        arrays = _attached.pop(self.name, None)
+        if arrays is not None:
+            _close(arrays._shm)
+        if self._shm is not None:
+            _close(self._shm)
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _close(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # Arrays of the block are still referenced. The memory is freed when
+        # they are, as the block is unlinked.
+        pass
@@ -0,0 +1,546 @@
+"""
+This module provides a generator of synthetic task documents that follow the
+schema produced by :class:`pymatgen.db.creator.VaspToDbTaskDrone`. It is meant
+for sizing clusters and benchmarking the QueryEngine against collections with
+millions of documents, without needing real VASP output.
+
+Example::
+
+    gen = TaskDocGenerator(elements={"Li": 2, "Fe": 1, "O": 4}, nsites=(4, 16), dos_npoints=301)
+    docs = gen.generate(10, seed=0)
+
+    # Or generate and bulk load in parallel, as `mgdb synth` does.
+    bulk_load(gen, 100000, host="localhost", database="vasp", ncpus=8)
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import logging
+import multiprocessing
+import string
+import uuid
+
+import gridfs
+import numpy as np
+from monty.json import MontyEncoder
+from pymongo import MongoClient
+
+from .cache import bump_generation
+from .compression import DEFAULT_CODECS, put_payload
+from .fingerprint import make_fingerprint
+
+logger = logging.getLogger(__name__)
+
+#: Elements sampled (uniformly) when no element distribution is given.
+DEFAULT_ELEMENTS = [
+    "H",
+    "Li",
+    "Be",
+    "B",
+    "C",
+    "N",
+    "O",
+    "F",
+    "Na",
+    "Mg",
+    "Al",
+    "Si",
+    "P",
+    "S",
+    "Cl",
+    "K",
+    "Ca",
+    "Sc",
+    "Ti",
+    "V",
+    "Cr",
+    "Mn",
+    "Fe",
+    "Co",
+    "Ni",
+    "Cu",
+    "Zn",
+    "Ga",
+    "Ge",
+    "As",
+    "Se",
+    "Br",
+    "Rb",
+    "Sr",
+    "Y",
+    "Zr",
+    "Nb",
+    "Mo",
+    "Ru",
+    "Rh",
+    "Pd",
+    "Ag",
+    "Cd",
+    "In",
+    "Sn",
+    "Sb",
+    "Te",
+    "I",
+    "Cs",
+    "Ba",
+    "La",
+    "Ce",
+    "Nd",
+    "Sm",
+    "Gd",
+    "Hf",
+    "Ta",
+    "W",
+    "Re",
+    "Os",
+    "Ir",
+    "Pt",
+    "Au",
+    "Hg",
+    "Tl",
+    "Pb",
+    "Bi",
+]
+
+
+class TaskDocGenerator:
+    """
+    Generates random task docs with the same layout as the docs inserted by
+    VaspToDbTaskDrone (calculations, input/output crystals, analysis,
+    spacegroup, optional DOS, etc.). The energies, forces and structures are
+    random and physically meaningless; only the shape and size of the
+    documents are realistic.
+
+    Instances are cheap and picklable, so they can be shipped to worker
+    processes.
+    """
+
+    def __init__(
+        self,
+        elements=None,
+        nelements=(1, 4),
+        nsites=(2, 32),
+        nionic_steps=3,
+        nelectronic_steps=5,
+        nkpoints=10,
+        nbands=16,
+        dos_npoints=0,
+        hubbard_fraction=0.2,
+        additional_fields=None,
+    ):
+        """Constructor.
+
+        Args:
+            elements:
+                Element distribution to sample from. Either a sequence of
+                element symbols (sampled uniformly) or a dict of
+                {symbol: weight}. Defaults to DEFAULT_ELEMENTS.
+            nelements:
+                Number of distinct elements per structure. Either an int, a
+                (min, max) tuple sampled uniformly, or a dict of
+                {nelements: weight}.
+            nsites:
+                Number of sites per structure, as an int or (min, max) tuple.
+            nionic_steps:
+                Number of ionic steps stored in each calculation.
+            nelectronic_steps:
+                Number of electronic steps stored in each ionic step.
+            nkpoints:
+                Number of k-points in the stored eigenvalues.
+            nbands:
+                Number of bands in the stored eigenvalues.
+            dos_npoints:
+                Number of energy points in the DOS. 0 means no DOS is
+                generated.
+            hubbard_fraction:
+                Fraction of tasks that are GGA+U runs.
+            additional_fields:
+                Dict of fields added to every doc, e.g. {"tags": ["synthetic"]}.
+        """
+        if elements is None:
+            elements = DEFAULT_ELEMENTS
+        if isinstance(elements, dict):
+            symbols = list(elements)
+            weights = np.array([elements[el] for el in symbols], dtype=float)
+        else:
+            symbols = list(elements)
+            weights = np.ones(len(symbols))
+        if not symbols:
+            raise ValueError("At least one element is required.")
+        self.elements = symbols
+        self.element_weights = weights / weights.sum()
+        self.nelements = nelements
+        self.nsites = nsites
+        self.nionic_steps = nionic_steps
+        self.nelectronic_steps = nelectronic_steps
+        self.nkpoints = nkpoints
+        self.nbands = nbands
+        self.dos_npoints = dos_npoints
+        self.hubbard_fraction = hubbard_fraction
+        self.additional_fields = additional_fields or {}
+
+    def generate(self, n, seed=None):
+        """
+        Generate a list of task docs.
+
+        Args:
+            n: Number of docs.
+            seed: Seed for the random number generator.
+
+        Returns:
+            List of task doc dicts, without task_id.
+        """
+        rng = np.random.default_rng(seed)
+        return [self.make_doc(rng) for _ in range(n)]
+
+    def _sample_nelements(self, rng):
+        spec = self.nelements
+        if isinstance(spec, dict):
+            choices = list(spec)
+            w = np.array([spec[c] for c in choices], dtype=float)
+            n = int(rng.choice(choices, p=w / w.sum()))
+        elif isinstance(spec, int):
+            n = spec
+        else:
+            n = int(rng.integers(spec[0], spec[1] + 1))
+        return max(1, min(n, len(self.elements)))
+
+    def _sample_nsites(self, rng, nelements):
+        spec = self.nsites
+        n = spec if isinstance(spec, int) else int(rng.integers(spec[0], spec[1] + 1))
+        return max(n, nelements)
+
+    def _random_structure(self, rng):
+        from pymatgen.core import Lattice, Structure
+
+        nel = self._sample_nelements(rng)
+        els = rng.choice(self.elements, size=nel, replace=False, p=self.element_weights)
+        nsites = self._sample_nsites(rng, nel)
+        # Every element gets at least one site, the rest are spread randomly.
+        counts = np.ones(nel, dtype=int) + rng.multinomial(nsites - nel, np.ones(nel) / nel)
+        species = [str(el) for el, c in zip(els, counts, strict=True) for _ in range(c)]
+        volume = nsites * rng.uniform(10, 25)
+        abc = rng.uniform(0.8, 1.2, size=3)
+        angles = rng.uniform(75, 105, size=3)
+        lattice = Lattice.from_parameters(*abc, *angles)
+        lattice = lattice.scale(volume)
+        return Structure(lattice, species, rng.random((nsites, 3)))
+
+    def _ionic_steps(self, rng, structure, final_energy):
+        nsites = len(structure)
+        steps = []
+        for i in range(self.nionic_steps):
+            e = final_energy + 0.05 * (self.nionic_steps - 1 - i) * rng.random()
+            electronic = [
+                {
+                    "alphaZ": float(rng.normal()),
+                    "ewald": float(rng.normal(-100, 10)),
+                    "hartreedc": float(rng.normal(-50, 5)),
+                    "XCdc": float(rng.normal(10, 1)),
+                    "pawpsdc": float(rng.normal(100, 10)),
+                    "pawaedc": float(rng.normal(-100, 10)),
+                    "eentropy": 0.0,
+                    "bandstr": float(rng.normal(-20, 2)),
+                    "atom": float(rng.normal(400, 40)),
+                    "e_fr_energy": float(e + rng.normal(0, 0.01)),
+                    "e_wo_entrp": float(e + rng.normal(0, 0.01)),
+                    "e_0_energy": float(e + rng.normal(0, 0.01)),
+                }
+                for _ in range(self.nelectronic_steps)
+            ]
+            steps.append(
+                {
+                    "e_fr_energy": e,
+                    "e_wo_entrp": e,
+                    "e_0_energy": e,
+                    "forces": rng.normal(0, 0.05, size=(nsites, 3)).tolist(),
+                    "stress": rng.normal(0, 1, size=(3, 3)).tolist(),
+                    "electronic_steps": electronic,
+                    "structure": structure.as_dict(),
+                }
+            )
+        return steps
+
+    def _eigenvalues(self, rng, efermi):
+        bands = np.sort(rng.uniform(efermi - 10, efermi + 10, self.nbands))
+        return [[float(e), 1.0 if e < efermi else 0.0] for e in bands]
+
+    def _dos(self, rng, structure, efermi):
+        from pymatgen.electronic_structure.core import Orbital, Spin
+        from pymatgen.electronic_structure.dos import CompleteDos, Dos
+
+        energies = np.linspace(efermi - 10, efermi + 10, self.dos_npoints)
+        pdoss = {}
+        total = np.zeros(self.dos_npoints)
+        for site in structure:
+            site_dos = {}
+            for orb in Orbital:
+                dens = rng.random(self.dos_npoints)
+                total += dens
+                site_dos[orb] = {Spin.up: dens}
+            pdoss[site] = site_dos
+        tdos = Dos(efermi, energies, {Spin.up: total})
+        return CompleteDos(structure, tdos, pdoss).as_dict()
+
+    def make_doc(self, rng):
+        """
+        Generate a single task doc.
+
+        Args:
+            rng: numpy.random.Generator to use.
+
+        Returns:
+            Task doc as a dict, without task_id.
+        """
+        from pymatgen.io.cif import CifWriter
+
+        final = self._random_structure(rng)
+        initial = final.copy()
+        initial.scale_lattice(final.volume * rng.uniform(0.9, 1.1))
+        comp = final.composition
+        reduced = comp.get_reduced_composition_and_factor()[0].as_dict()
+        el_amt = comp.get_el_amt_dict()
+        elements = sorted(el_amt)
+        nsites = len(final)
+        energy_per_atom = float(rng.uniform(-9, -2))
+        final_energy = energy_per_atom * nsites
+        is_hubbard = bool(rng.random() < self.hubbard_fraction)
+        hubbards = {el: float(rng.uniform(3, 6)) for el in elements} if is_hubbard else {}
+        run_type = "GGA+U" if is_hubbard else "GGA"
+        bandgap = float(max(0.0, rng.normal(1.0, 1.5)))
+        efermi = float(rng.uniform(-2, 6))
+        vbm = efermi
+        cbm = efermi + bandgap
+        labels = [f"{el}_pv" if rng.random() < 0.3 else el for el in elements]
+        potcar_spec = [{"titel": f"PAW_PBE {label} 06Sep2000", "hash": rng.bytes(16).hex()} for label in labels]
+        completed_at = datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=int(rng.integers(0, 10**8)))
+
+        calc_output = {
+            "ionic_steps": self._ionic_steps(rng, final, final_energy),
+            "final_energy": final_energy,
+            "final_energy_per_atom": energy_per_atom,
+            "crystal": final.as_dict(),
+            "efermi": efermi,
+            "eigenvalues": {"1": [self._eigenvalues(rng, efermi) for _ in range(self.nkpoints)]},
+            "bandgap": bandgap,
+            "cbm": cbm,
+            "vbm": vbm,
+            "is_gap_direct": bool(rng.random() < 0.5),
+            "epsilon_static": [],
+            "epsilon_static_wolfe": [],
+            "epsilon_ionic": [],
+        }
+        incar = {"PREC": "Accurate", "ALGO": "Fast", "ISPIN": 2, "NSW": 99, "IBRION": 2, "EDIFF": 0.0001}
+        if is_hubbard:
+            incar.update({"LDAU": True, "LDAUU": [hubbards[el] for el in elements]})
+        calc = {
+            "vasp_version": "5.4.4",
+            "has_vasp_completed": True,
+            "nsites": nsites,
+            "unit_cell_formula": comp.as_dict(),
+            "reduced_cell_formula": reduced,
+            "pretty_formula": comp.reduced_formula,
+            "is_hubbard": is_hubbard,
+            "hubbards": hubbards,
+            "elements": elements,
+            "nelements": len(elements),
+            "run_type": run_type,
+            "input": {
+                "crystal": initial.as_dict(),
+                "incar": incar,
+                "nkpoints": self.nkpoints,
+                "potcar": labels,
+                "potcar_spec": potcar_spec,
+                "potcar_type": ["PAW_PBE"] * len(labels),
+                "parameters": dict(incar, NBANDS=self.nbands),
+                "lattice_rec": final.lattice.reciprocal_lattice.as_dict(),
+            },
+            "output": calc_output,
+            "dir_name": "",
+            "completed_at": str(completed_at),
+            "cif": str(CifWriter(final)),
+            "density": final.density,
+            "task": {"type": "standard", "name": "standard"},
+            "oxide_type": "oxide" if "O" in el_amt else "None",
+        }
+        if self.dos_npoints:
+            calc["dos"] = self._dos(rng, final, efermi)
+
+        d = dict(self.additional_fields.items())
+        dir_name = f"synth:/{uuid.UUID(bytes=rng.bytes(16))}"
+        calc["dir_name"] = dir_name
+        vals = sorted(reduced.values())
+        delta_vol = final.volume - initial.volume
+        d.update(
+            {
+                "dir_name": dir_name,
+                "schema_version": "2.0.0",
+                "calculations": [calc],
+                "completed_at": calc["completed_at"],
+                "nsites": nsites,
+                "unit_cell_formula": calc["unit_cell_formula"],
+                "reduced_cell_formula": calc["reduced_cell_formula"],
+                "pretty_formula": calc["pretty_formula"],
+                "elements": elements,
+                "nelements": len(elements),
+                "cif": calc["cif"],
+                "density": calc["density"],
+                "is_hubbard": is_hubbard,
+                "hubbards": hubbards,
+                "run_type": run_type,
+                "chemsys": "-".join(elements),
+                "input": {
+                    "crystal": calc["input"]["crystal"],
+                    "is_lasph": False,
+                    "potcar_spec": potcar_spec,
+                    "xc_override": None,
+                },
+                "anonymous_formula": {string.ascii_uppercase[i]: float(vals[i]) for i in range(len(vals))},
+                "output": {
+                    "crystal": calc_output["crystal"],
+                    "final_energy": final_energy,
+                    "final_energy_per_atom": energy_per_atom,
+                },
+                "name": "aflow",
+                "pseudo_potential": {"functional": "pbe", "pot_type": "paw", "labels": labels},
+                "state": "successful",
+                "analysis": {
+                    "delta_volume": delta_vol,
+                    "max_force": float(np.abs(calc_output["ionic_steps"][-1]["forces"]).max()),
+                    "percent_delta_volume": delta_vol / initial.volume,
+                    "warnings": [],
+                    "errors": [],
+                    "coordination_numbers": [
+                        {"site": site.as_dict(), "coordination": int(rng.integers(2, 13))} for site in final
+                    ],
+                    "bandgap": bandgap,
+                    "cbm": cbm,
+                    "vbm": vbm,
+                    "is_gap_direct": calc_output["is_gap_direct"],
+                    "bv_structure": calc_output["crystal"],
+                },
+                # Random structures have no symmetry to speak of.
+                "spacegroup": {
+                    "symbol": "P1",
+                    "number": 1,
+                    "point_group": "1",
+                    "source": "spglib",
+                    "crystal_system": "triclinic",
+                    "hall": "P 1",
+                },
+                "fingerprint": make_fingerprint(comp.reduced_formula, 1, final.volume / nsites),
+                "oxide_type": calc["oxide_type"],
+                "transformations": {},
+                "run_stats": {},
+                "last_updated": datetime.datetime.today(),
+            }
+        )
+        return d
+
+
+def insert_docs(db, docs, collection="tasks", compress_dos=False, dos_codec=None):
+    """
+    Insert task docs in bulk, storing any DOS in the dos_fs GridFS exactly as
+    VaspToDbTaskDrone does. Task ids are reserved as one block from the same
+    counter used by the drone, so synthetic and real tasks do not collide.
+
+    Args:
+        db: pymongo Database.
+        docs: List of task docs. Modified in place.
+        collection: Name of the target collection.
+        compress_dos: zlib compression level for the DOS, or False.
+        dos_codec: Codec for the DOS, see pymatgen.db.compression. Overrides compress_dos.
+
+    Returns:
+        Number of docs inserted.
+    """
+    if not docs:
+        return 0
+    fs = None
+    for d in docs:
+        for calc in d.get("calculations", []):
+            if "dos" in calc:
+                fs = fs or gridfs.GridFS(db, "dos_fs")
+                dos = json.dumps(calc.pop("dos"), cls=MontyEncoder).encode("utf-8")
+                codec = dos_codec or (DEFAULT_CODECS["dos"] if compress_dos else "none")
+                level = compress_dos if codec == "zlib" and compress_dos else None
+                if codec != "none":
+                    calc["dos_compression"] = codec
+                calc["dos_fs_id"] = put_payload(fs, dos, codec, level=level, format="json")
+    if db.counter.count_documents({"_id": "taskid"}) == 0:
+        db.counter.insert_one({"_id": "taskid", "c": 1})
+    start = db.counter.find_one_and_update(filter={"_id": "taskid"}, update={"$inc": {"c": len(docs)}})["c"]
+    for i, d in enumerate(docs):
+        d["task_id"] = start + i
+    db[collection].insert_many(docs, ordered=False)
+    bump_generation(db, collection)
+    return len(docs)
+
+
+_worker_db = None
+
+
+def _init_worker(conn_args, database):
+    global _worker_db  # noqa: PLW0603
+    _worker_db = MongoClient(**conn_args)[database]
+
+
+def _generate_and_insert(args):
+    generator, n, seed, collection, compress_dos, dos_codec = args
+    docs = generator.generate(n, seed=seed)
+    return insert_docs(_worker_db, docs, collection=collection, compress_dos=compress_dos, dos_codec=dos_codec)
+
+
+def bulk_load(
+    generator,
+    n,
+    host="127.0.0.1",
+    port=27017,
+    database="vasp",
+    collection="tasks",
+    user=None,
+    password=None,
+    compress_dos=False,
+    dos_codec=None,
+    ncpus=None,
+    chunk_size=500,
+    seed=None,
+):
+    """
+    Generate and insert synthetic task docs in parallel. Each worker process
+    holds its own connection and inserts the chunks it generates, so docs
+    never travel back to the parent process.
+
+    Args:
+        generator: TaskDocGenerator to use.
+        n: Total number of docs to insert.
+        host: Hostname of the database machine.
+        port: Port for db access.
+        database: Name of the target database.
+        collection: Name of the target collection.
+        user: User for db access. Requires write access.
+        password: Password for db access.
+        compress_dos: zlib compression level for the DOS, or False.
+        dos_codec: Codec for the DOS, see pymatgen.db.compression. Overrides compress_dos.
+        ncpus: Number of worker processes. Defaults to the number of cpus.
+        chunk_size: Number of docs generated and inserted per batch.
+        seed: Seed to make the generated collection reproducible.
+
+    Returns:
+        Number of docs inserted.
+    """
+    ncpus = ncpus or multiprocessing.cpu_count()
+    conn_args = {"host": host, "port": port, "username": user, "password": password}
+    seeds = np.random.SeedSequence(seed).spawn((n + chunk_size - 1) // chunk_size)
+    tasks = [
+        (generator, min(chunk_size, n - i * chunk_size), s, collection, compress_dos, dos_codec)
+        for i, s in enumerate(seeds)
+    ]
+    inserted = 0
+    with multiprocessing.Pool(ncpus, initializer=_init_worker, initargs=(conn_args, database)) as pool:
+        for count in pool.imap_unordered(_generate_and_insert, tasks):
+            inserted += count
+            logger.info(f"{inserted}/{n} synthetic tasks inserted.")
+    return inserted
@@ -0,0 +1,374 @@
+"""
+Compact, array-backed tables of task summaries for in-memory screening.
+
+A list of query result dicts costs several hundred bytes per task, mostly in
+dict and object overhead. TaskTable stores each property as a typed NumPy
+array instead, and string properties such as pretty_formula as categorical
+int32 codes into a list of distinct values, so a task with the default
+columns takes about 40 bytes. Results are read from the cursor in chunks, so
+the dicts never all exist at once, and very large pulls can be spilled to
+memory-mapped files::
+
+    from pymatgen.db.tasktable import TaskTable
+
+    table = TaskTable.from_query(qe, {"nelements": {"$lte": 3}})
+    stable = table.filter(table["analysis.e_above_hull"] < 0.05, nsites=[1, 2, 3, 4])
+    ground_states = table.take(table.groupby("pretty_formula", idx=("energy_per_atom", "idxmin"))["idx"])
+    ground_states.sort("energy_per_atom")["task_id"]
+
+Missing values are NaN in float columns, the minimum value of the dtype in
+int columns (see missing_value) and code -1 in categorical columns.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import itertools
+import json
+import os
+
+import numpy as np
+
+#: dtype of categorical columns.
+CATEGORY = "category"
+
+#: Default columns, as properties or aliases, and their dtypes.
+DEFAULT_COLUMNS = {
+    "task_id": np.int64,
+    "pretty_formula": CATEGORY,
+    "energy_per_atom": np.float64,
+    "nsites": np.int32,
+    "spacegroup.number": np.int16,
+    "analysis.e_above_hull": np.float64,
+    "analysis.bandgap": np.float64,
+}
+
+#: Aggregation functions supported by TaskTable.groupby.
+AGGREGATIONS = ("count", "first", "min", "max", "sum", "mean", "idxmin", "idxmax")
+
+# Name of the metadata file of a saved table.
+_META_FILE = "table.json"
+
+
+def missing_value(dtype):
+    """Value of missing entries in a column of a dtype."""
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return np.nan
+    if dtype.kind in "iu":
+        return np.iinfo(dtype).min
+    raise ValueError(f"Unsupported dtype {dtype}")
+
+
+class TaskTable:
+    """
+    Columns of task properties as NumPy arrays. Build it with from_query or
+    load. Operations return new tables and do not modify this one.
+    """
+
+    def __init__(self, columns, categories=None):
+        """
+        Args:
+            columns: Dict of column name to 1-d array, all of the same length.
+                Categorical columns hold int32 codes.
+            categories: Dict of categorical column name to the list of its
+                distinct values, indexed by code.
+        """
+        self._columns = dict(columns)
+        self._categories = dict(categories or {})
+        lengths = {len(a) for a in self._columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("Columns must all have the same length.")
+        self._len = lengths.pop() if lengths else 0
+
+    @classmethod
+    def from_query(cls, qe, criteria=None, columns=None, chunk_size=100000, spill_dir=None, **kwargs):
+        """
+        Build a table from the results of a query.
+
+        Args:
+            qe: QueryEngine.
+            criteria: Criteria to query for as a dict.
+            columns: Dict of property, or alias, to dtype, a NumPy dtype or
+                CATEGORY. Defaults to DEFAULT_COLUMNS.
+            chunk_size: Number of results converted to arrays at a time.
+            spill_dir: Directory to write the columns to as they are read,
+                which are then memory-mapped, so that tables larger than
+                memory can be built. Reopen it later with load.
+            **kwargs: Other kwargs supported by QueryEngine.query, e.g. sort.
+        """
+        columns = dict(columns or DEFAULT_COLUMNS)
+        kwargs.setdefault("batch_size", min(chunk_size, 10000))
+        kwargs.setdefault("cache", False)
+        results = iter(qe.query(list(columns), criteria, **kwargs))
+        codes = {name: {} for name, dtype in columns.items() if _is_category(dtype)}
+        chunks = {name: [] for name in columns}
+        n = 0
+        with contextlib.ExitStack() as stack:
+            if spill_dir is not None:
+                os.makedirs(spill_dir, exist_ok=True)
+                files = {
+                    name: stack.enter_context(open(os.path.join(spill_dir, f"col{i}.bin"), "wb"))
+                    for i, name in enumerate(columns)
+                }
+            while rows := list(itertools.islice(results, chunk_size)):
+                for name, dtype in columns.items():
+                    chunk = _column_chunk(rows, name, dtype, codes.get(name))
+                    if spill_dir is None:
+                        chunks[name].append(chunk)
+                    else:
+                        files[name].write(chunk.tobytes())
+                n += len(rows)
+        categories = {name: list(c) for name, c in codes.items()}
+        if spill_dir is not None:
+            _write_meta(spill_dir, columns, categories, n)
+            return cls.load(spill_dir)
+        arrays = {
+            name: np.concatenate(c) if c else np.empty(0, dtype=_storage_dtype(columns[name]))
+            for name, c in chunks.items()
+        }
+        return cls(arrays, categories)
+
+    def save(self, directory):
+        """Write the table to a directory, from which load memory-maps it."""
+        os.makedirs(directory, exist_ok=True)
+        dtypes = {}
+        for i, (name, a) in enumerate(self._columns.items()):
+            np.ascontiguousarray(a).tofile(os.path.join(directory, f"col{i}.bin"))
+            dtypes[name] = CATEGORY if name in self._categories else a.dtype
+        _write_meta(directory, dtypes, self._categories, self._len)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """
+        Open a table written by save or by from_query with spill_dir.
+
+        Args:
+            directory: Directory of the table.
+            mmap_mode: numpy.memmap mode, e.g. "r" or "c" for copy-on-write,
+                or None to read the columns into memory.
+        """
+        with open(os.path.join(directory, _META_FILE)) as f:
+            meta = json.load(f)
+        columns = {}
+        for i, col in enumerate(meta["columns"]):
+            path = os.path.join(directory, f"col{i}.bin")
+            dtype = np.dtype(col["dtype"])
+            if mmap_mode is None or meta["length"] == 0:
+                columns[col["name"]] = np.fromfile(path, dtype=dtype, count=meta["length"])
+            else:
+                columns[col["name"]] = np.memmap(path, dtype=dtype, mode=mmap_mode, shape=(meta["length"],))
+        categories = {col["name"]: col["categories"] for col in meta["columns"] if "categories" in col}
+        return cls(columns, categories)
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def columns(self):
+        """Column names."""
+        return list(self._columns)
+
+    @property
+    def nbytes(self):
+        """Size of the columns in bytes, excluding the categories."""
+        return sum(a.nbytes for a in self._columns.values())
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        """
+        Values of a column. Categorical columns are decoded to an object
+        array of their values, see codes for the codes.
+        """
+        if name in self._categories:
+            codes = self._columns[name]
+            values = np.array([*self._categories[name], None], dtype=object)
+            return values[codes]
+        return self._columns[name]
+
+    def codes(self, name):
+        """Codes of a categorical column."""
+        return self._columns[name]
+
+    def categories(self, name):
+        """Distinct values of a categorical column, indexed by code."""
+        return self._categories[name]
+
+    def isna(self, name):
+        """Boolean mask of the missing values of a column."""
+        a = self._columns[name]
+        if name in self._categories:
+            return a < 0
+        return np.isnan(a) if a.dtype.kind == "f" else a == missing_value(a.dtype)
+
+    def row(self, i):
+        """Row i as a dict, with None for missing values."""
+        return {name: self._value(name, i) for name in self._columns}
+
+    def _value(self, name, i):
+        v = self._columns[name][i]
+        if name in self._categories:
+            return None if v < 0 else self._categories[name][v]
+        if np.isnan(v) if v.dtype.kind == "f" else v == missing_value(v.dtype):
+            return None
+        return v.item()
+
+    def take(self, indices):
+        """Table of the rows at indices, an int array, or where a boolean mask is True."""
+        return TaskTable({k: np.asarray(a[indices]) for k, a in self._columns.items()}, self._categories)
+
+    def _match(self, name, value):
+        a = self._columns[name]
+        values = value if isinstance(value, list | tuple | set | np.ndarray) else [value]
+        if name in self._categories:
+            index = {v: i for i, v in enumerate(self._categories[name])}
+            values = [index[v] for v in values if v in index]
+        return np.isin(a, list(values))
+
+    def filter(self, mask=None, **values):
+        """
+        Rows matching all the conditions.
+
+        Args:
+            mask: Boolean array, e.g. table["energy_per_atom"] < -5.
+            **values: Column name to a value, or a list of values, to match.
+                Use a dict for names with dots, e.g.
+                table.filter(**{"spacegroup.number": [225, 229]}).
+
+        Returns:
+            TaskTable
+        """
+        selected = np.ones(self._len, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        for name, value in values.items():
+            selected &= self._match(name, value)
+        return self.take(selected)
+
+    def _sort_key(self, name):
+        a = self._columns[name]
+        if name in self._categories:
+            # Sort by value, not code. Missing values go last.
+            order = np.argsort(np.array(self._categories[name], dtype=object))
+            ranks = np.empty(len(order) + 1, dtype=np.int64)
+            ranks[order] = np.arange(len(order))
+            ranks[-1] = len(order)
+            return ranks[a]
+        return a
+
+    def argsort(self, by, descending=False):
+        """Indices that sort the table by one or more columns, see sort."""
+        by = [by] if isinstance(by, str) else list(by)
+        keys = []
+        for name in reversed(by):
+            key = self._sort_key(name)
+            if descending:
+                # Negate the ranks rather than the values, which could overflow.
+                key = -np.unique(key, return_inverse=True)[1].ravel()
+            # The missing flag is the more significant key of the column.
+            keys += [key, self.isna(name)]
+        return np.lexsort(keys) if keys else np.arange(self._len)
+
+    def sort(self, by, descending=False):
+        """
+        Table sorted by one or more columns, the first being the primary key.
+        The sort is stable, also when descending, categorical columns sort by
+        value, and missing values come last.
+        """
+        return self.take(self.argsort(by, descending=descending))
+
+    def _group_codes(self, by):
+        if by in self._categories:
+            ranks, inverse = np.unique(self._sort_key(by), return_inverse=True)
+            values = np.array([*self._categories[by], None], dtype=object)
+            by_rank = values[[*np.argsort(values[:-1]), len(values) - 1]]
+            return by_rank[ranks], inverse
+        return np.unique(self._columns[by], return_inverse=True)
+
+    def groupby(self, by, **aggregations):
+        """
+        Aggregate columns per distinct value of a column.
+
+        Args:
+            by: Column to group by.
+            **aggregations: Output column name to (column, function), where
+                function is one of AGGREGATIONS. Missing values are ignored
+                by min, max, sum, mean, idxmin and idxmax, which give the
+                row index in this table, e.g. to take the lowest energy task
+                per formula. first decodes categorical columns.
+
+        Returns:
+            Dict of by and the output column names to arrays, with one entry
+            per group, sorted by the group value.
+        """
+        keys, inverse = self._group_codes(by)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind="stable")
+        starts = np.flatnonzero(np.r_[True, np.diff(inverse[order]) != 0]) if len(order) else np.zeros(0, int)
+        counts = np.diff(np.r_[starts, len(order)])
+        result = {by: keys}
+        for out, (name, func) in aggregations.items():
+            if func not in AGGREGATIONS:
+                raise ValueError(f"Unknown aggregation {func}. Use one of {', '.join(AGGREGATIONS)}.")
+            values = self._columns[name][order]
+            result[out] = _aggregate(values, self.isna(name)[order], order, inverse[order], starts, counts, func)
+            if func == "first" and name in self._categories:
+                result[out] = np.array([*self._categories[name], None], dtype=object)[result[out]]
+        return result
+
+
+def _aggregate(values, missing, order, groups, starts, counts, func):
+    """Aggregate values sorted by group, with their missing mask, see TaskTable.groupby."""
+    if func == "count":
+        return counts
+    if func == "first":
+        return values[starts]
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.int64 if func.startswith("idx") else np.float64)
+    floats = np.where(missing, np.nan, values.astype(np.float64))
+    if func == "min":
+        return np.fmin.reduceat(floats, starts)
+    if func == "max":
+        return np.fmax.reduceat(floats, starts)
+    nan = np.isnan(floats)
+    if func in ("sum", "mean"):
+        sums = np.add.reduceat(np.where(nan, 0, floats), starts)
+        if func == "sum":
+            return sums
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / np.add.reduceat(~nan, starts)
+    # idxmin, idxmax: sort each group by value, NaNs last, and take the first.
+    key = np.where(nan, np.inf, floats) if func == "idxmin" else np.where(nan, np.inf, -floats)
+    within = np.lexsort((key, groups))
+    return order[within[starts]]
+
+
+def _is_category(dtype):
+    return isinstance(dtype, str) and dtype == CATEGORY
+
+
+def _storage_dtype(dtype):
+    return np.dtype(np.int32) if _is_category(dtype) else np.dtype(dtype)
+
+
+def _column_chunk(rows, name, dtype, codes=None):
+    """Array of one column of a chunk of query results."""
+    if codes is not None:
+        return np.fromiter(
+            (-1 if (v := r[name]) is None else codes.setdefault(v, len(codes)) for r in rows),
+            dtype=np.int32,
+            count=len(rows),
+        )
+    missing = missing_value(dtype)
+    return np.fromiter((missing if (v := r[name]) is None else v for r in rows), dtype=dtype, count=len(rows))
+
+
+def _write_meta(directory, dtypes, categories, length):
+    meta = {"length": length, "columns": []}
+    for name, dtype in dtypes.items():
+        col = {"name": name, "dtype": _storage_dtype(dtype).str}
+        if name in categories:
+            col["categories"] = categories[name]
+        meta["columns"].append(col)
+    with open(os.path.join(directory, _META_FILE), "w") as f:
+        json.dump(meta, f)
@@ -0,0 +1,412 @@
+"""
+Materialized views of properties derived from the tasks collection, kept up to
+date incrementally as the drone inserts or updates tasks.
+
+A view groups the tasks matching its criteria by the value of one property
+and stores one doc per group in its own collection, with the group value as
+_id. Properties are given as QueryEngine aliases. For example, the lowest
+energy task per formula::
+
+    from pymatgen.db.views import BestTaskView, GroupView, ViewWorker
+
+    ground_states = BestTaskView(
+        "ground_states", "pretty_formula", sort_key="energy_per_atom",
+        properties=["task_id", "energy_per_atom", "e_above_hull"],
+    )
+
+and any reduction of the tasks of a group with GroupView::
+
+    def stats(chemsys, tasks):
+        return {"ntasks": len(tasks), "min_energy": min(t["energy_per_atom"] for t in tasks)}
+
+    chemsys_stats = GroupView("chemsys_stats", "chemsys", stats, properties=["energy_per_atom"])
+
+ViewWorker follows a change stream on the tasks collection and rebuilds the
+groups of the tasks that changed::
+
+    ViewWorker(qe, [ground_states, chemsys_stats]).run()
+
+Change streams need a replica set. On a standalone server the worker polls
+for tasks whose last_updated, which the drone sets on every write, is newer
+than the last seen, so deleted tasks are only removed from the views by a
+rebuild. The resume token or last_updated high-water mark is saved in the
+view_state collection, so a restarted worker picks up where it stopped. A
+view that the worker has not seen before is built in full first.
+"""
+
+from __future__ import annotations
+
+import datetime
+import importlib
+import logging
+import time
+
+import pymongo
+
+from .query_engine import CHANGES_SORT
+
+_log = logging.getLogger("mg." + __name__)
+
+#: Key of the list of _ids of the tasks a view doc was built from.
+SOURCES_KEY = "_sources"
+
+
+def _get_path(doc, path):
+    if path in doc:
+        # Query results are keyed by the full path
+        return doc[path]
+    for key in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+
+def _import_function(name):
+    module, _, func = name.partition(":")
+    return getattr(importlib.import_module(module), func)
+
+
+class View:
+    """Base class of materialized views. Subclasses implement build."""
+
+    def __init__(self, name, group_by, properties=None, criteria=None):
+        """
+        Args:
+            name: Name of the view collection.
+            group_by: Property, or alias, to group tasks by, e.g. "pretty_formula".
+            properties: Properties, or aliases, of the tasks to read. Dots in
+                property names are replaced by underscores in view docs.
+            criteria: Criteria that the tasks of the view must match, in
+                QueryEngine syntax. The QueryEngine's default criteria apply,
+                e.g. only successful tasks are included.
+        """
+        self.name = name
+        self.group_by = group_by
+        self.properties = list(properties or [])
+        self.criteria = dict(criteria or {})
+
+    def keys(self, qe, doc):
+        """
+        Groups affected by a change to a task.
+
+        Args:
+            qe: QueryEngine.
+            doc: Changed task doc, with the Mongo field names. Only has the
+                fields in ViewWorker.fields when polling.
+
+        Returns:
+            List of group values.
+        """
+        value = _get_path(doc, qe.aliases.get(self.group_by, self.group_by))
+        return [] if value is None else [value]
+
+    def all_keys(self, qe):
+        """All group values, for a rebuild."""
+        return list(qe.query(criteria=self.criteria, distinct_key=qe.aliases.get(self.group_by, self.group_by)))
+
+    def tasks(self, qe, key, **kwargs):
+        """Tasks of a group, with properties and _id. kwargs are passed to query."""
+        return qe.query(["_id", *self.properties], {**self.criteria, self.group_by: key}, cache=False, **kwargs)
+
+    def build(self, qe, key):
+        """
+        Build the view doc of a group.
+
+        Args:
+            qe: QueryEngine.
+            key: Group value.
+
+        Returns:
+            (doc, list of the _ids of the tasks it was built from), or None if
+            the group is empty.
+        """
+        raise NotImplementedError
+
+    def as_dict(self):
+        """Dict of the constructor args, see view_from_dict."""
+        return {
+            "type": self.__class__.__name__,
+            "name": self.name,
+            "group_by": self.group_by,
+            "properties": self.properties,
+            "criteria": self.criteria,
+        }
+
+
+class BestTaskView(View):
+    """
+    One doc per group with the properties of the task with the lowest (or
+    highest) value of a property, e.g. the ground state of each formula.
+    """
+
+    def __init__(self, name, group_by, sort_key="energy_per_atom", properties=None, criteria=None, ascending=True):
+        """
+        Args:
+            name: Name of the view collection.
+            group_by: Property, or alias, to group tasks by.
+            sort_key: Property, or alias, to pick the task by.
+            properties: Properties, or aliases, to store. task_id and sort_key
+                are always stored.
+            criteria: Criteria that the tasks of the view must match.
+            ascending: Pick the task with the lowest value of sort_key if
+                True, the highest otherwise.
+        """
+        properties = list(properties or [])
+        properties += [p for p in ("task_id", sort_key) if p not in properties]
+        super().__init__(name, group_by, properties=properties, criteria=criteria)
+        self.sort_key = sort_key
+        self.ascending = ascending
+
+    def build(self, qe, key):
+        """View doc of a group, see View.build."""
+        direction = pymongo.ASCENDING if self.ascending else pymongo.DESCENDING
+        sort = [(qe.aliases.get(self.sort_key, self.sort_key), direction)]
+        for r in self.tasks(qe, key, sort=sort, limit=1):
+            return {k: v for k, v in r.items() if k != "_id"}, [r["_id"]]
+        return None
+
+    def as_dict(self):
+        """Dict of the constructor args, see view_from_dict."""
+        return {**super().as_dict(), "sort_key": self.sort_key, "ascending": self.ascending}
+
+
+class GroupView(View):
+    """
+    One doc per group computed by a function of all the tasks of the group,
+    e.g. statistics or hull data per chemsys.
+    """
+
+    def __init__(self, name, group_by, function, properties=None, criteria=None):
+        """
+        Args:
+            name: Name of the view collection.
+            group_by: Property, or alias, to group tasks by.
+            function: Function taking the group value and the list of query
+                results of the tasks of the group, and returning the view doc
+                as a dict, or None to have no doc for the group. May be given
+                as "module:function".
+            properties: Properties, or aliases, of the tasks passed to function.
+            criteria: Criteria that the tasks of the view must match.
+        """
+        super().__init__(name, group_by, properties=properties, criteria=criteria)
+        self.function = _import_function(function) if isinstance(function, str) else function
+
+    def build(self, qe, key):
+        """View doc of a group, see View.build."""
+        tasks = list(self.tasks(qe, key))
+        doc = self.function(key, [{k: v for k, v in t.items() if k != "_id"} for t in tasks]) if tasks else None
+        if doc is None:
+            return None
+        return doc, [t["_id"] for t in tasks]
+
+    def as_dict(self):
+        """Dict of the constructor args, see view_from_dict."""
+        f = self.function
+        return {**super().as_dict(), "function": f"{f.__module__}:{f.__qualname__}"}
+
+
+def view_from_dict(d):
+    """
+    Create a view from a dict, e.g. loaded from JSON.
+
+    For example::
+
+        {"type": "BestTaskView", "name": "ground_states", "group_by": "pretty_formula",
+         "sort_key": "energy_per_atom", "properties": ["task_id", "e_above_hull"]}
+
+    The function of a GroupView is given as "module:function".
+    """
+    d = dict(d)
+    cls = {"BestTaskView": BestTaskView, "GroupView": GroupView}[d.pop("type", "BestTaskView")]
+    return cls(**d)
+
+
+class ViewWorker:
+    """
+    Keeps materialized views up to date with the tasks collection of a
+    QueryEngine. See the module docstring.
+    """
+
+    def __init__(self, qe, views, name="views", state_collection="view_state", batch_size=1000, poll_interval=10):
+        """
+        Args:
+            qe: QueryEngine of the tasks collection. Needs write access to
+                the database of the views.
+            views: List of Views.
+            name: Name of the worker. Workers with different names keep
+                separate state, e.g. to run the views of different teams
+                separately.
+            state_collection: Collection in which the worker saves its state.
+            batch_size: Maximum number of changed tasks to process at once.
+            poll_interval: Seconds between polls when polling, and maximum
+                seconds between state saves when following a change stream.
+        """
+        self.qe = qe
+        self.views = list(views)
+        self.name = name
+        self.state_collection = qe.db[state_collection]
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        #: Task fields needed to find the groups affected by a change.
+        self.fields = sorted({"_id", "last_updated", *(qe.aliases.get(v.group_by, v.group_by) for v in self.views)})
+        self.state = self.state_collection.find_one({"_id": name}) or {"_id": name, "views": []}
+
+    def _save_state(self, **kwargs):
+        self.state.update(kwargs)
+        self.state_collection.replace_one({"_id": self.name}, self.state, upsert=True)
+
+    def _store(self, view, key, built):
+        coll = self.qe.db[view.name]
+        if built is None:
+            coll.delete_one({"_id": key})
+            return
+        doc, sources = built
+        doc = {k.replace(".", "_"): v for k, v in doc.items()}
+        doc[SOURCES_KEY] = sources
+        doc["_updated"] = datetime.datetime.now(datetime.timezone.utc)
+        coll.replace_one({"_id": key}, doc, upsert=True)
+
+    def update(self, view, key):
+        """Rebuild the doc of one group of a view."""
+        self._store(view, key, view.build(self.qe, key))
+
+    def rebuild(self, views=None):
+        """
+        Build views in full, and remove docs of groups that no longer exist.
+
+        Args:
+            views: Views to rebuild. Defaults to all.
+        """
+        latest = self._latest_change()
+        for view in views or self.views:
+            _log.info(f"Rebuilding view {view.name}")
+            keys = view.all_keys(self.qe)
+            for key in keys:
+                self.update(view, key)
+            self.qe.db[view.name].delete_many({"_id": {"$nin": keys}})
+            self.qe.db[view.name].create_index(SOURCES_KEY)
+        built = sorted({*self.state["views"], *(v.name for v in views or self.views)})
+        if self.state.get("high_water_mark") is None:
+            self._save_state(views=built, high_water_mark=latest)
+        else:
+            self._save_state(views=built)
+
+    def _latest_change(self):
+        """High-water mark of the last task updated, see QueryEngine.query_since."""
+        sort = [(k, pymongo.DESCENDING) for k, _ in CHANGES_SORT]
+        for d in self.qe.collection.find({"last_updated": {"$ne": None}}, {"last_updated": 1}).sort(sort).limit(1):
+            return {"last_updated": d["last_updated"], "_id": d["_id"]}
+        return None
+
+    def _build_new_views(self):
+        new = [v for v in self.views if v.name not in self.state["views"]]
+        if new:
+            self.rebuild(new)
+
+    def process(self, docs=(), deleted_ids=()):
+        """
+        Update the groups affected by changed tasks.
+
+        Args:
+            docs: Changed task docs, with at least the fields in self.fields.
+            deleted_ids: _ids of deleted tasks.
+
+        Returns:
+            Number of view docs updated.
+        """
+        n = 0
+        deleted_ids = list(deleted_ids)
+        for view in self.views:
+            keys = {}
+            for doc in docs:
+                for key in view.keys(self.qe, doc):
+                    # Group values may be unhashable, e.g. lists
+                    keys.setdefault(repr(key), key)
+            # Groups that the tasks were in, in case they moved or were deleted.
+            ids = [doc["_id"] for doc in docs] + deleted_ids
+            if ids:
+                for d in self.qe.db[view.name].find({SOURCES_KEY: {"$in": ids}}, {"_id": 1}):
+                    keys.setdefault(repr(d["_id"]), d["_id"])
+            for key in keys.values():
+                self.update(view, key)
+            n += len(keys)
+        return n
+
+    def poll_once(self):
+        """
+        Process the tasks updated since the last poll.
+
+        Returns:
+            Number of tasks processed.
+        """
+        self._build_new_views()
+        ntasks = 0
+        for batch, mark in self.qe.iter_changes(
+            self.state.get("high_water_mark"), self.fields, batch_size=self.batch_size
+        ):
+            self.process(batch)
+            self._save_state(high_water_mark=mark)
+            ntasks += len(batch)
+        return ntasks
+
+    def watch(self, stop=None):
+        """
+        Follow the change stream of the tasks collection until stop is set.
+
+        Args:
+            stop: threading.Event, or None to run forever.
+
+        Raises:
+            pymongo.errors.OperationFailure or NotImplementedError: If change
+                streams are not supported, e.g. on a standalone server.
+        """
+        kwargs = {"full_document": "updateLookup", "max_await_time_ms": 1000}
+        if self.state.get("resume_token") is not None:
+            kwargs["resume_after"] = self.state["resume_token"]
+        with self.qe.collection.watch(**kwargs) as stream:
+            # Open the stream before building new views, so no change is missed.
+            self._build_new_views()
+            docs, deleted, saved = [], [], time.monotonic()
+            while stop is None or not stop.is_set():
+                change = stream.try_next()
+                if change is not None:
+                    if change["operationType"] == "delete":
+                        deleted.append(change["documentKey"]["_id"])
+                    elif change.get("fullDocument") is not None:
+                        docs.append(change["fullDocument"])
+                    elif change["operationType"] in ("drop", "rename", "invalidate"):
+                        _log.warning(f"Tasks collection {change['operationType']}, stopping. Rebuild the views.")
+                        break
+                if len(docs) + len(deleted) >= self.batch_size or (
+                    change is None and (docs or deleted or time.monotonic() - saved > self.poll_interval)
+                ):
+                    self.process(docs, deleted)
+                    docs, deleted, saved = [], [], time.monotonic()
+                    self._save_state(resume_token=stream.resume_token)
+            if docs or deleted:
+                self.process(docs, deleted)
+                self._save_state(resume_token=stream.resume_token)
+
+    def run(self, stop=None, change_stream=True):
+        """
+        Keep the views up to date until stop is set, following a change stream
+        if the server supports them and polling otherwise.
+
+        Args:
+            stop: threading.Event, or None to run forever.
+            change_stream: Whether to try a change stream before polling.
+        """
+        if change_stream:
+            try:
+                self.watch(stop)
+                return
+            except (pymongo.errors.OperationFailure, NotImplementedError) as ex:
+                _log.info(f"Change streams unavailable ({ex}), polling last_updated.")
+        while stop is None or not stop.is_set():
+            n = self.poll_once()
+            _log.debug(f"Processed {n} updated tasks")
+            if stop is None:
+                time.sleep(self.poll_interval)
+            else:
+                stop.wait(self.poll_interval)
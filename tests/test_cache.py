@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import tempfile
+import unittest
+
+import mongomock
+import mongomock.gridfs
+
+from pymatgen.db.cache import DiskCache, MemoryCache, QueryCache, bump_generation, get_generation
+from pymatgen.db.query_engine import QueryEngine
+from pymatgen.db.synth import TaskDocGenerator, insert_docs
+
+mongomock.gridfs.enable_gridfs_integration()
+
+
+class BackendTest(unittest.TestCase):
+    def check_backend(self, backend):
+        assert backend.get("a") is None
+        backend.set("a", [{"x": 1}])
+        value = backend.get("a")
+        assert value == [{"x": 1}]
+        value.append(2)
+        assert backend.get("a") == [{"x": 1}]
+        backend.set("b", 1, ttl=-1)
+        assert backend.get("b") is None
+        backend.clear()
+        assert backend.get("a") is None
+
+    def test_memory(self):
+        backend = MemoryCache(maxsize=2)
+        self.check_backend(backend)
+        for k in "abc":
+            backend.set(k, k)
+        backend.get("b")
+        backend.set("d", "d")
+        assert len(backend) == 2
+        assert backend.get("c") is None
+        assert backend.get("b") == "b"
+
+    def test_disk(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.check_backend(DiskCache(tmpdir))
+            DiskCache(tmpdir).set("a", 1)
+            assert DiskCache(tmpdir).get("a") == 1
+
+
+class QueryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = mongomock.MongoClient()
+        self.db = self.conn["vasp"]
+        generator = TaskDocGenerator(elements={"Li": 1, "Fe": 1, "O": 1}, nsites=(2, 4), dos_npoints=0)
+        self.docs = generator.generate(20, seed=0)
+        insert_docs(self.db, self.docs[:10])
+        self.cache = QueryCache(ttl=None)
+        self.qe = QueryEngine(connection=self.conn, cache=self.cache)
+
+    def test_generation(self):
+        assert get_generation(self.db, "tasks") == 1
+        bump_generation(self.db, "tasks")
+        assert get_generation(self.db, "tasks") == 2
+        assert get_generation(self.db, "other") == 0
+
+    def test_query(self):
+        props = ["task_id", "energy"]
+        results = self.qe.query(props, {"nsites": {"$gte": 2}}, sort=[("task_id", 1)], batch_size=5)
+        assert len(results) == 10
+        assert (self.cache.hits, self.cache.misses) == (0, 1)
+
+        # Same parsed criteria and options, with aliases and batch size that do not change the results.
+        cached = self.qe.query(props, {"nsites": {"$gte": 2}, "state": "successful"}, sort=[("task_id", 1)])
+        assert list(cached) == list(results)
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+        self.qe.query(props, {"nsites": {"$gte": 2}}, sort=[("task_id", -1)])
+        self.qe.query(["task_id"], {"nsites": {"$gte": 2}}, sort=[("task_id", 1)])
+        self.qe.query(props, {"nsites": {"$gte": 2}}, sort=[("task_id", 1)], cache=False)
+        assert (self.cache.hits, self.cache.misses) == (1, 3)
+
+        # Writes invalidate the cache.
+        insert_docs(self.db, self.docs[10:])
+        results = self.qe.query(props, {"nsites": {"$gte": 2}}, sort=[("task_id", 1)])
+        assert len(results) == 20
+        assert (self.cache.hits, self.cache.misses) == (1, 4)
+
+    def test_max_results(self):
+        self.cache.max_results = 5
+        assert len(list(self.qe.query(["task_id"], {}))) == 10
+        assert len(list(self.qe.query(["task_id"], {}))) == 10
+        assert self.cache.hits == 0
+
+    def test_get_entries(self):
+        entries = self.qe.get_entries({"nelements": {"$gte": 1}})
+        assert len(entries) == 10
+        cached = self.qe.get_entries({"nelements": {"$gte": 1}})
+        assert [e.entry_id for e in cached] == [e.entry_id for e in entries]
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+    def test_disk(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            qe = QueryEngine(connection=self.conn, cache=QueryCache(DiskCache(tmpdir), ttl=60))
+            first = list(qe.query(["task_id", "pretty_formula"], {}))
+            other = QueryEngine(connection=self.conn, cache=QueryCache(DiskCache(tmpdir)))
+            assert list(other.query(["task_id", "pretty_formula"], {})) == first
+            assert other.cache.hits == 1
+
+    def test_generation_check_interval(self):
+        self.cache.generation_check_interval = 60
+        self.qe.query(["task_id"], {})
+        insert_docs(self.db, self.docs[10:])
+        assert len(self.qe.query(["task_id"], {})) == 10
+        self.cache._generations.clear()
+        assert len(self.qe.query(["task_id"], {})) == 20
+
+
+if __name__ == "__main__":
+    unittest.main()
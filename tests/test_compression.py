@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import json
+import unittest
+import zlib
+
+import gridfs
+import mongomock
+import mongomock.gridfs
+import pytest
+
+from pymatgen.db.compression import CODECS, benchmark_codecs, compress, decompress, get_payload, put_payload
+from pymatgen.db.query_engine import QueryEngine
+from pymatgen.db.synth import TaskDocGenerator, insert_docs
+from pymatgen.electronic_structure.dos import CompleteDos
+
+mongomock.gridfs.enable_gridfs_integration()
+
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.data = json.dumps({"energies": list(range(1000)), "densities": [0.0] * 1000}).encode("utf-8")
+        self.fs = gridfs.GridFS(mongomock.MongoClient()["vasp"], "dos_fs")
+
+    def test_roundtrip(self):
+        for name in CODECS:
+            assert decompress(compress(self.data, name), name) == self.data
+        assert len(compress(self.data, "zlib")) < len(self.data)
+        with pytest.raises(ValueError, match="Unknown or unavailable codec"):
+            compress(self.data, "brotli")
+
+    def test_payload(self):
+        file_id = put_payload(self.fs, self.data, "zlib", level=6, format="json")
+        with self.fs.get(file_id) as f:
+            assert f.metadata == {"codec": "zlib", "format": "json"}
+        assert get_payload(self.fs, file_id) == self.data
+
+        # Files written before codecs were recorded.
+        assert get_payload(self.fs, self.fs.put(zlib.compress(self.data))) == self.data
+        assert get_payload(self.fs, self.fs.put(self.data)) == self.data
+
+    def test_benchmark(self):
+        results = benchmark_codecs([self.data], codecs=["none", "zlib"], levels={"zlib": [1, 9]}, repeat=1)
+        assert [(r["codec"], r["level"]) for r in results] == [("none", None), ("zlib", 1), ("zlib", 9)]
+        assert results[0]["ratio"] == 1
+        assert all(r["ratio"] > 1 for r in results[1:])
+
+    def test_get_dos_from_id(self):
+        conn = mongomock.MongoClient()
+        generator = TaskDocGenerator(elements={"Li": 1, "O": 1}, nelements=(2, 2), nsites=(3, 4), dos_npoints=21)
+        docs = generator.generate(2, seed=0)
+        insert_docs(conn["vasp"], docs[:1], dos_codec="zlib")
+        insert_docs(conn["vasp"], docs[1:])
+        qe = QueryEngine(connection=conn)
+        for task_id in (1, 2):
+            dos = qe.get_dos_from_id(task_id)
+            assert isinstance(dos, CompleteDos)
+            assert len(dos.energies) == 21
+            assert len(dos.pdos) == len(dos.structure)
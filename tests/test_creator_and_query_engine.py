@@ -7,6 +7,7 @@ from __future__ import annotations
 import os
 import unittest
 import warnings
+from unittest import mock
 
 import pytest
 from pymongo import MongoClient
@@ -16,7 +17,7 @@ from pymatgen.apps.borg.queen import BorgQueen
 from pymatgen.core.structure import Structure
 from pymatgen.electronic_structure.dos import CompleteDos
 from pymatgen.entries.computed_entries import ComputedEntry
-from pymatgen.db.creator import VaspToDbTaskDrone
+from pymatgen.db.creator import VaspToDbTaskDrone, count_ionic_steps
 from pymatgen.db.query_engine import QueryEngine
 from tests import common
 
@@ -169,3 +170,52 @@ class VaspToDbTaskDroneTest(unittest.TestCase):
     def tearDownClass(cls):
         if cls.conn is not None:
             cls.conn.drop_database("creator_unittest")
+
+
+class LowMemoryDroneTest(unittest.TestCase):
+    def setUp(self):
+        import mongomock
+        import mongomock.gridfs
+
+        mongomock.gridfs.enable_gridfs_integration()
+        self.conn = mongomock.MongoClient()
+        patcher = mock.patch("pymatgen.db.creator.MongoClient", return_value=self.conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_arrays_to_gridfs(self):
+        path = os.path.join(test_dir, "db_test", "Li2O")
+        full = VaspToDbTaskDrone(simulate_mode=True).assimilate(path)
+        drone = VaspToDbTaskDrone(ionic_step_skip=2, arrays_to_gridfs=True)
+        task_id = drone.assimilate(path)
+        qe = QueryEngine(connection=self.conn)
+        doc = qe.collection.find_one({"task_id": task_id})
+        output = doc["calculations"][-1]["output"]
+        assert "eigenvalues" not in output
+        assert "eigenvalues_fs_id" in output
+        assert output["bandgap"] == pytest.approx(full["calculations"][-1]["output"]["bandgap"])
+        n_steps = len(full["calculations"][-1]["output"]["ionic_steps"])
+        assert len(output["ionic_steps"]) == (n_steps + 1) // 2
+        assert doc["output"]["final_energy"] == pytest.approx(full["output"]["final_energy"])
+
+        eigenvalues = qe.get_array_from_id(task_id)
+        expected = full["calculations"][-1]["output"]["eigenvalues"]
+        assert set(eigenvalues) == set(expected)
+        for spin, values in expected.items():
+            assert eigenvalues[spin].tolist() == values
+        assert qe.get_array_from_id(task_id, "projected_eigenvalues") is None
+
+    def test_ionic_step_skip_keeps_last_step(self):
+        path = os.path.join(test_dir, "db_test", "Li2O")
+        full = VaspToDbTaskDrone(simulate_mode=True).assimilate(path)
+        steps = full["calculations"][-1]["output"]["ionic_steps"]
+        assert count_ionic_steps(os.path.join(path, "vasprun.xml")) == len(steps) == 3
+        assert count_ionic_steps(os.path.join(path, "vasprun.xml"), chunk_size=7) == 3
+        for skip in (3, 4):
+            doc = VaspToDbTaskDrone(simulate_mode=True, ionic_step_skip=skip).assimilate(path)
+            assert doc["output"]["final_energy"] == pytest.approx(-14.31337758)
+            assert doc["output"]["final_energy"] == pytest.approx(full["output"]["final_energy"])
+            assert doc["output"]["crystal"] == full["output"]["crystal"]
+            assert doc["calculations"][-1]["output"]["ionic_steps"] == steps[-1:]
+            assert doc["input"]["potcar_spec"] == full["input"]["potcar_spec"]
+            assert doc["input"]["potcar_spec"][0]["summary_stats"]
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import contextlib
+import datetime
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import bson
+import mongomock
+import pytest
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+from pymatgen.db.cli import _get_cursor_kwargs, _get_parser, query_db
+from pymatgen.db.export import (
+    ArrowWriter,
+    BSONWriter,
+    DelimitedWriter,
+    JSONLinesWriter,
+    TableWriter,
+    chunked,
+    guess_format,
+)
+from pymatgen.db.query_engine import QueryEngine, QueryResults
+from pymatgen.db.util import JSON_SERIALIZERS, MongoJSONEncoder, get_json_serializer
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+class WriterTest(unittest.TestCase):
+    def test_table_writer(self):
+        out = io.StringIO()
+        writer = TableWriter(out, ["task_id", "formula", "energy"], sample_size=2)
+        writer.write_row([1, "Li2O", -14.3133])
+        assert out.getvalue() == ""  # still sampling
+        writer.write_row([22, "Fe", None])
+        writer.write_row([333333, "LiFePO4", -100.123456789])
+        writer.close()
+        assert out.getvalue().splitlines() == [
+            "task_id  formula    energy",
+            "-------  -------  --------",
+            "      1  Li2O     -14.3133",
+            "     22  Fe",
+            " 333333  LiFePO4  -100.123",
+        ]
+
+    def test_table_writer_empty(self):
+        out = io.StringIO()
+        TableWriter(out, ["a", "b"]).close()
+        assert out.getvalue().splitlines() == ["a  b", "-  -"]
+
+    def test_delimited_writer(self):
+        out = io.StringIO()
+        writer = DelimitedWriter(out, ["a", "b", "c"], delimiter="\t")
+        writer.write_row([1 / 3, "x,y", {"k": [1]}])
+        writer.write_row([None, "z", [1, 2]])
+        assert out.getvalue().splitlines() == ["a\tb\tc", '0.3333333333333333\tx,y\t"{""k"": [1]}"', "\tz\t[1, 2]"]
+
+    def test_json_serializers(self):
+        doc = {"_id": bson.ObjectId(), "t": datetime.datetime(2020, 1, 2, 3, 4, 5), "a": [1.5, {"b": None}]}
+        expected = json.loads(json.dumps(doc, cls=MongoJSONEncoder))
+        for backend in ("auto", "json"):
+            assert json.loads(get_json_serializer(backend)(doc)) == expected
+        assert bson.json_util.loads(get_json_serializer("bson")(doc)) == doc
+        with pytest.raises(ValueError, match="Unknown JSON serializer"):
+            get_json_serializer("yaml")
+        assert "orjson" in JSON_SERIALIZERS
+
+    def test_json_lines_writer(self):
+        out = io.BytesIO()
+        writer = JSONLinesWriter(out, serializer="json")
+        writer.write_row({"a": 1})
+        writer.write_row({"b": [2]})
+        writer.close()
+        assert out.getvalue() == b'{"a": 1}\n{"b": [2]}\n'
+
+    def test_raw_results(self):
+        doc = {"_id": bson.ObjectId(), "task_id": 1, "output": {"crystal": {"sites": [{"xyz": [0, 0, 0]}]}, "gap": 1.2}}
+        raw = RawBSONDocument(bson.encode(doc), CodecOptions(document_class=RawBSONDocument))
+        prop_dict = {"task_id": ["task_id"], "output.crystal": ["output", "crystal"], "gap": ["output", "gap"]}
+        result = next(iter(QueryResults(prop_dict, [raw])))
+        assert isinstance(result["output.crystal"], RawBSONDocument)
+        expected = {"task_id": 1, "output.crystal": doc["output"]["crystal"], "gap": 1.2}
+        for backend in ("auto", "json", "bson"):
+            assert json.loads(get_json_serializer(backend)(result)) == expected
+
+        out = io.BytesIO()
+        writer = BSONWriter(out)
+        writer.write_row(raw)
+        writer.write_row(result)
+        writer.close()
+        assert out.getvalue().startswith(raw.raw)
+        assert list(bson.decode_file_iter(io.BytesIO(out.getvalue()))) == [doc, expected]
+        assert guess_format("tasks.bson") == "bson"
+
+    def test_cursor_kwargs(self):
+        qe = QueryEngine(connection=mongomock.MongoClient())
+        parser = _get_parser()
+        args = parser.parse_args(
+            ["query", "--props", "task_id", "--limit", "10", "--sort", "nelements", "energy:desc", "task_id:asc"]
+        )
+        assert _get_cursor_kwargs(args, qe) == {
+            "limit": 10,
+            "sort": [("nelements", 1), ("output.final_energy", -1), ("task_id", 1)],
+        }
+        with contextlib.redirect_stderr(io.StringIO()), pytest.raises(SystemExit):
+            parser.parse_args(["query", "--props", "task_id", "--sort", "energy:down"])
+
+
+class QueryCommandTest(unittest.TestCase):
+    def setUp(self):
+        conn = mongomock.MongoClient()
+        conn["vasp"]["tasks"].insert_many(
+            [{"task_id": i, "state": "successful", "output": {"final_energy": -1.0 * i}} for i in range(1, 4)]
+        )
+        patcher = mock.patch("pymatgen.db.cli._get_query_engine", return_value=QueryEngine(connection=conn))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def run_query(self, *argv):
+        # A real file as stdout, as JSON output is written to its file descriptor.
+        path = os.path.join(self.tmpdir.name, "stdout")
+        with open(path, "w") as f, contextlib.redirect_stdout(f):
+            query_db(_get_parser().parse_args(["query", "--props", "task_id", "energy", *argv]))
+        with open(path) as f:
+            return f.read()
+
+    def test_json(self):
+        for argv in (["--dump"], ["--format", "json"]):
+            out = self.run_query(*argv, "--sort", "task_id:desc")
+            rows = [json.loads(line) for line in out.splitlines()]
+            assert rows == [{"task_id": i, "energy": -1.0 * i} for i in (3, 2, 1)]
+
+    def test_csv(self):
+        out = self.run_query("--format", "csv", "--limit", "2", "--sort", "task_id")
+        assert out.splitlines() == ["task_id,energy", "1,-1.0", "2,-2.0"]
+
+
+@unittest.skipUnless(pa, "requires pyarrow")
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = mongomock.MongoClient()
+        self.conn["vasp"]["tasks"].insert_many(
+            [
+                {
+                    "task_id": i,
+                    "state": "successful",
+                    "pretty_formula": f"Li{i}O",
+                    "output": {"final_energy": -1.0 * i},
+                    "elements": ["Li", "O"],
+                }
+                for i in range(1, 26)
+            ]
+        )
+        self.qe = QueryEngine(connection=self.conn)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_guess_format(self):
+        assert guess_format("a.parquet") == "parquet"
+        assert guess_format("a.feather") == "feather"
+        with pytest.raises(ValueError, match="Cannot guess"):
+            guess_format("a.csv")
+
+    def test_chunked(self):
+        assert [len(c) for c in chunked(range(25), 10)] == [10, 10, 5]
+
+    def test_export_parquet(self):
+        path = os.path.join(self.tmpdir.name, "tasks.parquet")
+        props = ["task_id", "pretty_formula", "energy", "elements", "_id", "missing"]
+        assert self.qe.export(path, props, chunk_size=10) == 25
+        table = pq.read_table(path)
+        assert table.column_names == props
+        assert table.schema.field("task_id").type == pa.int64()
+        assert table.schema.field("energy").type == pa.float64()
+        assert table.schema.field("_id").type == pa.string()
+        assert table.schema.field("missing").type == pa.string()
+        assert pq.ParquetFile(path).num_row_groups == 3
+        assert sorted(table.column("task_id").to_pylist()) == list(range(1, 26))
+
+    def test_export_feather(self):
+        from pyarrow import feather
+
+        path = os.path.join(self.tmpdir.name, "tasks.feather")
+        assert self.qe.export(path, ["task_id", "energy"], criteria={"task_id": {"$lt": 5}}, chunk_size=2) == 4
+        assert feather.read_table(path).num_rows == 4
+
+    def test_export_jsonl(self):
+        path = os.path.join(self.tmpdir.name, "tasks.jsonl")
+        assert self.qe.export(path, ["task_id", "energy"], sort=[("task_id", 1)]) == 25
+        with open(path) as f:
+            rows = [json.loads(line) for line in f]
+        assert rows[0] == {"task_id": 1, "energy": -1.0}
+
+    def test_string_fallback(self):
+        path = os.path.join(self.tmpdir.name, "mixed.parquet")
+        with ArrowWriter(path, ["a"]) as writer:
+            writer.write_rows([{"a": None}])
+            writer.write_rows([{"a": {"b": 1}}, {"a": "x"}])
+        assert pq.read_table(path).column("a").to_pylist() == [None, '{"b": 1}', "x"]
+
+    def test_type_mismatch(self):
+        path = os.path.join(self.tmpdir.name, "bad.parquet")
+        with ArrowWriter(path, ["a"]) as writer:
+            writer.write_rows([{"a": 1}])
+            with pytest.raises(ValueError, match="inferred from the first chunk"):
+                writer.write_rows([{"a": "x"}])
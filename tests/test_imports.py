@@ -0,0 +1,53 @@
+"""
+Import-time regression tests. The CLI and the query engine should not pull
+in heavy dependencies until the code path that needs them runs.
+"""
+
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+HEAVY_MODULES = [
+    "pymatgen.core",
+    "pymatgen.electronic_structure.dos",
+    "pymatgen.entries.computed_entries",
+    "pymatgen.io.vasp",
+    "pymatgen.ext.matproj",
+    "pymatgen.symmetry.analyzer",
+    "pymatgen.analysis.local_env",
+    "gridfs",
+    "ruamel.yaml",
+    "tabulate",
+    "pyarrow",
+]
+
+
+def loaded_heavy_modules(*modules):
+    code = "import sys\n"
+    code += "".join(f"import {m}\n" for m in modules)
+    code += f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    with tempfile.TemporaryDirectory() as home:
+        # Use an empty home dir so that a ~/.pmgrc.yaml cannot affect the result.
+        env = dict(os.environ, HOME=home)
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+    return [m for m in out.stdout.strip().split(",") if m]
+
+
+class ImportTest(unittest.TestCase):
+    def test_package(self):
+        assert loaded_heavy_modules("pymatgen.db") == []
+
+    def test_query_engine(self):
+        assert loaded_heavy_modules("pymatgen.db.query_engine") == []
+
+    def test_cli(self):
+        assert loaded_heavy_modules("pymatgen.db.cli") == []
+
+    def test_settings(self):
+        import pymatgen.db
+
+        assert isinstance(pymatgen.db.SETTINGS, dict)
@@ -1,13 +1,31 @@
 from __future__ import annotations
 
+import json
+import os
+import tempfile
 import unittest
 
-from pymatgen.db.matproj import MPDB
+import mongomock
+import pytest
+
+from pymatgen.core import Lattice, Structure
+from pymatgen.db.cache import get_generation
+from pymatgen.db.matproj import MPDB, LocalEntrySource, MPRestEntrySource
+from pymatgen.entries.computed_entries import ComputedEntry, ComputedStructureEntry
 from tests import common
 
 has_mongo = common.has_mongo()
 
 
+def make_entries(n):
+    entries = []
+    for i in range(n):
+        species = ["Fe", "O"] if i % 2 else ["Li", "O"]
+        s = Structure(Lattice.cubic(3 + 0.01 * i), species, [[0, 0, 0], [0.5, 0.5, 0.5]])
+        entries.append(ComputedStructureEntry(s, -10.0 - i, entry_id=f"mp-{i}"))
+    return entries
+
+
 class MPDBTest(unittest.TestCase):
     @unittest.skipUnless(has_mongo, "requires MongoDB server")
     def test_queryresult(self):
@@ -15,3 +33,147 @@ class MPDBTest(unittest.TestCase):
         mpdb.create({"chemsys": "Fe-O"})
         entries = mpdb.get_entries_in_chemsys(["Fe", "O"])
         assert len(entries) > 0
+
+
+class MPRestEntrySourceTest(unittest.TestCase):
+    def test_criteria(self):
+        source = MPRestEntrySource({"chemsys": ["Li-O", "Fe-O"], "material_id": "mp-1"})
+        assert source.criteria == ["Li-O", "Fe-O", "mp-1"]
+        with pytest.raises(ValueError, match="nelements"):
+            MPRestEntrySource({"chemsys": "Li-O", "nelements": 2})
+
+
+class ListSource:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def pages(self):
+        yield "all", self.entries
+
+
+class FailingSource:
+    """Raises after yielding the first page."""
+
+    def __init__(self, source):
+        self.source = source
+
+    def pages(self):
+        for i, (key, entries) in enumerate(self.source.pages()):
+            if i == 1:
+                raise RuntimeError("connection lost")
+            yield key, entries
+
+
+class MPDBCreateTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mongomock.patch(servers=(("localhost", 27017),))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "entries.jsonl")
+        with open(self.path, "w") as f:
+            for e in make_entries(25):
+                f.write(json.dumps(e.as_dict()) + "\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_create_from_local_source(self):
+        mpdb = MPDB()
+        assert mpdb.create(source=LocalEntrySource(self.path, page_size=10), chunk_size=4) == 25
+        assert mpdb.collection.count_documents({}) == 25
+        assert mpdb.progress.count_documents({"complete": True}) == 3
+        assert len(mpdb.get_entries_in_chemsys("Fe-O")) == 12
+        assert "chemsys_1" in mpdb.collection.index_information()
+
+    def test_resume(self):
+        mpdb = MPDB()
+        source = LocalEntrySource(self.path, page_size=10)
+        with self.assertRaises(RuntimeError):
+            mpdb.create(source=FailingSource(source))
+        assert mpdb.collection.count_documents({}) == 10
+        # Simulate a page that was partially inserted when the build died.
+        mpdb.progress.insert_one({"_id": "entries.jsonl:10", "complete": False})
+        mpdb.collection.insert_one(MPDB.entry_to_doc(make_entries(11)[10]))
+        assert mpdb.create(source=source) == 15
+        assert len(mpdb.collection.distinct("entry_id")) == mpdb.collection.count_documents({}) == 25
+        # Everything is checkpointed, so running again is a no-op.
+        assert mpdb.create(source=source) == 0
+        assert mpdb.collection.index_information()["entry_id_1"]["unique"]
+
+    def test_resume_shifted_pages(self):
+        mpdb = MPDB()
+        mpdb.collection.create_index("entry_id")
+        with self.assertRaises(RuntimeError):
+            mpdb.create(source=FailingSource(LocalEntrySource(self.path, page_size=10)))
+        # Pages of another size overlap the completed one.
+        assert mpdb.create(source=LocalEntrySource(self.path, page_size=4)) == 21
+        assert len(mpdb.collection.distinct("entry_id")) == mpdb.collection.count_documents({}) == 25
+
+    def test_json_list_source(self):
+        path = os.path.join(self.tmpdir.name, "entries.json")
+        with open(path, "w") as f:
+            json.dump([e.as_dict() for e in make_entries(5)], f)
+        pages = list(LocalEntrySource(path, page_size=2).pages())
+        assert [k for k, _ in pages] == ["entries.json:0", "entries.json:2", "entries.json:4"]
+
+    def test_sync(self):
+        mpdb = MPDB()
+        entries = make_entries(6)
+        mpdb.create(source=ListSource(entries))
+        # mp-5 is removed, mp-1 is recomputed and mp-6 is new.
+        entries = make_entries(7)
+        del entries[5]
+        entries[1] = ComputedStructureEntry(entries[1].structure, -100.0, entry_id="mp-1")
+        diff = mpdb.sync(source=ListSource(entries), chunk_size=2)
+        assert diff == {"added": ["mp-6"], "updated": ["mp-1"], "deleted": ["mp-5"], "unchanged": 4}
+        assert sorted(mpdb.collection.distinct("entry_id")) == sorted(e.entry_id for e in entries)
+        assert mpdb.collection.find_one({"entry_id": "mp-1"})["energy"] == -100.0
+        generation = get_generation(mpdb.db, "entries")
+        assert generation > 0
+        assert mpdb.sync(source=ListSource(entries))["unchanged"] == 6
+        assert get_generation(mpdb.db, "entries") == generation
+        # A source narrowed by criteria does not delete the other entries by default.
+        diff = mpdb.sync("Li-O", source=ListSource(entries[:2]))
+        assert diff["deleted"] == []
+        assert mpdb.collection.count_documents({}) == 6
+
+    def test_get_entries_in_chemsys(self):
+        mpdb = MPDB()
+        entries = make_entries(6)
+        for e in entries:
+            e.data.update(band_gap=1.0, blob=list(range(100)))
+        mpdb.create(source=ListSource(entries))
+        light = mpdb.get_entries_in_chemsys("Fe-O", inc_structure=False, property_data=["band_gap"])
+        assert [type(e) for e in light] == [ComputedEntry] * 3
+        assert light[0].data == {"band_gap": 1.0}
+        full = mpdb.get_entries_in_chemsys(["O", "Fe"], batch_size=2, ncpus=2)
+        assert all(isinstance(e, ComputedStructureEntry) for e in full)
+        assert sorted(e.energy for e in full) == sorted(e.energy for e in light) == [-15.0, -13.0, -11.0]
+        assert sorted(full[0].data) == ["band_gap", "blob"]
+
+    def test_get_phase_diagram(self):
+        mpdb = MPDB(pd_cache_size=1)
+        lattice = Lattice.cubic(3)
+        refs = [
+            ComputedStructureEntry(Structure(lattice, [el], [[0, 0, 0]]), -1.0, entry_id=f"mp-{el}")
+            for el in ("Li", "Fe", "O")
+        ]
+        mpdb.create(source=ListSource(refs + make_entries(4)))
+        pd = mpdb.get_phase_diagram("O-Li")
+        assert {e.entry_id for e in pd.stable_entries} == {"mp-Li", "mp-O", "mp-2"}
+        assert mpdb.get_phase_diagram(["Li", "O"]) is pd
+        assert mpdb.phase_diagrams.count_documents({}) == 1
+
+        # Evicted from memory, but loaded from the persisted copy.
+        mpdb.get_phase_diagram("Fe-O")
+        assert mpdb.get_phase_diagram("Li-O") is not pd
+        assert mpdb.phase_diagrams.count_documents({}) == 2
+
+        # A change in a subsystem invalidates the cached diagram.
+        new = ComputedStructureEntry(Structure(lattice, ["O"], [[0, 0, 0]]), -5.0, entry_id="mp-O2")
+        mpdb.sync(source=ListSource([new]), delete=False)
+        assert {e.entry_id for e in mpdb.get_phase_diagram("Li-O").stable_entries} == {"mp-Li", "mp-O2", "mp-2"}
+
+        assert mpdb.warm_phase_diagrams(["Li-O", "Fe-O", "Fe-Li-O"], ncpus=2) == ["Fe-Li-O", "Fe-O"]
+        assert mpdb.warm_phase_diagrams(["Fe-Li-O"], ncpus=2) == []
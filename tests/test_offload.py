@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import unittest
+
+import bson
+import mongomock
+import mongomock.gridfs
+
+from pymatgen.db.offload import OffloadResolver, is_ref, offload_large_fields
+from pymatgen.db.query_engine import QueryEngine
+
+mongomock.gridfs.enable_gridfs_integration()
+
+
+class OffloadTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = mongomock.MongoClient()
+        self.db = self.conn["vasp"]
+        steps = [{"e_fr_energy": -1.0 * i, "forces": [[0.1 * i] * 3] * 8} for i in range(200)]
+        self.doc = {
+            "task_id": 1,
+            "state": "successful",
+            "pretty_formula": "Li2O",
+            "calculations": [{"output": {"ionic_steps": steps, "final_energy": -14.3}}],
+            "output": {"final_energy": -14.3},
+        }
+        self.steps = steps
+
+    def test_offload(self):
+        doc = bson.decode(bson.encode(self.doc))
+        paths = offload_large_fields(doc, self.db, threshold=10000, exclude=("task_id",))
+        assert paths == ["calculations.0.output.ionic_steps"]
+        assert is_ref(doc["calculations"][0]["output"]["ionic_steps"])
+        assert doc["calculations"][0]["output"]["final_energy"] == -14.3
+        assert len(bson.encode(doc)) < 10000
+        assert offload_large_fields(dict(self.doc), self.db, threshold=len(bson.encode(self.doc))) == []
+
+    def test_query(self):
+        doc = dict(self.doc)
+        offload_large_fields(doc, self.db, threshold=10000)
+        self.db.tasks.insert_one(doc)
+        qe = QueryEngine(connection=self.conn, offload_fs="offload_fs")
+        resolver = next(f for f in qe.result_post if isinstance(f, OffloadResolver))
+
+        r = qe.query_one(["energy", "pretty_formula"], {"task_id": 1})
+        assert r == {"energy": -14.3, "pretty_formula": "Li2O"}
+        assert resolver._fs is None  # nothing read from gridfs
+
+        r = qe.query_one(["calculations"], {"task_id": 1})
+        assert r["calculations"][0]["output"]["ionic_steps"] == self.steps
+        r = qe.query_one(["calculations.output.ionic_steps"], {"task_id": 1})
+        assert r["calculations.output.ionic_steps"] == [self.steps]
+        # Paths inside an offloaded field are not resolved.
+        r = qe.query_one(["calculations.output.ionic_steps.e_fr_energy"], {"task_id": 1})
+        assert r["calculations.output.ionic_steps.e_fr_energy"] == [None]
+
+    def test_opt_in(self):
+        doc = dict(self.doc)
+        offload_large_fields(doc, self.db, threshold=10000)
+        self.db.tasks.insert_one(doc)
+        result_post = []
+        qe = QueryEngine(connection=self.conn, result_post=result_post)
+        assert qe.result_post == []
+        r = qe.query_one(["calculations.output.ionic_steps"], {"task_id": 1})
+        assert is_ref(r["calculations.output.ionic_steps"][0])
+        qe = QueryEngine(connection=self.conn, result_post=result_post, offload_fs="offload_fs")
+        assert result_post == []
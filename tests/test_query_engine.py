@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import datetime
 import os
 import unittest
 import uuid
@@ -7,7 +8,8 @@ import uuid
 import bson
 import pymongo
 
-from pymatgen.db.query_engine import QueryEngine, QueryResults
+from pymatgen.db.config import DBConfig
+from pymatgen.db.query_engine import QueryEngine, QueryResults, _compile_mapping, make_read_preference
 from tests import common
 
 has_mongo = common.has_mongo()
@@ -64,3 +66,256 @@ class QueryResultsTest(unittest.TestCase):
                 assert isinstance(_elt, list)
                 for n in _elt:
                     assert isinstance(n, float)
+
+
+class MappingTest(unittest.TestCase):
+    def test_compiled_mapping(self):
+        docs = [
+            {"task_id": 1, "output": {"final_energy": -1.5, "crystal": {"lattice": {"a": 3.0}}}, "state": "successful"},
+            {"task_id": 2, "output": {"final_energy": None}},
+            {"calculations": [{"output": {"final_energy": 1.0}}, {"output": {}}, {"input": 1}]},
+            {"calculations": [[{"output": {"final_energy": 1.0}}], []], "output": [{"crystal": {"lattice": {}}}]},
+            {},
+        ]
+        properties = [
+            ["task_id", "state"],
+            [
+                "task_id",
+                "output.final_energy",
+                "output.crystal.lattice.a",
+                "output",
+                "calculations.output.final_energy",
+            ],
+            ["calculations", "calculations.input", "calculations.output"],
+        ]
+        for props in properties:
+            prop_dict = {p: p.split(".") for p in props}
+            mapper = _compile_mapping(prop_dict)
+            for doc in docs:
+                expected = {
+                    k: QueryResults._mapped_result_path(v[1:], doc[v[0]]) if v[0] in doc else None
+                    for k, v in prop_dict.items()
+                }
+                result = mapper(doc)
+                assert result == expected
+                assert list(result) == props
+
+
+class FindDuplicatesTest(unittest.TestCase):
+    def test_find_duplicates(self):
+        import mongomock
+
+        from pymatgen.db.synth import TaskDocGenerator, insert_docs
+
+        conn = mongomock.MongoClient()
+        docs = TaskDocGenerator(elements={"Li": 1, "O": 1}, nelements=(2, 2), nsites=(2, 4)).generate(6, seed=1)
+        # Two more tasks of the first structure, computed in other directories.
+        for i in range(2):
+            dup = {k: v for k, v in docs[0].items() if k != "_id"}
+            dup["dir_name"] = f"{dup['dir_name']}/{i}"
+            docs.append(dup)
+        insert_docs(conn["vasp"], docs)
+        qe = QueryEngine(connection=conn)
+
+        clusters = qe.find_duplicates()
+        assert len(clusters) >= 1
+        first = qe.collection.find_one({"dir_name": docs[0]["dir_name"]})
+        cluster = next(c for c in clusters if first["task_id"] in c["task_ids"])
+        assert len(cluster["task_ids"]) == 3
+        assert cluster["fingerprint"] == first["fingerprint"]
+        assert qe.find_duplicates({"task_id": {"$ne": first["task_id"]}})
+
+
+class ReadPreferenceTest(unittest.TestCase):
+    def setUp(self):
+        import mongomock
+
+        # mongomock caches databases, so none may be opened before the QueryEngine sets its options.
+        self.conn = mongomock.MongoClient()
+
+    def test_make_read_preference(self):
+        rp = make_read_preference("secondary_preferred", tag_sets=[{"nodeType": "ANALYTICS"}, {}], max_staleness=120)
+        assert rp.mongos_mode == "secondaryPreferred"
+        assert rp.tag_sets == [{"nodeType": "ANALYTICS"}, {}]
+        assert rp.max_staleness == 120
+        assert make_read_preference(rp) is rp
+        with self.assertRaises(ValueError):
+            make_read_preference("tertiary")
+        with self.assertRaises(ValueError):
+            make_read_preference("primary", tag_sets=[{"dc": "east"}])
+
+    def test_options(self):
+        qe = QueryEngine(connection=self.conn, read_preference="nearest", read_concern="majority")
+        qe.collection.insert_one({"task_id": 1, "state": "successful"})
+        assert qe.db.read_preference.mongos_mode == "nearest"
+        assert qe.db.read_concern.level == "majority"
+
+        analytics = qe.with_options("secondary", tag_sets=[{"nodeType": "ANALYTICS"}])
+        assert analytics.db.read_preference.tag_sets == [{"nodeType": "ANALYTICS"}]
+        assert analytics.db.read_concern.level == "majority"
+        assert qe.db.read_preference.mongos_mode == "nearest"
+        assert analytics.query_one(["task_id"])["task_id"] == 1
+        assert qe.query_one(["task_id"], read_preference="secondary")["task_id"] == 1
+
+    def test_config(self):
+        cfg = DBConfig(config_dict={"read_preference": "secondary", "max_staleness": 90, "max_pool_size": 10})
+        assert cfg.read_preference == "secondary"
+        assert cfg.connection_options == {"read_preference": "secondary", "max_staleness": 90, "max_pool_size": 10}
+        qe = QueryEngine(connection=self.conn, **cfg.connection_options)
+        assert qe.db.read_preference.max_staleness == 90
+
+
+class ScanTest(unittest.TestCase):
+    def setUp(self):
+        import mongomock
+
+        self.qe = QueryEngine(connection=mongomock.MongoClient())
+        docs = [{"task_id": i, "state": "successful", "energy": -float(i)} for i in range(10)]
+        self.qe.collection.insert_many(docs)
+
+    def test_cursor_options(self):
+        results = self.qe.query(["task_id"], {}, batch_size=3, exhaust=True, allow_disk_use=True, sort=[("task_id", 1)])
+        assert [r["task_id"] for r in results] == list(range(10))
+        after_id = self.qe.collection.find_one({"task_id": 3})["_id"]
+        results = self.qe.query(["task_id"], {"task_id": {"$lt": 8}}, after_id=after_id, sort=[("_id", 1)])
+        assert [r["task_id"] for r in results] == [4, 5, 6, 7]
+
+    def test_scan(self):
+        scan = self.qe.scan(["task_id"], {"task_id": {"$lt": 8}}, batch_size=3)
+        assert [r["task_id"] for r in scan] == list(range(8))
+        assert scan.last_id == self.qe.collection.find_one({"task_id": 7})["_id"]
+        resume_after = self.qe.collection.find_one({"task_id": 3})["_id"]
+        scan = self.qe.scan(["task_id"], {"task_id": {"$lt": 8}}, resume_after=resume_after)
+        assert [r["task_id"] for r in scan] == [4, 5, 6, 7]
+        with self.assertRaises(ValueError):
+            self.qe.scan(["task_id"], sort=[("task_id", 1)])
+
+    def test_scan_resume(self):
+        query = self.qe.query
+
+        def flaky_query(*args, **kwargs):
+            # The first cursor is killed after 4 results.
+            results = query(*args, **kwargs)
+            if flaky_query.calls == 0:
+                docs = list(results._results)
+
+                def killed():
+                    yield from docs[:4]
+                    raise pymongo.errors.CursorNotFound("cursor id not found")
+
+                results._results = killed()
+            flaky_query.calls += 1
+            return results
+
+        flaky_query.calls = 0
+        self.qe.query = flaky_query
+        scan = self.qe.scan(["task_id", "energy"], {})
+        assert [r["task_id"] for r in scan] == list(range(10))
+        assert scan.nretries == 1
+
+
+class ChangesTest(unittest.TestCase):
+    def setUp(self):
+        import mongomock
+
+        self.qe = QueryEngine(connection=mongomock.MongoClient())
+        self.t0 = datetime.datetime(2024, 1, 1)
+        # Pairs of tasks updated at the same time, and one without last_updated.
+        docs = [
+            {"task_id": i, "state": "successful", "last_updated": self.t0 + datetime.timedelta(seconds=i // 2)}
+            for i in range(10)
+        ]
+        self.qe.collection.insert_many([*docs, {"task_id": 10, "state": "successful"}])
+
+    def test_query_since(self):
+        changes = self.qe.query_since(None, ["task_id"], {})
+        assert [r["task_id"] for r in changes] == list(range(10))
+        mark = changes.high_water_mark
+        assert mark["last_updated"] == self.t0 + datetime.timedelta(seconds=4)
+        assert list(self.qe.query_since(mark, ["task_id"], {})) == []
+
+        # Resume between tasks with the same last_updated.
+        doc = self.qe.collection.find_one({"task_id": 4})
+        mark = {"last_updated": doc["last_updated"], "_id": doc["_id"]}
+        assert [r["task_id"] for r in self.qe.query_since(mark, ["task_id"])] == [5, 6, 7, 8, 9]
+        assert [r["task_id"] for r in self.qe.query_since(self.t0, ["task_id"])] == list(range(2, 10))
+        with self.assertRaises(ValueError):
+            self.qe.query_since(None, ["task_id"], sort=[("task_id", 1)])
+
+    def test_iter_changes(self):
+        batches = list(self.qe.iter_changes(None, ["task_id"], batch_size=4))
+        assert [[r["task_id"] for r in batch] for batch, _ in batches] == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+        mark = batches[-1][1]
+        assert list(self.qe.iter_changes(mark, ["task_id"])) == []
+        self.qe.collection.update_one(
+            {"task_id": 3}, {"$set": {"last_updated": self.t0 + datetime.timedelta(seconds=10)}}
+        )
+        ((batch, mark),) = self.qe.iter_changes(mark, ["task_id"])
+        assert [r["task_id"] for r in batch] == [3]
+        assert mark["_id"] == self.qe.collection.find_one({"task_id": 3})["_id"]
+
+
+class ParallelQueryTest(unittest.TestCase):
+    def setUp(self):
+        import mongomock
+
+        self.qe = QueryEngine(connection=mongomock.MongoClient())
+        docs = [{"task_id": i, "state": "successful", "output": {"final_energy": -float(i)}} for i in range(100)]
+        self.qe.collection.insert_many(docs)
+
+    def test_parallel_query(self):
+        for split_key, split_method in [
+            ("_id", "sample"),
+            ("task_id", "sample"),
+            ("_id", "bounds"),
+            ("task_id", "bounds"),
+        ]:
+            results = list(
+                self.qe.parallel_query(
+                    ["task_id", "energy"],
+                    {"task_id": {"$gte": 10}},
+                    nworkers=4,
+                    split_key=split_key,
+                    split_method=split_method,
+                )
+            )
+            assert sorted(r["task_id"] for r in results) == list(range(10, 100))
+            assert all(r["energy"] == -r["task_id"] for r in results)
+
+    def test_parallel_query_missing_and_mixed_keys(self):
+        def count(split_method):
+            results = self.qe.parallel_query(
+                ["task_id"], {}, nworkers=4, split_key="task_id", split_method=split_method
+            )
+            return len(list(results))
+
+        self.qe.collection.insert_many([{"state": "successful"}, {"task_id": None, "state": "successful"}])
+        assert count("sample") == count("bounds") == 102
+        self.qe.collection.insert_many([{"task_id": f"mp-{i}", "state": "successful"} for i in range(10)])
+        assert count("sample") == 112
+        assert self.qe._split_points({}, 4, "task_id", sample_size=500) == [25, 50, 75]
+
+    def test_split_points(self):
+        points = self.qe._split_points({}, 4, "task_id", "bounds")
+        assert points == [24, 49, 74]
+        assert len(self.qe._split_points({}, 4, "task_id", sample_size=50)) <= 3
+        assert self.qe._split_points({}, 1, "task_id") == []
+        assert len(self.qe._split_points({}, 4, "energy", sample_size=500)) == 3
+        points = self.qe._split_points({}, 4, "energy", "bounds")
+        assert points == [-74.25, -49.5, -24.75]
+        results = self.qe.parallel_query(["task_id"], {}, nworkers=4, split_key="energy", split_method="bounds")
+        assert sorted(r["task_id"] for r in results) == list(range(100))
+
+    def test_errors_and_early_exit(self):
+        with self.assertRaises(ValueError):
+            list(self.qe.parallel_query(["task_id"], {}, split_method="median"))
+        results = self.qe.parallel_query(["task_id"], {}, nworkers=3)
+        assert next(results)["task_id"] in range(100)
+        results.close()
+
+        def fail(doc):
+            raise RuntimeError("bad doc")
+
+        self.qe.result_post.append(fail)
+        with self.assertRaises(RuntimeError):
+            list(self.qe.parallel_query(["task_id"], {}, nworkers=2))
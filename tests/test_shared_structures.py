@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import multiprocessing
+import pickle
+import unittest
+
+import mongomock
+import numpy as np
+
+from pymatgen.core import Lattice, Structure
+from pymatgen.db.query_engine import QueryEngine
+from pymatgen.db.shared_structures import StructureArrays
+from pymatgen.db.synth import TaskDocGenerator, insert_docs
+
+
+def _volume(shared, i):
+    return shared.attach().structure(i).volume
+
+
+class StructureArraysTest(unittest.TestCase):
+    def setUp(self):
+        self.structures = [
+            Structure(Lattice.cubic(4.2), ["Li", "O"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+            Structure(Lattice.hexagonal(3, 5), ["Fe2+", "O2-", "O2-"], [[0, 0, 0], [0.3, 0.3, 0.5], [0.6, 0.6, 0.5]]),
+        ]
+
+    def check(self, arrays, ids):
+        assert len(arrays) == 2
+        assert arrays.ids is not None
+        assert list(arrays.ids) == ids
+        for s, t in zip(self.structures, arrays, strict=True):
+            assert s == t
+            assert [str(sp) for sp in s.species] == [str(sp) for sp in t.species]
+
+    def test_roundtrip(self):
+        arrays = StructureArrays.from_structures(self.structures, ids=[1, 2])
+        self.check(arrays, [1, 2])
+        assert arrays.species_names(1) == ["Fe2+", "O2-", "O2-"]
+        dicts = StructureArrays.from_dicts([s.as_dict() for s in self.structures], ids=[1, 2])
+        for k in ("lattices", "offsets", "frac_coords", "species"):
+            assert np.array_equal(getattr(arrays, k), getattr(dicts, k))
+        assert dicts.species_table == arrays.species_table
+        disordered = Structure(Lattice.cubic(3), [{"Li": 0.5, "Na": 0.5}], [[0, 0, 0]])
+        with self.assertRaises(ValueError):
+            StructureArrays.from_structures([disordered])
+        with self.assertRaises(ValueError):
+            StructureArrays.from_dicts([disordered.as_dict()])
+
+    def test_share(self):
+        for ids in ([1, 2], ["mp-1", "mp-2"]):
+            with StructureArrays.from_structures(self.structures, ids=ids).share() as shared:
+                handle = pickle.loads(pickle.dumps(shared))
+                assert len(handle) == 2
+                arrays = handle.attach()
+                assert handle.attach() is arrays
+                assert not arrays.frac_coords.flags.writeable
+                self.check(arrays, ids)
+                del arrays
+                handle.close()
+
+    def test_pool(self):
+        volumes = [s.volume for s in self.structures] * 10
+        with StructureArrays.from_structures(self.structures * 10).share() as shared:
+            with multiprocessing.Pool(2) as pool:
+                result = pool.starmap(_volume, [(shared, i) for i in range(len(shared))])
+        assert np.allclose(result, volumes)
+
+    def test_from_query(self):
+        conn = mongomock.MongoClient()
+        generator = TaskDocGenerator(elements={"Li": 1, "O": 1}, nelements=(2, 2), nsites=(2, 4))
+        insert_docs(conn["vasp"], generator.generate(5, seed=0))
+        qe = QueryEngine(connection=conn)
+        arrays = StructureArrays.from_query(qe, {}, sort=[("task_id", 1)])
+        docs = list(qe.query(["task_id", "output.crystal"], {}, sort=[("task_id", 1)]))
+        assert list(arrays.ids) == [d["task_id"] for d in docs]
+        for s, d in zip(arrays, docs, strict=True):
+            assert s == Structure.from_dict(d["output.crystal"])
+
+
+if __name__ == "__main__":
+    unittest.main()
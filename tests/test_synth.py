@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import unittest
+
+import mongomock
+import mongomock.gridfs
+
+from pymatgen.db.query_engine import QueryEngine
+from pymatgen.db.synth import TaskDocGenerator, insert_docs
+from pymatgen.entries.computed_entries import ComputedStructureEntry
+
+mongomock.gridfs.enable_gridfs_integration()
+
+
+class TaskDocGeneratorTest(unittest.TestCase):
+    def setUp(self):
+        self.generator = TaskDocGenerator(
+            elements={"Li": 1, "Fe": 1, "O": 2}, nelements=(2, 3), nsites=(3, 6), dos_npoints=21
+        )
+
+    def test_generate(self):
+        docs = self.generator.generate(5, seed=0)
+        assert len(docs) == 5
+        for d in docs:
+            assert set(d["elements"]) <= {"Li", "Fe", "O"}
+            assert 2 <= d["nelements"] <= 3
+            assert 3 <= d["nsites"] <= 6
+            assert d["chemsys"] == "-".join(sorted(d["elements"]))
+            assert d["output"]["final_energy"] == d["calculations"][-1]["output"]["final_energy"]
+            assert len(d["calculations"][-1]["output"]["ionic_steps"]) == 3
+            assert len(d["calculations"][-1]["dos"]["energies"]) == 21
+            assert d["spacegroup"]["number"] == 1
+
+    def test_reproducible(self):
+        d1 = self.generator.generate(1, seed=42)[0]
+        d2 = self.generator.generate(1, seed=42)[0]
+        assert d1["dir_name"] == d2["dir_name"]
+        assert d1["output"]["crystal"] == d2["output"]["crystal"]
+
+    def test_insert_and_query(self):
+        conn = mongomock.MongoClient()
+        docs = self.generator.generate(4, seed=1)
+        assert insert_docs(conn["vasp"], docs, compress_dos=1) == 4
+        assert sorted(d["task_id"] for d in docs) == [1, 2, 3, 4]
+        coll = conn["vasp"]["tasks"]
+        assert coll.count_documents({}) == 4
+        calc = coll.find_one()["calculations"][-1]
+        assert "dos" not in calc
+        assert calc["dos_compression"] == "zlib"
+
+        qe = QueryEngine(connection=conn)
+        entries = qe.get_entries({}, inc_structure=True)
+        assert len(entries) == 4
+        assert all(isinstance(e, ComputedStructureEntry) for e in entries)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import tempfile
+import unittest
+
+import mongomock
+import numpy as np
+
+from pymatgen.db.query_engine import QueryEngine
+from pymatgen.db.synth import TaskDocGenerator, insert_docs
+from pymatgen.db.tasktable import DEFAULT_COLUMNS, TaskTable
+
+
+class TaskTableTest(unittest.TestCase):
+    def setUp(self):
+        conn = mongomock.MongoClient()
+        generator = TaskDocGenerator(elements={"Li": 2, "Fe": 1, "O": 2}, nsites=(2, 6))
+        insert_docs(conn["vasp"], generator.generate(50, seed=0))
+        self.qe = QueryEngine(connection=conn)
+        self.results = list(self.qe.query(list(DEFAULT_COLUMNS), {}, sort=[("task_id", 1)]))
+        self.table = TaskTable.from_query(self.qe, {}, chunk_size=7, sort=[("task_id", 1)])
+
+    def test_from_query(self):
+        table = self.table
+        assert len(table) == 50
+        assert table.columns == list(DEFAULT_COLUMNS)
+        assert table["task_id"].dtype == np.int64
+        assert list(table["task_id"]) == [r["task_id"] for r in self.results]
+        assert list(table["pretty_formula"]) == [r["pretty_formula"] for r in self.results]
+        assert table.codes("pretty_formula").dtype == np.int32
+        assert len(table.categories("pretty_formula")) == len({r["pretty_formula"] for r in self.results})
+        # Synthetic tasks have no e_above_hull.
+        assert table.isna("analysis.e_above_hull").all()
+        assert not table.isna("analysis.bandgap").any()
+        assert table.row(0) == self.results[0]
+        assert table.nbytes == 50 * 42
+
+    def test_filter_and_sort(self):
+        table = self.table
+        formula = self.results[0]["pretty_formula"]
+        low = table.filter(table["energy_per_atom"] < -3, pretty_formula=[formula, "XeF6"])
+        expected = [r["task_id"] for r in self.results if r["energy_per_atom"] < -3 and r["pretty_formula"] == formula]
+        assert list(low["task_id"]) == expected
+        assert len(table.filter(**{"spacegroup.number": 1})) == 50
+
+        by_energy = table.sort("energy_per_atom", descending=True)
+        assert list(by_energy["energy_per_atom"]) == sorted((r["energy_per_atom"] for r in self.results), reverse=True)
+        by_formula = table.sort(["pretty_formula", "task_id"])
+        expected = sorted(self.results, key=lambda r: (r["pretty_formula"], r["task_id"]))
+        assert list(by_formula["task_id"]) == [r["task_id"] for r in expected]
+
+    def test_groupby_missing(self):
+        missing = np.iinfo(np.int32).min
+        table = TaskTable(
+            {
+                "g": np.array([0, 0, 1, 1, 1], dtype=np.int32),
+                "n": np.array([4, missing, missing, 2, 6], dtype=np.int32),
+                "f": np.array([1, 0, -1, 1, 0], dtype=np.int32),
+            },
+            categories={"g": ["x", "y"], "f": ["a", "b"]},
+        )
+        groups = table.groupby(
+            "g",
+            mn=("n", "min"),
+            mx=("n", "max"),
+            total=("n", "sum"),
+            avg=("n", "mean"),
+            idx=("n", "idxmin"),
+            f=("f", "first"),
+        )
+        assert list(groups["g"]) == ["x", "y"]
+        assert list(groups["mn"]) == [4, 2]
+        assert list(groups["mx"]) == [4, 6]
+        assert list(groups["total"]) == [4, 8]
+        assert list(groups["avg"]) == [4, 4]
+        assert list(groups["idx"]) == [0, 3]
+        assert list(groups["f"]) == ["b", None]
+
+    def test_sort_ties_and_missing(self):
+        missing = np.iinfo(np.int32).min
+        table = TaskTable(
+            {
+                "i": np.arange(6),
+                "n": np.array([2, missing, 1, 2, missing, 1], dtype=np.int32),
+                "e": np.array([1.0, np.nan, 2.0, 1.0, 3.0, np.nan]),
+                "f": np.array([1, -1, 0, 1, 0, -1], dtype=np.int32),
+            },
+            categories={"f": ["a", "b"]},
+        )
+        assert list(table.sort("n")["i"]) == [2, 5, 0, 3, 1, 4]
+        assert list(table.sort("n", descending=True)["i"]) == [0, 3, 2, 5, 1, 4]
+        assert list(table.sort("e", descending=True)["i"]) == [4, 2, 0, 3, 1, 5]
+        assert list(table.sort("f", descending=True)["i"]) == [0, 3, 2, 4, 1, 5]
+        assert list(table.sort(["n", "e"], descending=True)["i"]) == [0, 3, 2, 5, 4, 1]
+
+    def test_groupby(self):
+        groups = self.table.groupby(
+            "pretty_formula",
+            n=("task_id", "count"),
+            emin=("energy_per_atom", "min"),
+            gap=("analysis.bandgap", "mean"),
+            idx=("energy_per_atom", "idxmin"),
+            hull=("analysis.e_above_hull", "min"),
+        )
+        assert list(groups["pretty_formula"]) == sorted({r["pretty_formula"] for r in self.results})
+        for i, formula in enumerate(groups["pretty_formula"]):
+            rows = [r for r in self.results if r["pretty_formula"] == formula]
+            assert groups["n"][i] == len(rows)
+            assert groups["emin"][i] == min(r["energy_per_atom"] for r in rows)
+            assert np.isclose(groups["gap"][i], np.mean([r["analysis.bandgap"] for r in rows]))
+            assert self.table["energy_per_atom"][groups["idx"][i]] == groups["emin"][i]
+        assert np.isnan(groups["hull"]).all()
+        with self.assertRaises(ValueError):
+            self.table.groupby("pretty_formula", x=("nsites", "median"))
+
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            table = TaskTable.from_query(self.qe, {}, chunk_size=7, spill_dir=tmpdir, sort=[("task_id", 1)])
+            assert isinstance(table.codes("pretty_formula"), np.memmap)
+            for name in table.columns:
+                assert np.array_equal(table[name], self.table[name], equal_nan=name != "pretty_formula")
+            self.table.filter(nsites=[2, 3]).save(tmpdir + "/small")
+            small = TaskTable.load(tmpdir + "/small", mmap_mode=None)
+            assert list(small["task_id"]) == [r["task_id"] for r in self.results if r["nsites"] in (2, 3)]
+            del table
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,20 +12,28 @@ __email__ = "shyue@mit.edu"
 __date__ = "Mar 5, 2012"
 
 import os
+import tempfile
 import unittest
 
+import mongomock
+from monty.io import zopen
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
 
+from pymatgen.alchemy.materials import TransformedStructure
 from pymatgen.apps.borg.queen import BorgQueen
+from pymatgen.core import Lattice, Structure
+from pymatgen.db.alchemy.sinks import MongoStructureSink
+from pymatgen.db.alchemy.transmuters import QeTransmuter, StreamingQeTransmuter
+from pymatgen.db.cache import get_generation
+from pymatgen.db.creator import VaspToDbTaskDrone
+from pymatgen.db.fingerprint import fingerprint_neighbors, make_fingerprint, structure_fingerprint
+from pymatgen.db.query_engine import QueryEngine
 from pymatgen.transformations.standard_transformations import (
     OxidationStateDecorationTransformation,
     PartialRemoveSpecieTransformation,
     SubstitutionTransformation,
 )
-from pymatgen.db.alchemy.transmuters import QeTransmuter
-from pymatgen.db.creator import VaspToDbTaskDrone
-from pymatgen.db.query_engine import QueryEngine
 
 test_dir = os.path.join(os.path.dirname(__file__), "test_files")
 
@@ -65,3 +73,75 @@ class QeTransmuterTest(unittest.TestCase):
     def tearDownClass(cls):
         if cls.conn is not None:
             cls.conn.drop_database("qetransmuter_unittest")
+
+
+class StreamingQeTransmuterTest(unittest.TestCase):
+    def setUp(self):
+        from pymatgen.db.synth import TaskDocGenerator, insert_docs
+
+        conn = mongomock.MongoClient()
+        generator = TaskDocGenerator(elements={"Li": 1, "Zn": 1, "O": 1}, nelements=(3, 3), nsites=(4, 6))
+        insert_docs(conn["vasp"], generator.generate(7, seed=0))
+        self.qe = QueryEngine(connection=conn)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_stream(self):
+        trans = [SubstitutionTransformation({"Zn": "Mg"})]
+        transmuter = StreamingQeTransmuter(self.qe, {}, trans, chunk_size=3)
+        structures = list(transmuter)
+        assert len(structures) == 7
+        for ts in structures:
+            assert "Zn" not in ts.final_structure.composition
+            assert isinstance(ts.history[0]["task_id"], int)
+            assert "entry" not in ts.history[0]
+
+    def test_write_json(self):
+        path = os.path.join(self.tmpdir.name, "ts.jsonl.gz")
+        trans = [SubstitutionTransformation({"Zn": "Mg"})]
+        transmuter = StreamingQeTransmuter(self.qe, {"nsites": {"$lt": 6}}, trans, ncores=2, chunk_size=2)
+        n = transmuter.write_json(path)
+        with zopen(path, "rt") as f:
+            assert len(f.readlines()) == n == self.qe.collection.count_documents({"nsites": {"$lt": 6}})
+
+    def test_write_to_collection(self):
+        target = mongomock.MongoClient()["vasp"]["candidates"]
+        trans = [SubstitutionTransformation({"Zn": "Mg"})]
+        transmuter = StreamingQeTransmuter(self.qe, {}, trans, ncores=2, chunk_size=3)
+        sink = transmuter.write_to_collection(target, batch_size=4)
+        assert sink.ninserted + sink.nduplicates == 7
+        assert target.count_documents({}) == sink.ninserted
+        assert get_generation(target.database, "candidates") > 0
+        doc = target.find_one()
+        assert doc["fingerprint"].startswith(doc["pretty_formula"] + ":")
+        ts = MongoStructureSink.get_transformed_structure(doc)
+        assert "Zn" not in ts.final_structure.composition
+
+        # Running again only produces duplicates.
+        sink = transmuter.write_to_collection(target, batch_size=4)
+        assert sink.ninserted == 0
+        assert sink.nduplicates == 7
+
+
+class MongoStructureSinkTest(unittest.TestCase):
+    def test_dedupe(self):
+        lattice = Lattice.cubic(4.2)
+        s1 = Structure(lattice, ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+        s2 = s1.copy()
+        s2.scale_lattice(s1.volume * 1.02)
+        s3 = Structure(lattice, ["K", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+        collection = mongomock.MongoClient()["db"]["candidates"]
+        with MongoStructureSink(collection) as sink:
+            for s in (s1, s2, s3, s1):
+                sink.add(TransformedStructure(s, []))
+        assert (sink.ninserted, sink.nduplicates) == (2, 2)
+        assert sorted(collection.distinct("pretty_formula")) == ["KCl", "NaCl"]
+
+    def test_fingerprint(self):
+        s = Structure(Lattice.cubic(4.2), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+        fp = structure_fingerprint(s)
+        assert fp.startswith("NaCl:221:")
+        assert fp in fingerprint_neighbors(fp)
+        assert make_fingerprint("NaCl", 221, s.volume / 2) == fp
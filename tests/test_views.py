@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import datetime
+import threading
+import unittest
+
+import mongomock
+
+from pymatgen.db.query_engine import QueryEngine
+from pymatgen.db.synth import TaskDocGenerator, insert_docs
+from pymatgen.db.views import BestTaskView, GroupView, ViewWorker, view_from_dict
+
+
+def count_tasks(key, tasks):
+    return {"ntasks": len(tasks)}
+
+
+class ViewTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = mongomock.MongoClient()
+        self.db = self.conn["vasp"]
+        generator = TaskDocGenerator(elements={"Li": 1, "O": 1}, nelements=(2, 2), nsites=(2, 4))
+        self.docs = generator.generate(30, seed=0)
+        insert_docs(self.db, self.docs[:20])
+        self.qe = QueryEngine(connection=self.conn)
+        self.best = BestTaskView("ground_states", "pretty_formula", properties=["output.crystal"])
+        self.counts = GroupView("counts", "chemsys", count_tasks)
+        self.worker = ViewWorker(self.qe, [self.best, self.counts], poll_interval=0.01)
+
+    def expected_ground_states(self):
+        best = {}
+        for d in self.db.tasks.find({"state": "successful"}):
+            e = d["output"]["final_energy_per_atom"]
+            if d["pretty_formula"] not in best or e < best[d["pretty_formula"]][0]:
+                best[d["pretty_formula"]] = (e, d["task_id"])
+        return {k: v[1] for k, v in best.items()}
+
+    def check_views(self):
+        views = {d["_id"]: d["task_id"] for d in self.db.ground_states.find()}
+        assert views == self.expected_ground_states()
+        assert self.db.counts.find_one({"_id": "Li-O"})["ntasks"] == self.db.tasks.count_documents(
+            {"state": "successful"}
+        )
+
+    def test_rebuild(self):
+        self.worker.rebuild()
+        self.check_views()
+        doc = self.db.ground_states.find_one()
+        assert set(doc) >= {"task_id", "energy_per_atom", "output_crystal", "_sources"}
+
+    def test_poll(self):
+        assert self.worker.poll_once() == 0
+        self.check_views()
+        insert_docs(self.db, self.docs[20:])
+        assert self.worker.poll_once() == 10
+        self.check_views()
+        assert self.worker.poll_once() == 0
+
+        # Moving a task to another group updates both groups.
+        task = self.db.ground_states.find_one()
+        self.db.tasks.update_one(
+            {"task_id": task["task_id"]},
+            {"$set": {"pretty_formula": "LiO3", "last_updated": datetime.datetime.today()}},
+        )
+        assert self.worker.poll_once() == 1
+        self.check_views()
+
+        # State is saved.
+        worker = ViewWorker(self.qe, [self.best, self.counts])
+        assert worker.poll_once() == 0
+        assert worker.state["views"] == ["counts", "ground_states"]
+
+    def test_process_changes(self):
+        self.worker.rebuild()
+        insert_docs(self.db, self.docs[20:])
+        self.worker.process(self.docs[20:])
+        self.check_views()
+        task = self.db.ground_states.find_one()
+        deleted = self.db.tasks.find_one_and_delete({"task_id": task["task_id"]})
+        self.worker.process(deleted_ids=[deleted["_id"]])
+        self.check_views()
+
+    def test_run(self):
+        # mongomock has no change streams.
+        self.worker.rebuild()
+        stop = threading.Event()
+        thread = threading.Thread(target=self.worker.run, args=(stop, False))
+        thread.start()
+        try:
+            insert_docs(self.db, self.docs[20:])
+            for _ in range(100):
+                if self.db.counts.find_one({"_id": "Li-O"})["ntasks"] == self.db.tasks.count_documents(
+                    {"state": "successful"}
+                ):
+                    break
+                stop.wait(0.05)
+        finally:
+            stop.set()
+            thread.join()
+        self.check_views()
+
+    def test_from_dict(self):
+        for view in (self.best, self.counts):
+            assert view_from_dict(view.as_dict()).as_dict() == view.as_dict()
+
+
+if __name__ == "__main__":
+    unittest.main()